@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+'''
+Runs every Test Case of a set against every trace of a set, in parallel.
+'''
+
+import os
+import sys
+import json
+import argparse
+from tcparser import batch
+from tcparser.trace import add_trace_arguments, trace_options
+from tcparser.logs import add_logging_arguments
+from tcparser.tc_report import add_report_arguments, load_report
+from tcparser.profiling import write_chrome_trace
+
+
+def parse_args():
+    '''
+    Parses the command line.
+    :return: parsed arguments
+    '''
+    parser = argparse.ArgumentParser(prog="batch",
+                                     description="Runs every Test Case against every trace, on a pool of processes.")
+    parser.add_argument("report_dir", help="Directory where the reports are written, in a subdirectory per trace.")
+    parser.add_argument("--tcs", nargs="+", required=True, metavar="TC",
+                        help="Test Case files, glob patterns or directories.")
+    parser.add_argument("--traces", nargs="+", required=True, metavar="TRACE",
+                        help="Trace files, glob patterns or directories.")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                        help="Number of processes (default: number of CPUs, %(default)s).")
+    parser.add_argument("--summary", help="Summary file (default: <report_dir>/summary.json).")
+    add_trace_arguments(parser)
+    add_report_arguments(parser)
+    add_logging_arguments(parser)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    tcfns = batch.find_files(args.tcs, batch.TC_EXTENSIONS)
+    tracefns = batch.find_files(args.traces, batch.TRACE_EXTENSIONS)
+    os.makedirs(args.report_dir, exist_ok=True)
+    summary = batch.run_batch(tracefns, tcfns, args.report_dir, trace_options(args), project=args.project,
+                              workers=args.jobs, logging_options=(args.log_level, args.log_file, args.rule_trace),
+                              report_format=args.report_format,
+                              profile=args.profile or args.profile_trace is not None,
+                              checkpoint_dir=args.checkpoints)
+    for result in summary["results"]:
+        print("{}\t{}\t{}".format(result["result"], result["trace"], result["tc"]))
+    print("{} TCs x {} traces in {:.1f} s: {} passed, {} failed, {} errors".format(
+        summary["tcs"], summary["traces"], summary["elapsed"], summary["passed"], summary["failed"],
+        summary["errors"]))
+    if args.profile_trace:
+        write_chrome_trace(args.profile_trace, [("{} {}".format(result["tc"], result["trace"]),
+                                                 load_report(result["report"]))
+                                                for result in summary["results"] if result["report"] is not None])
+    summaryfn = args.summary or os.path.join(args.report_dir, "summary.json")
+    with open(summaryfn, "w") as summaryfile:
+        json.dump(summary, summaryfile, indent=3)
+    sys.exit(0 if summary["failed"] == 0 and summary["errors"] == 0 else 1)
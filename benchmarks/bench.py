@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+'''
+Benchmark harness.
+
+Generates synthetic IMS / VoLTE traces of the requested sizes (see generate_trace.py) and times, for each trace and
+each Trace mode, the loading of the trace, TestCase.run and the writing of the report. The peak memory of every
+scenario is recorded as well. Each scenario runs in its own process, so that peak memory figures do not mix.
+
+Results are written as JSON, and can be compared against the results of a previous release with --compare.
+'''
+
+import os
+import re
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from benchmarks.generate_trace import TraceGenerator, call_msisdns
+from tcparser.trace import Trace
+from tcparser.test_case import TestCase
+from tcparser import columns
+
+try:
+    import resource
+except ImportError:     # not available on Windows
+    resource = None
+
+TC_TEMPLATE = os.path.join(BENCH_DIR, "volte_call.json")
+
+# Trace options for every benchmarked mode
+MODES = {
+    "memory": {},
+    "stream": {"stream": True},
+    "index": {"index_protocols": True},
+    "index-fields": {"index_protocols": True, "index_fields": True},
+    "compact": {"compact": True},
+    "compact-index": {"compact": True, "index_protocols": True, "index_fields": True},
+    "cache": {"cache": True},
+    "cache-index": {"cache": True, "index_protocols": True},
+    "project": {"project": True},
+    "project-compact": {"project": True, "compact": True, "index_protocols": True},
+    "columns": {"index_protocols": True, "columns": []}
+}
+
+
+def peak_memory_mb():
+    '''
+    Gets the peak resident memory of this process.
+    :return: peak memory in MB. None if it cannot be measured on this platform.
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / (1024.0 * 1024.0)     # bytes
+    return peak / 1024.0    # KB
+
+
+def run_scenario(mode, tracefn, tcfn, reportfn):
+    '''
+    Runs a single scenario in this process.
+    :return: dict with the measurements.
+    '''
+    start = time.perf_counter()
+    test_case = TestCase(tcfn)
+    options = dict(MODES[mode])
+    if options.pop("project", False):
+        options["projection"] = test_case.get_projection()
+    trace = Trace(tracefn, **options)
+    test_case.set_trace(trace)
+    loaded = time.perf_counter()
+    test_case.run()
+    run = time.perf_counter()
+    test_case.report(reportfn)
+    reported = time.perf_counter()
+    return {
+        "load_s": loaded - start,
+        "run_s": run - loaded,
+        "report_s": reported - run,
+        "total_s": reported - start,
+        "peak_memory_mb": peak_memory_mb(),
+        "result": test_case.get_result()
+    }
+
+
+def prepare(workdir, frames, seed):
+    '''
+    Generates the trace and the TC for a trace size, unless they already exist in workdir.
+    :return: tuple (trace file, TC file)
+    '''
+    tracefn = os.path.join(workdir, "trace_{}_{}.json".format(frames, seed))
+    tcfn = os.path.join(workdir, "tc_{}_{}.json".format(frames, seed))
+    generator = TraceGenerator(frames, seed=seed)
+    if not os.path.exists(tracefn):
+        print("Generating {}".format(tracefn), file=sys.stderr)
+        with open(tracefn + ".tmp", "w") as tracefile:
+            generator.write(tracefile)
+        os.replace(tracefn + ".tmp", tracefn)
+    with open(TC_TEMPLATE, "r") as tcfp:
+        tc_description = json.load(tcfp)
+    msisdn_a, msisdn_b = call_msisdns(generator.numcalls - 1)   # last call: the whole trace is scanned
+    tc_description["variables"] = {"msisdn_a": re.escape(msisdn_a), "msisdn_b": re.escape(msisdn_b)}
+    with open(tcfn, "w") as tcfp:
+        json.dump(tc_description, tcfp, indent=2)
+    return tracefn, tcfn
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=BENCH_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baselinefn):
+    '''
+    Prints the ratio between these results and a previous run.
+    :param results: results of this run.
+    :param baselinefn: JSON results file of a previous run.
+    :return: void
+    '''
+    with open(baselinefn, "r") as basefp:
+        baseline = json.load(basefp)
+    previous = {(item["frames"], item["mode"]): item for item in baseline["results"]}
+    print("Compared with {} ({})".format(baselinefn, baseline.get("revision")))
+    print("{:>9} {:<14} {:>10} {:>10} {:>10}".format("frames", "mode", "total", "run", "memory"))
+    for item in results["results"]:
+        old = previous.get((item["frames"], item["mode"]))
+        if old is None:
+            continue
+        ratios = []
+        for key in ("total_s", "run_s", "peak_memory_mb"):
+            if item[key] and old[key]:
+                ratios.append("{:9.2f}x".format(item[key] / old[key]))
+            else:
+                ratios.append("{:>10}".format("-"))
+        print("{:>9} {:<14} {}".format(item["frames"], item["mode"], " ".join(ratios)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="bench", description="Benchmarks Trazer on synthetic IMS traces.")
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="Comma separated trace sizes, in frames (default: %(default)s).")
+    parser.add_argument("--modes", default=",".join(mode for mode in MODES if "columns" not in MODES[mode]
+                                                    or columns.numpy is not None),
+                        help="Comma separated Trace modes (default: %(default)s). \"columns\" needs NumPy.")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Runs of every scenario. The fastest one is kept (default: %(default)s).")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed of the traces (default: %(default)s).")
+    parser.add_argument("--workdir", default=os.path.join(BENCH_DIR, "work"),
+                        help="Directory for the generated traces and reports (default: %(default)s).")
+    parser.add_argument("--output", help="JSON file where the results are written.")
+    parser.add_argument("--compare", metavar="RESULTS", help="JSON results of a previous run to compare with.")
+    parser.add_argument("--worker", nargs=4, metavar=("MODE", "TRACE", "TC", "REPORT"), help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.worker is not None:
+        print(json.dumps(run_scenario(*args.worker)))
+        sys.exit(0)
+
+    os.makedirs(args.workdir, exist_ok=True)
+    results = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": []
+    }
+    modes = args.modes.split(",")
+    for mode in modes:
+        assert (mode in MODES), "Unknown mode {}. Valid modes: {}".format(mode, ", ".join(MODES))
+    print("{:>9} {:<14} {:>8} {:>8} {:>8} {:>8} {:>10} {:>7}".format("frames", "mode", "load", "run", "report",
+                                                                       "total", "memory", "result"))
+    for frames in [int(size) for size in args.sizes.split(",")]:
+        tracefn, tcfn = prepare(args.workdir, frames, args.seed)
+        for mode in modes:
+            best = None
+            for repeat in range(args.repeat):
+                reportfn = os.path.join(args.workdir, "report_{}_{}.json".format(frames, mode))
+                output = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--worker",
+                                                  mode, tracefn, tcfn, reportfn])
+                measure = json.loads(output.decode())
+                if best is None or measure["total_s"] < best["total_s"]:
+                    best = measure
+            best["frames"] = frames
+            best["mode"] = mode
+            results["results"].append(best)
+            print("{:>9} {:<14} {:8.3f} {:8.3f} {:8.3f} {:8.3f} {:>7.1f} MB {:>7}".format(
+                frames, mode, best["load_s"], best["run_s"], best["report_s"], best["total_s"],
+                best["peak_memory_mb"] or 0.0, "Passed" if best["result"] else "Failed"))
+    if args.output is not None:
+        with open(args.output, "w") as outfp:
+            json.dump(results, outfp, indent=2)
+    if args.compare is not None:
+        compare(results, args.compare)
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+'''
+Synthetic IMS / VoLTE trace generator.
+
+Writes traces with the shape of "tshark -T json --no-duplicate-keys" exports: SIP calls with nested msg_hdr_tree and
+SDP bodies, Diameter Cx and Sh transactions, and noise protocols (RTP, DNS, TCP) in between. The trace size, the share
+of noise frames and the random seed are configurable, so that the same trace can be rebuilt for every benchmark run.
+
+Every call uses the MSISDNs returned by call_msisdns(), so that a TC can target any of them.
+'''
+
+import sys
+import json
+import random
+import argparse
+
+CX_APPLICATION_ID = "16777216"
+SH_APPLICATION_ID = "16777217"
+IP_PROTOCOLS = {"udp": "17", "tcp": "6", "sctp": "132"}
+CALL_FRAMES = 14    # signalling frames generated for every call
+START_EPOCH = 1600000000.0
+CODECS = ["rtpmap:101 AMR-WB/16000", "fmtp:101 mode-set=0,1,2", "rtpmap:102 AMR/8000", "fmtp:102 mode-set=0,2,4,7",
+          "rtpmap:8 PCMA/8000", "rtpmap:116 telephone-event/16000", "ptime:20", "maxptime:240"]
+
+
+def call_msisdns(call):
+    '''
+    Gets the calling and called MSISDNs of a call.
+    :param call: index of the call inside the trace.
+    :return: tuple (msisdn_a, msisdn_b)
+    '''
+    return "+43664{:07d}".format(call), "+43676{:07d}".format(call)
+
+
+class TraceGenerator(object):
+
+    def __init__(self, numframes, noise=0.8, seed=1):
+        '''
+        :param numframes: number of frames in the trace.
+        :param noise: share of the frames that do not belong to IMS signalling.
+        :param seed: random seed.
+        '''
+        self.numframes = numframes
+        self.random = random.Random(seed)
+        self.numcalls = max(1, int(numframes * (1.0 - noise)) // CALL_FRAMES)
+
+    def __frame(self, protocols, transport, layers):
+        frame = {
+            "frame": {
+                "frame.encap_type": "1",
+                "frame.time_epoch": "",     # set when the frame is written
+                "frame.number": "",
+                "frame.len": str(self.random.randint(60, 1400)),
+                "frame.protocols": "eth:ethertype:ip:" + protocols
+            },
+            "eth": {
+                "eth.dst": "00:1b:21:3c:9d:{:02x}".format(self.random.randint(0, 255)),
+                "eth.src": "00:1b:21:3c:9e:{:02x}".format(self.random.randint(0, 255)),
+                "eth.type": "0x00000800"
+            },
+            "ip": {
+                "ip.version": "4",
+                "ip.ttl": "64",
+                "ip.proto": IP_PROTOCOLS[transport],
+                "ip.src": "10.{}.{}.{}".format(*(self.random.randint(1, 254) for i in range(3))),
+                "ip.dst": "10.{}.{}.{}".format(*(self.random.randint(1, 254) for i in range(3)))
+            }
+        }
+        frame.update(layers)
+        return {"_index": "packets-2020-09-13", "_type": "doc", "_score": None, "_source": {"layers": frame}}
+
+    def __udp(self, srcport, dstport):
+        return {"udp.srcport": str(srcport), "udp.dstport": str(dstport), "udp.port": [str(srcport), str(dstport)],
+                "udp.length": str(self.random.randint(100, 1400))}
+
+    def __tcp(self, srcport, dstport):
+        return {"tcp.srcport": str(srcport), "tcp.dstport": str(dstport), "tcp.port": [str(srcport), str(dstport)],
+                "tcp.flags": "0x00000018", "tcp.flags_tree": {"tcp.flags.push": "1", "tcp.flags.ack": "1"}}
+
+    def __sip(self, call, first_line, cseq, body=None):
+        msisdn_a, msisdn_b = call_msisdns(call)
+        call_id = "{:08x}-{}@10.18.5.64".format(call, call * 7919 % 100000)
+        headers = {
+            "sip.Via": "SIP/2.0/UDP 10.18.5.64:5060;branch=z9hG4bK{:x}".format(self.random.getrandbits(32)),
+            "sip.Via_tree": {"sip.Via.transport": "UDP", "sip.Via.sent-by.address": "10.18.5.64"},
+            "sip.From": "<tel:{}>;tag={:x}".format(msisdn_a, call),
+            "sip.From_tree": {"sip.from.addr": "tel:" + msisdn_a, "sip.from.tag": "{:x}".format(call)},
+            "sip.To": "<tel:{}>".format(msisdn_b),
+            "sip.To_tree": {"sip.to.addr": "tel:" + msisdn_b},
+            "sip.Call-ID": call_id,
+            "sip.CSeq": cseq,
+            "sip.CSeq_tree": {"sip.CSeq.seq": cseq.split()[0], "sip.CSeq.method": cseq.split()[1]},
+            "sip.P-Access-Network-Info": "3GPP-E-UTRAN-FDD; utran-cell-id-3gpp=2320100{:09d}".format(call),
+            "sip.Content-Length": "0"
+        }
+        sip = {}
+        if first_line.startswith("SIP/2.0"):
+            sip["sip.Status-Line"] = first_line
+            sip["sip.Status-Line_tree"] = {"sip.Status-Code": first_line.split()[1]}
+        else:
+            sip["sip.Request-Line"] = first_line
+            sip["sip.Request-Line_tree"] = {"sip.Method": first_line.split()[0], "sip.r-uri": first_line.split()[1]}
+        sip["sip.msg_hdr"] = "Via: ...; Call-ID: {}".format(call_id)
+        sip["sip.msg_hdr_tree"] = headers
+        if body is not None:
+            headers["sip.Content-Type"] = "application/sdp"
+            sip["sip.msg_body"] = {"sdp": {
+                "sdp.version": "0",
+                "sdp.owner": "- {} 1 IN IP4 10.18.5.64".format(call),
+                "sdp.connection_info": "IN IP4 10.18.5.64",
+                "sdp.media": "audio {} RTP/AVP 101 102 8 116".format(49152 + 2 * (call % 1000)),
+                "sdp.media_attr": body
+            }}
+        return self.__frame("udp:sip" + (":sdp" if body is not None else ""), "udp",
+                            {"udp": self.__udp(5060, 5060), "sip": sip})
+
+    def __diameter(self, call, code, application, request, avps):
+        session_id = "scscf.ims.mnc001.mcc232.3gppnetwork.org;{};{}".format(call, code)
+        avp_list = [{
+            "diameter.avp.code": "263",
+            "diameter.avp.len": str(len(session_id) + 8),
+            "diameter.avp_tree": {"diameter.Session-Id": session_id}
+        }]
+        for avp_code, name, value in avps:
+            avp_list.append({
+                "diameter.avp.code": avp_code,
+                "diameter.avp.len": str(len(value) + 8),
+                "diameter.avp_tree": {name: value}
+            })
+        diameter = {
+            "diameter.version": "0x00000001",
+            "diameter.flags": "0x000000c0" if request else "0x00000040",
+            "diameter.flags_tree": {"diameter.flags.request": "1" if request else "0"},
+            "diameter.cmd.code": str(code),
+            "diameter.applicationId": application,
+            "diameter.hopbyhopid": "0x{:08x}".format(call * 16 + code % 16),
+            "diameter.Session-Id": session_id,
+            "diameter.avp": avp_list
+        }
+        return self.__frame("sctp:diameter", "sctp",
+                            {"sctp": {"sctp.srcport": "3868", "sctp.dstport": "3868"}, "diameter": diameter})
+
+    def __noise(self):
+        kind = self.random.random()
+        if kind < 0.7:
+            seq = self.random.randint(0, 65535)
+            return self.__frame("udp:rtp", "udp", {
+                "udp": self.__udp(49152 + 2 * self.random.randint(0, 999), 50000),
+                "rtp": {"rtp.version": "2", "rtp.p_type": "101", "rtp.seq": str(seq),
+                        "rtp.timestamp": str(seq * 320), "rtp.ssrc": "0x{:08x}".format(self.random.getrandbits(32))}
+            })
+        if kind < 0.85:
+            return self.__frame("udp:dns", "udp", {
+                "udp": self.__udp(self.random.randint(1024, 65535), 53),
+                "dns": {"dns.id": "0x{:04x}".format(self.random.getrandbits(16)), "dns.flags.response": "0",
+                        "Queries": {"pcscf.ims.mnc001.mcc232.3gppnetwork.org: type NAPTR, class IN": {
+                            "dns.qry.name": "pcscf.ims.mnc001.mcc232.3gppnetwork.org", "dns.qry.type": "35"}}}
+            })
+        return self.__frame("tcp:tls", "tcp", {
+            "tcp": self.__tcp(443, self.random.randint(1024, 65535)),
+            "tls": {"tls.record": {"tls.record.content_type": "23", "tls.record.length": "1024"}}
+        })
+
+    def __call(self, call):
+        msisdn_a, msisdn_b = call_msisdns(call)
+        identity = [("601", "diameter.Public-Identity", "tel:" + msisdn_b)]
+        user_data = [("700", "diameter.User-Identity", "tel:" + msisdn_b), ("703", "diameter.Data-Reference", "17")]
+        return [
+            self.__sip(call, "INVITE tel:{} SIP/2.0".format(msisdn_b), "1 INVITE", CODECS),
+            self.__sip(call, "SIP/2.0 100 Trying", "1 INVITE"),
+            self.__diameter(call, 302, CX_APPLICATION_ID, True, identity),
+            self.__diameter(call, 302, CX_APPLICATION_ID, False, [("268", "diameter.Result-Code", "2001")]),
+            self.__diameter(call, 306, SH_APPLICATION_ID, True, user_data),
+            self.__diameter(call, 306, SH_APPLICATION_ID, False, [("268", "diameter.Result-Code", "2001")]),
+            self.__sip(call, "SIP/2.0 183 Session Progress", "1 INVITE", CODECS[:2] + CODECS[5:7]),
+            self.__sip(call, "PRACK tel:{} SIP/2.0".format(msisdn_b), "2 PRACK"),
+            self.__sip(call, "SIP/2.0 200 OK", "2 PRACK"),
+            self.__sip(call, "SIP/2.0 180 Ringing", "1 INVITE"),
+            self.__sip(call, "SIP/2.0 200 OK", "1 INVITE", CODECS[:2] + CODECS[5:7]),
+            self.__sip(call, "ACK tel:{} SIP/2.0".format(msisdn_b), "1 ACK"),
+            self.__sip(call, "BYE tel:{} SIP/2.0".format(msisdn_b), "3 BYE"),
+            self.__sip(call, "SIP/2.0 200 OK", "3 BYE")
+        ]
+
+    def frames(self):
+        '''
+        Generates the frames of the trace in order.
+        :return: generator of frames, as exported by tshark.
+        '''
+        signalling = self.numcalls * CALL_FRAMES
+        pending = []    # frames of the calls in progress
+        call = 0
+        for index in range(self.numframes):
+            remaining = self.numframes - index
+            left = signalling - (call * CALL_FRAMES - len(pending))     # signalling frames not written yet
+            if left > 0 and (left >= remaining or self.random.random() < float(left) / remaining):
+                if len(pending) == 0:
+                    pending = self.__call(call)
+                    pending.reverse()
+                    call += 1
+                frame = pending.pop()
+            else:
+                frame = self.__noise()
+            layers = frame["_source"]["layers"]
+            layers["frame"]["frame.number"] = str(index + 1)
+            layers["frame"]["frame.time_epoch"] = "{:.9f}".format(START_EPOCH + index * 0.002)
+            yield frame
+
+    def write(self, fp):
+        '''
+        Writes the trace as a JSON array, one frame at a time.
+        :param fp: text file object.
+        :return: void
+        '''
+        fp.write("[\n")
+        for index, frame in enumerate(self.frames()):
+            if index > 0:
+                fp.write(",\n")
+            fp.write(json.dumps(frame, indent=2))
+        fp.write("\n]\n")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="generate_trace", description="Generates a synthetic IMS / VoLTE trace.")
+    parser.add_argument("output", help="JSON trace file to write. Use - for the standard output.")
+    parser.add_argument("--frames", type=int, default=10000, help="Number of frames (default: %(default)s).")
+    parser.add_argument("--noise", type=float, default=0.8,
+                        help="Share of noise frames: RTP, DNS, TLS (default: %(default)s).")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed (default: %(default)s).")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    generator = TraceGenerator(args.frames, args.noise, args.seed)
+    if args.output == "-":
+        generator.write(sys.stdout)
+    else:
+        with open(args.output, "w") as tracefile:
+            generator.write(tracefile)
+    print("{} frames, {} calls".format(args.frames, generator.numcalls), file=sys.stderr)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+'''
+Trace analysis service: keeps traces loaded between Test Case runs.
+'''
+
+import os
+import sys
+import json
+import asyncio
+import argparse
+from tcparser import daemon
+from tcparser.trace import add_trace_arguments, trace_options
+from tcparser.display_filter import AUTO
+from tcparser.logs import add_logging_arguments, setup_logging
+
+
+def add_connection_arguments(parser):
+    parser.add_argument("--host", default="127.0.0.1", help="Address of the service (default: %(default)s).")
+    parser.add_argument("--port", type=int, default=daemon.DEFAULT_PORT,
+                        help="TCP port of the service (default: %(default)s).")
+    parser.add_argument("--socket", help="Unix socket of the service, instead of TCP.")
+
+
+def parse_args():
+    '''
+    Parses the command line.
+    :return: parsed arguments
+    '''
+    parser = argparse.ArgumentParser(prog="daemon",
+                                     description="Runs Test Cases against traces kept loaded by a service.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="Starts the service.")
+    add_connection_arguments(serve)
+    serve.add_argument("--memory-cap", type=int, default=daemon.DEFAULT_MEMORY_CAP, metavar="MB",
+                       help="Memory cap of the loaded traces, in MB (default: %(default)s).")
+    serve.add_argument("--workers", type=int, help="Threads that run TCs (default: number of CPUs).")
+    add_trace_arguments(serve)
+    add_logging_arguments(serve)
+    run = commands.add_parser("run", help="Runs a Test Case against a trace, loading the trace if needed.")
+    run.add_argument("tc_file", help="Test Case description file.")
+    run.add_argument("trace_file", help="JSON trace file obtained from Wireshark, or pcap / pcapng capture.")
+    run.add_argument("report_file", nargs="?", help="TC report.")
+    add_connection_arguments(run)
+    load = commands.add_parser("load", help="Loads a trace in advance.")
+    load.add_argument("trace_file", help="JSON trace file obtained from Wireshark, or pcap / pcapng capture.")
+    add_connection_arguments(load)
+    evict = commands.add_parser("evict", help="Drops a loaded trace.")
+    evict.add_argument("trace_file", help="Trace file, as it was loaded.")
+    add_connection_arguments(evict)
+    status = commands.add_parser("status", help="Lists the loaded traces.")
+    add_connection_arguments(status)
+    return parser.parse_args()
+
+
+async def serve(args):
+    service = daemon.TraceDaemon(args.memory_cap * 1048576, args.workers, trace_options(args))
+    try:
+        await service.serve(args.host, args.port, args.socket)
+    finally:
+        service.close()
+
+
+async def send(args, message):
+    '''
+    Sends a request and prints the answers.
+    :return: exit code
+    '''
+    code = 0
+    async for answer in daemon.request(message, args.host, args.port, args.socket):
+        event = answer["event"]
+        if event == "error":
+            print("Error: {}".format(answer["error"]), file=sys.stderr)
+            code = 2
+        elif event == "trace":
+            print("Trace {} {} in {:.2f} s".format(
+                answer["trace"], "loaded" if answer["loaded"] else "already loaded", answer["load_s"]))
+        elif event == "rule":
+            print("Rule {}: {}".format(answer["index"], answer["rule"].get("result")))
+        elif event == "result":
+            print("Test Case Result: {} ({:.2f} s)".format(answer["result"] == "Passed", answer["run_s"]))
+            if args.report_file is not None:
+                with open(args.report_file, "w") as report_file:
+                    json.dump(answer["report"], report_file, indent=3)
+            code = 0 if answer["result"] == "Passed" else 1
+        else:
+            print(json.dumps(answer, indent=3))
+    return code
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.command == "serve":
+        assert (args.display_filter != AUTO), "--filter auto is not supported: loaded traces are shared by all TCs"
+        setup_logging(args.log_level, args.log_file, args.rule_trace)
+        try:
+            asyncio.run(serve(args))
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+    if args.command == "run":
+        with open(args.tc_file, "r") as tc_file:
+            message = {"trace": args.trace_file, "tc": json.load(tc_file), "name": args.tc_file}
+    elif args.command == "status":
+        message = {"command": "status"}
+    else:
+        message = {"command": args.command, "trace": args.trace_file}
+    message["cwd"] = os.getcwd()     # relative paths are the client's, not the service's
+    sys.exit(asyncio.run(send(args, message)))
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+'''
+Prints the Wireshark display filter that keeps every frame that a set of Test Cases could match.
+'''
+
+import argparse
+from tcparser import test_case
+from tcparser import display_filter
+
+
+def parse_args():
+    '''
+    Parses the command line.
+    :return: parsed arguments
+    '''
+    parser = argparse.ArgumentParser(prog="display_filter",
+                                     description="Derives from Test Cases a Wireshark display filter that keeps every "
+                                                 "frame that they could match, to cut traces down before running "
+                                                 "the TCs.")
+    parser.add_argument("tc_files", nargs="+", help="Test Case description files.")
+    parser.add_argument("--tshark",
+                        help="tshark command, to read the field types (default: $TRAZER_TSHARK or tshark).")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    test_cases = [test_case.TestCase(tc_file) for tc_file in args.tc_files]
+    result = display_filter.test_cases_filter(test_cases, args.tshark)
+    print(result if result is not None else "")
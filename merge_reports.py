@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+'''
+Merges TC reports into a single file.
+'''
+
+import argparse
+from tcparser import tc_report
+from tcparser.batch import find_files
+
+
+def parse_args():
+    '''
+    Parses the command line.
+    :return: parsed arguments
+    '''
+    parser = argparse.ArgumentParser(prog="merge_reports",
+                                     description="Merges TC reports (JSON or JSON lines) into a JSON lines file, "
+                                                 "one report at a time.")
+    parser.add_argument("merged_file", help="Merged report.")
+    parser.add_argument("reports", nargs="+",
+                        help="Report files, glob patterns or directories, searched recursively (e.g. the report "
+                             "directory of batch.py).")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    reportfns = find_files(args.reports, (".json", ".ndjson"), recursive=True)
+    summary = tc_report.merge_reports(reportfns, args.merged_file)
+    print("{} reports: {} passed, {} failed, {} incomplete ({} other files skipped)".format(
+        summary["reports"], summary["Passed"], summary["Failed"], summary["Incomplete"], summary["skipped"]))
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+'''
+Runs a Test Case on every conversation of a trace (e.g. every call of a load test), in parallel.
+'''
+
+import os
+import sys
+import json
+import argparse
+from tcparser import shard
+from tcparser.trace import add_trace_arguments, add_merge_argument, trace_options, trace_files
+from tcparser.display_filter import apply_auto_filter
+from tcparser.test_case import TestCase
+from tcparser.logs import add_logging_arguments, setup_logging
+
+
+def parse_args():
+    '''
+    Parses the command line.
+    :return: parsed arguments
+    '''
+    parser = argparse.ArgumentParser(prog="shard",
+                                     description="Splits a trace into conversations by a correlation key and runs a "
+                                                 "Test Case on each of them, on a pool of processes.")
+    parser.add_argument("tc_file", help="Test Case description file.")
+    parser.add_argument("trace_file", help="JSON trace file obtained from Wireshark, or pcap / pcapng capture.")
+    parser.add_argument("report_dir", help="Directory where a report is written for each conversation.")
+    parser.add_argument("--key", nargs="+", default=["call-id"], metavar="FIELD",
+                        help="Field of the correlation key, e.g. sip.Call-ID, or call-id, session-id, imsi. With "
+                             "several fields, the first one that a frame carries is used (default: call-id).")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                        help="Number of processes (default: number of CPUs, %(default)s).")
+    parser.add_argument("--summary", help="Summary file (default: <report_dir>/summary.json).")
+    add_trace_arguments(parser)
+    add_merge_argument(parser)
+    add_logging_arguments(parser)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    setup_logging(args.log_level, args.log_file, args.rule_trace)
+    os.makedirs(args.report_dir, exist_ok=True)
+    tracefn = trace_files(args.trace_file, args.merge)
+    options = apply_auto_filter(trace_options(args), tracefn, [TestCase(args.tc_file)])
+    summary = shard.run_sharded(args.tc_file, tracefn, args.key, args.report_dir, options,
+                                project=args.project, workers=args.jobs,
+                                logging_options=(args.log_level, args.log_file, args.rule_trace))
+    print("{} conversations in {:.1f} s: {} passed, {} failed, {} errors".format(
+        summary["shards"], summary["elapsed"], summary["histogram"]["Passed"], summary["histogram"]["Failed"],
+        summary["histogram"]["Error"]))
+    for rule, count in sorted(summary["failed_rules"].items(), key=lambda item: -item[1]):
+        print("{:8d} failed at {}".format(count, rule))
+    summaryfn = args.summary or os.path.join(args.report_dir, "summary.json")
+    with open(summaryfn, "w") as summaryfile:
+        json.dump(summary, summaryfile, indent=3)
+    sys.exit(0 if summary["histogram"]["Failed"] == 0 and summary["histogram"]["Error"] == 0 else 1)
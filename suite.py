@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+'''
+Runs several Test Cases against the same trace, reading the trace only once.
+'''
+
+import os
+import argparse
+import logging
+from tcparser import trace
+from tcparser import test_case
+from tcparser import runner
+from tcparser.trace import add_trace_arguments, add_merge_argument, trace_options, trace_files
+from tcparser.display_filter import apply_auto_filter
+from tcparser.logs import add_logging_arguments, setup_logging
+from tcparser.tc_report import add_report_arguments, report_name
+from tcparser.profiling import write_chrome_trace
+
+
+def parse_args():
+    '''
+    Parses the command line.
+    :return: parsed arguments
+    '''
+    parser = argparse.ArgumentParser(prog="suite",
+                                     description="Runs several Test Cases against a Wireshark JSON trace.")
+    parser.add_argument("trace_file", help="JSON trace file obtained from Wireshark, or pcap / pcapng capture.")
+    parser.add_argument("report_dir", help="Directory where a report is written for each TC.")
+    parser.add_argument("tc_files", nargs="+", help="Test Case description files.")
+    add_trace_arguments(parser)
+    add_merge_argument(parser)
+    add_report_arguments(parser)
+    add_logging_arguments(parser)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    setup_logging(args.log_level, args.log_file, args.rule_trace)
+    logger = logging.getLogger("TraceAnaliser")
+    logger.info('Logging started ...')
+    os.makedirs(args.report_dir, exist_ok=True)
+    test_cases = [test_case.TestCase(tc_file) for tc_file in args.tc_files]
+    projection = None
+    if args.project:
+        projection = test_cases[0].get_projection()
+        for tc in test_cases[1:]:
+            projection.merge(tc.get_projection())
+    tracefn = trace_files(args.trace_file, args.merge)
+    options = apply_auto_filter(trace_options(args), tracefn, test_cases)
+    trace = trace.Trace(tracefn, **options, projection=projection)
+    for tc in test_cases:
+        tc.set_trace(trace)
+        if args.report_format == "ndjson":
+            tc.stream_report(os.path.join(args.report_dir, report_name(tc.filename, args.report_format)))
+        if args.profile or args.profile_trace:
+            tc.profile()
+        if args.checkpoints:
+            tc.use_checkpoints(args.checkpoints)
+    runner.run_test_cases(trace, test_cases)
+    if args.follow:
+        trace.stream.close()    # stops reading the live trace
+    for tc in test_cases:
+        logger.info("Test Case {} Result: {}".format(tc.filename, tc.get_result()))
+        print("{}: {}".format(tc.filename, tc.get_result()))
+        tc.report(os.path.join(args.report_dir, report_name(tc.filename, args.report_format)))
+    if args.profile_trace:
+        write_chrome_trace(args.profile_trace, [(tc.filename, tc.get_report()) for tc in test_cases])
@@ -0,0 +1,227 @@
+'''
+Compiled "store", "verify" and "report" sections of TC rules.
+
+Like the "match" section (see matcher.py), these sections are compiled once, when the TC is loaded:
+- every item of a "store" section is a fixed path of keys down to a field, and the variable it is stored into;
+- the regular expressions of a "verify" section are precompiled;
+- the values of a "report" section are split around their variable placeholder ({{name}}).
+So a matched frame is processed without inspecting the rule dicts, or building regular expressions, again. The
+template itself is never modified.
+'''
+
+import re
+from .frame import MAPPING_TYPES
+from .matcher import VARIABLE, MISSING
+from .profiling import counted
+
+
+class Extraction(object):
+    '''
+    Item of a "store" section: the path of keys to follow inside a protocol, down to a field, and the variable that
+    the value of the field is stored into. For example, {"msg_hdr_tree": {"sip.Call-ID": "callId"}} stores the value
+    of sip.Call-ID inside msg_hdr_tree into variable callId.
+    '''
+
+    def __init__(self, protocol, item):
+        '''
+        :param protocol: protocol of the item.
+        :param item: dict from the list of the protocol in the "store" section. Only the first key of every dict is
+                     followed.
+        '''
+        assert (type(item) is dict), "Invalid \"store\" item: {}".format(item)
+        self.protocol = protocol
+        self.path = []
+        node = item
+        while type(node) is dict and len(node) > 0:
+            key = next(iter(node))
+            self.path.append(key)
+            node = node[key]
+        self.variable = node if type(node) is not dict else None    # None if the path ends without a variable
+
+    def extract(self, frame):
+        '''
+        Gets the value of the field from a frame. When the path goes through lists of dicts, the values found in all
+        of them are gathered into a list.
+        :param frame: frame layers.
+        :return: tuple (found, value). The value is None if the field was found without value (JSON null).
+        '''
+        layer = frame.get(self.protocol, MISSING)
+        if layer is MISSING or type(layer) not in MAPPING_TYPES:
+            return False, None
+        return self.__extract(layer, 0)
+
+    def __extract(self, framedict, depth):
+        value = framedict.get(self.path[depth], MISSING)
+        if value is MISSING:
+            return False, None
+        if depth + 1 == len(self.path):
+            if type(value) is list and len(value) == 0:
+                return False, None
+            return True, value
+        valuetype = type(value)
+        if valuetype in MAPPING_TYPES:
+            return self.__extract(value, depth + 1)
+        if valuetype is not list:
+            return False, None
+        found = False
+        gathered = None     # value, or list of the values found in the items
+        isowned = False     # True once "gathered" is a list built here, which can be appended to
+        for item in value:
+            if type(item) not in MAPPING_TYPES:
+                continue
+            isfound, itemvalue = self.__extract(item, depth + 1)
+            found = found or isfound
+            if itemvalue is None:
+                continue
+            if gathered is None:
+                gathered = itemvalue
+                continue
+            if not isowned:
+                gathered = list(gathered) if type(gathered) is list else [gathered]
+                isowned = True
+            gathered.append(itemvalue)
+        return found, gathered
+
+
+class StorePlan(object):
+    '''
+    Compiled "store" section of a rule.
+    '''
+
+    def __init__(self, store):
+        '''
+        :param store: "store" section. Keys are protocols, values are lists of items (see Extraction).
+        '''
+        self.extractions = []
+        for protocol, items in store.items():
+            for item in items:
+                extraction = Extraction(protocol, item)
+                if extraction.variable is not None:
+                    self.extractions.append(extraction)
+
+    def apply(self, frame, tcvars):
+        '''
+        Stores the fields of a matched frame into the TC variables. Fields found without value are stored as empty
+        strings; fields not found are left alone.
+        :param frame: frame layers.
+        :param tcvars: TC variables, updated.
+        :return: list of the names of the variables stored.
+        '''
+        stored = []
+        for extraction in self.extractions:
+            found, value = extraction.extract(frame)
+            if found:
+                tcvars[extraction.variable] = "" if value is None else value
+                stored.append(extraction.variable)
+        return stored
+
+
+class VerifyPlan(object):
+    '''
+    Compiled "verify" section of a rule: conditions on the TC variables, checked once the rule has matched a frame.
+    The rule is verified if any condition is met.
+    '''
+
+    def __init__(self, verify):
+        '''
+        :param verify: list of conditions: {"field": variable, "contains": regular expression} or
+                       {"field": variable, "is": value}.
+        '''
+        self.counter = None     # profiling.EvaluationCounter of the evaluations of the regular expressions
+        self.conditions = []    # tuples (variable, position of the regular expression or None, value for "is")
+        self.__sources = []
+        for item in verify:
+            if "contains" in item:
+                self.__sources.append("(.*)" + item["contains"] + "(.*)")
+                self.conditions.append((item["field"], len(self.__sources) - 1, None))
+            elif "is" in item:
+                self.conditions.append((item["field"], None, item["is"]))
+            else:
+                self.conditions.append((None, None, None))
+        # variables of the "is" conditions after every condition, which must still be stored when it is met
+        self.__required = [[variable for variable, position, expected in self.conditions[index + 1:]
+                            if variable is not None and position is None] for index in range(len(self.conditions))]
+        self.__compile()
+
+    def __compile(self):
+        self.__searches = [re.compile(source).search for source in self.__sources]
+        if self.counter is not None:
+            self.__searches = [counted(search, self.counter) for search in self.__searches]
+
+    def count_evaluations(self, counter):
+        '''
+        Counts the evaluations of the regular expressions from now on.
+        :param counter: profiling.EvaluationCounter
+        '''
+        self.counter = counter
+        self.__compile()
+
+    def verify(self, tcvars):
+        '''
+        :param tcvars: TC variables.
+        :return: True if any condition is met. Raises KeyError for an "is" condition on a variable not stored, even
+                 if another condition is met.
+        '''
+        for index, (variable, position, expected) in enumerate(self.conditions):
+            if position is not None:
+                value = tcvars.get(variable, MISSING)
+                if value is MISSING:
+                    continue
+                search = self.__searches[position]
+                if type(value) is list:
+                    ismet = any(search(item) for item in value)
+                else:
+                    ismet = search(value) is not None
+            elif variable is not None:
+                ismet = expected == tcvars[variable]
+            else:
+                continue
+            if ismet:
+                for required in self.__required[index]:
+                    if required not in tcvars:
+                        raise KeyError(required)
+                return True
+        return False
+
+
+class ReportPlan(object):
+    '''
+    Compiled "report" section of a rule.
+    '''
+
+    def __init__(self, report):
+        '''
+        :param report: list of {"tag": name in the report, "value": text, with at most one variable placeholder}.
+        '''
+        self.entries = []   # tuples (tag, value, variable or None, list of the placeholder matches)
+        for item in report:
+            assert ("tag" in item and "value" in item), "Invalid \"report\" item: {}".format(item)
+            value = item["value"]
+            placeholders = list(VARIABLE.finditer(value)) if type(value) is str else []
+            variable = placeholders[0].group(1) if placeholders else None
+            self.entries.append((item["tag"], value, variable, placeholders))
+
+    def apply(self, tcvars, add):
+        '''
+        Reports the values of the section, with the current value of their variables.
+        :param tcvars: TC variables.
+        :param add: function called with (tag, value) for every value.
+        :return: void. Raises exception if a variable does not exist.
+        '''
+        for tag, value, variable, placeholders in self.entries:
+            if variable is None:
+                add(tag, value)
+                continue
+            assert (variable in tcvars), "{} not stored.".format(variable)
+            replacement = tcvars[variable]
+            if type(replacement) is list:
+                replacement = "{}".format(replacement)
+            isexpanded = "\\" in replacement    # escapes and group references, expanded as re.sub() does
+            parts = []
+            end = 0
+            for placeholder in placeholders:
+                parts.append(value[end:placeholder.start()])
+                parts.append(placeholder.expand(replacement) if isexpanded else replacement)
+                end = placeholder.end()
+            parts.append(value[end:])
+            add(tag, "".join(parts))
@@ -0,0 +1,249 @@
+'''
+Runs every Test Case of a set against every trace of a set, on a pool of processes.
+
+The work is split into jobs, each one a trace and a group of TCs. A job loads its trace once and runs its TCs
+together (see runner.py). The TCs of a trace are split into several jobs only when there are fewer traces than
+processes, so that all the processes have work to do.
+'''
+
+import os
+import glob
+import time
+import logging
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from .trace import Trace
+from .test_case import TestCase
+from .runner import run_test_cases
+from .reader import CAPTURE_EXTENSIONS
+from .ek import NDJSON_EXTENSIONS
+from .logs import setup_logging, DEFAULT_LOGFILE
+from .tc_report import report_name
+from .display_filter import apply_auto_filter
+
+TC_EXTENSIONS = (".json",)
+TRACE_EXTENSIONS = (".json",) + NDJSON_EXTENSIONS + CAPTURE_EXTENSIONS
+
+
+def find_files(patterns, extensions, recursive=False):
+    '''
+    Expands file names, glob patterns and directories into a list of files.
+    :param patterns: list of file names, glob patterns or directories. Directories contribute the files directly
+                     inside them whose extension is in "extensions".
+    :param extensions: extensions of the files taken from directories.
+    :param recursive: if True, directories also contribute the files of their subdirectories.
+    :return: sorted list of file paths, without duplicates.
+    '''
+    files = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for dirpath, dirnames, filenames in os.walk(pattern):
+                for name in filenames:
+                    if os.path.splitext(name)[1].lower() in extensions:
+                        files.add(os.path.join(dirpath, name))
+                if not recursive:
+                    break
+        else:
+            matches = glob.glob(pattern)
+            assert (len(matches) > 0), "No file matches {}".format(pattern)
+            files.update(os.path.normpath(match) for match in matches)
+    return sorted(files)
+
+
+def unique_names(paths, keep_extension=True):
+    '''
+    Names files after their path relative to the deepest directory that holds them all, so that files with the same
+    name in different directories get different names.
+    :param paths: list of file paths, without duplicates.
+    :param keep_extension: if False, the extensions are left out of the names, unless two files only differ by their
+                           extension.
+    :return: dict file path -> name, a relative path.
+    '''
+    if len(paths) == 0:
+        return {}
+    absolute = [os.path.abspath(path) for path in paths]
+    root = os.path.commonpath([os.path.dirname(path) for path in absolute])
+    names = dict((path, os.path.relpath(abspath, root)) for path, abspath in zip(paths, absolute))
+    if not keep_extension:
+        stems = dict((path, os.path.splitext(name)[0]) for path, name in names.items())
+        if len(set(stems.values())) == len(stems):
+            names = stems
+    assert (len(set(names.values())) == len(names)), "Files with the same path: {}".format(paths)
+    return names
+
+
+def report_path(report_dir, tracename, tcname, report_format="json"):
+    '''
+    :param tracename: name of the trace, see unique_names().
+    :param tcname: name of the TC, see unique_names().
+    :return: path of the report of a TC run against a trace: <report_dir>/<trace name>/<TC name>
+    '''
+    return os.path.join(report_dir, tracename, os.path.dirname(tcname), report_name(tcname, report_format))
+
+
+def plan_jobs(tracefns, tcfns, workers):
+    '''
+    Splits the work into jobs.
+    :param tracefns: list of trace files.
+    :param tcfns: list of TC files. Every TC is run against every trace.
+    :param workers: number of processes.
+    :return: list of (trace file, list of TC files)
+    '''
+    if len(tracefns) == 0 or len(tcfns) == 0:
+        return []
+    groups = max(1, min(len(tcfns), -(-workers // len(tracefns))))     # groups of TCs per trace
+    size = -(-len(tcfns) // groups)
+    return [(tracefn, tcfns[start:start + size]) for tracefn in tracefns for start in range(0, len(tcfns), size)]
+
+
+def init_worker(log_level, log_file, rule_trace):
+    '''
+    Sets up logging in a worker process. Each process writes its own log file (and rule trace), named after the
+    given ones with the process id appended.
+    '''
+    def per_process(filename):
+        if filename is None:
+            return None
+        root, extension = os.path.splitext(filename)
+        return "{}.{}{}".format(root, os.getpid(), extension)
+    setup_logging(log_level, per_process(log_file), per_process(rule_trace))
+
+
+def error_result(tcfn, tracefn, error, start):
+    return {"tc": tcfn, "trace": tracefn, "report": None, "result": "Error",
+            "error": "{}: {}".format(type(error).__name__, error), "elapsed": time.perf_counter() - start}
+
+
+def run_job(tracefn, tcfns, report_dir, options, project=False, report_format="json", profile=False,
+            checkpoint_dir=None, names=None):
+    '''
+    Runs a group of TCs against a trace and writes their reports. An error in a TC (e.g. an invalid TC file, or an
+    exception while it runs) is reported as its result, and does not prevent the other TCs from running. If the trace
+    fails while the TCs run together, the TCs not finished yet are run again one by one.
+    :param tracefn: trace file.
+    :param tcfns: list of TC files.
+    :param report_dir: root directory of the reports.
+    :param options: keyword arguments of Trace.
+    :param project: if True, the trace only keeps the fields used by the TCs of the job.
+    :param report_format: "json", or "ndjson" to write the reports while the TCs run (see tc_report.ReportWriter).
+    :param profile: if True, the reports get a "perf" block per rule (see TestCase.profile()).
+    :param checkpoint_dir: if given, directory of the checkpoints of the TCs (see TestCase.use_checkpoints()).
+    :param names: names of the trace and the TCs in the paths of the reports: dict file path -> name (see
+                  unique_names()). The file names, without extension for the trace, if None.
+    :return: list with a result dict per TC.
+    '''
+    logger = logging.getLogger(__name__)
+    if names is None:
+        names = dict((tcfn, os.path.basename(tcfn)) for tcfn in tcfns)
+        names[tracefn] = os.path.splitext(os.path.basename(tracefn))[0]
+    start = time.perf_counter()
+    results = []
+    test_cases = []
+    for tcfn in tcfns:
+        try:
+            test_cases.append(TestCase(tcfn))
+        except Exception as error:
+            logger.error("Cannot load TC {}: {}".format(tcfn, traceback.format_exc()))
+            results.append(error_result(tcfn, tracefn, error, start))
+    if len(test_cases) == 0:
+        return results
+    try:
+        projection = None
+        if project:
+            projection = test_cases[0].get_projection()
+            for test_case in test_cases[1:]:
+                projection.merge(test_case.get_projection())
+        trace = Trace(tracefn, projection=projection, **apply_auto_filter(options, tracefn, test_cases))
+    except Exception as error:
+        logger.error("Cannot load trace {}: {}".format(tracefn, traceback.format_exc()))
+        return results + [error_result(test_case.filename, tracefn, error, start) for test_case in test_cases]
+    def prepare(test_case):
+        test_case.set_trace(trace)
+        if report_format == "ndjson":
+            reportfn = report_path(report_dir, names[tracefn], names[test_case.filename], report_format)
+            os.makedirs(os.path.dirname(reportfn), exist_ok=True)
+            test_case.stream_report(reportfn)
+        if profile:
+            test_case.profile()
+        if checkpoint_dir is not None:
+            test_case.use_checkpoints(checkpoint_dir)
+
+    for test_case in test_cases:
+        prepare(test_case)
+    errors = {}     # TC -> exception
+    def on_error(test_case, error):
+        logger.error("Engine error in TC {} against {}: {}".format(test_case.filename, tracefn, traceback.format_exc()))
+        errors[test_case] = error
+
+    try:
+        run_test_cases(trace, test_cases, on_error)
+    except Exception:
+        unfinished = [test_case for test_case in test_cases if test_case not in errors and not test_case.is_finished()]
+        logger.error("Engine error running TCs against {}, running the {} unfinished TCs one by one: {}".format(
+            tracefn, len(unfinished), traceback.format_exc()))
+        for test_case in unfinished:
+            try:
+                prepare(test_case)  # starts the streamed report again
+                test_case.run()
+            except Exception as error:
+                logger.error("TC {} failed: {}".format(test_case.filename, traceback.format_exc()))
+                errors[test_case] = error
+    elapsed = time.perf_counter() - start
+    for test_case in test_cases:
+        if test_case in errors:
+            results.append(error_result(test_case.filename, tracefn, errors[test_case], start))
+            continue
+        reportfn = report_path(report_dir, names[tracefn], names[test_case.filename], report_format)
+        os.makedirs(os.path.dirname(reportfn), exist_ok=True)
+        test_case.report(reportfn)
+        results.append({"tc": test_case.filename, "trace": tracefn, "report": reportfn,
+                        "result": "Passed" if test_case.get_result() else "Failed", "elapsed": elapsed})
+    return results
+
+
+def run_batch(tracefns, tcfns, report_dir, options, project=False, workers=None, logging_options=None,
+              report_format="json", profile=False, checkpoint_dir=None):
+    '''
+    Runs every TC against every trace.
+    :param tracefns: list of trace files.
+    :param tcfns: list of TC files.
+    :param report_dir: root directory of the reports.
+    :param options: keyword arguments of Trace.
+    :param project: see run_job().
+    :param workers: number of processes. Number of CPUs if None.
+    :param logging_options: (log level, log file, rule trace file) of the worker processes.
+    :param report_format: see run_job().
+    :param profile: see run_job().
+    :param checkpoint_dir: see run_job().
+    :return: summary dict with the totals and a result per TC and trace.
+    '''
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if logging_options is None:
+        logging_options = ("WARNING", DEFAULT_LOGFILE, None)
+    jobs = plan_jobs(tracefns, tcfns, workers)
+    names = unique_names(tcfns)
+    names.update(unique_names(tracefns, keep_extension=False))
+    options = dict(options, parse_workers=options.get("parse_workers") or 1)  # the jobs already use all the CPUs
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=logging_options) as executor:
+        futures = [executor.submit(run_job, tracefn, group, report_dir, options, project, report_format,
+                                   profile, checkpoint_dir, dict((fn, names[fn]) for fn in [tracefn] + group))
+                   for tracefn, group in jobs]
+        for future in futures:
+            results.extend(future.result())
+    totals = {"Passed": 0, "Failed": 0, "Error": 0}
+    for result in results:
+        totals[result["result"]] += 1
+    return {
+        "traces": len(tracefns),
+        "tcs": len(tcfns),
+        "jobs": len(jobs),
+        "workers": workers,
+        "elapsed": time.perf_counter() - start,
+        "passed": totals["Passed"],
+        "failed": totals["Failed"],
+        "errors": totals["Error"],
+        "results": results
+    }
@@ -0,0 +1,204 @@
+'''
+Binary sidecar cache of parsed traces.
+
+The first time a trace is used with the cache enabled, its frames are parsed once and written next to it (or to a
+cache directory) in marshal format, one record per frame, followed by a table with the position of every record and
+the index of the frames that carry each protocol. Later runs map the cache file into memory and decode a frame only
+when it is accessed, so reopening a trace of any size takes the time of reading its header.
+
+A cache file is only used if it was written for the same trace file: same size, modification time and hash of a
+sample of its content (and same display filter, for captures). Otherwise it is rebuilt. Traces up to SAMPLES *
+SAMPLE_SIZE bytes are hashed entirely; bigger ones only at SAMPLES positions, so that opening them does not read them
+whole. An edit of a big trace that keeps its size and modification time, outside the samples, goes unnoticed: remove
+the cache file (or touch the trace) after rewriting a trace in place with its original time stamps.
+
+File layout:
+    MAGIC | frame records | padding | record positions (uint64) | protocol indexes (uint64) | header (JSON)
+    | header position (uint64) | header length (uint64) | MAGIC
+'''
+
+import os
+import json
+import mmap
+import struct
+import marshal
+import hashlib
+import logging
+from array import array
+
+MAGIC = b"TRZCACHE"
+CACHE_VERSION = 1
+CACHE_SUFFIX = ".trzcache"
+SAMPLE_SIZE = 1 << 20       # bytes hashed at each sampled position of the trace file
+SAMPLES = 16                # positions sampled. Files up to SAMPLES * SAMPLE_SIZE bytes are hashed entirely.
+MARSHAL_VERSION = 4
+TRAILER = struct.Struct("<QQ")
+
+
+def source_key(tracefn, display_filter=None):
+    '''
+    Identifies the content of a trace file without reading all of it (see the limits in the module description).
+    :param tracefn: path of the trace file.
+    :param display_filter: display filter applied to the trace, for captures.
+    :return: dict with the size, modification time and sampled hash of the file.
+    '''
+    stat = os.stat(tracefn)
+    digest = hashlib.blake2b(digest_size=16)
+    with open(tracefn, "rb") as tracefile:
+        if stat.st_size <= SAMPLES * SAMPLE_SIZE:
+            for chunk in iter(lambda: tracefile.read(SAMPLE_SIZE), b""):
+                digest.update(chunk)
+        else:
+            step = (stat.st_size - SAMPLE_SIZE) // (SAMPLES - 1)
+            for sample in range(SAMPLES):
+                tracefile.seek(sample * step)
+                digest.update(tracefile.read(SAMPLE_SIZE))
+    return {
+        "version": CACHE_VERSION,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "hash": digest.hexdigest(),
+        "filter": display_filter
+    }
+
+
+def cache_path(tracefn, cache_dir=None):
+    '''
+    :param tracefn: path of the trace file.
+    :param cache_dir: directory of the cache files. The directory of the trace if None.
+    :return: path of the cache file of the trace.
+    '''
+    if cache_dir is None:
+        return tracefn + CACHE_SUFFIX
+    return os.path.join(cache_dir, os.path.basename(tracefn) + CACHE_SUFFIX)
+
+
+def write_cache(cachefn, key, frames):
+    '''
+    Writes the cache file of a trace. The file is written under a temporary name and renamed when complete, so that
+    an interrupted write never leaves a truncated cache behind.
+    :param cachefn: path of the cache file.
+    :param key: source_key() of the trace.
+    :param frames: iterable of the frame layers of the trace, as plain dicts.
+    :return: number of frames written.
+    '''
+    positions = array("Q")
+    protocols = {}      # protocol -> array of the indexes of the frames that carry it
+    tmpfn = "{}.{}.tmp".format(cachefn, os.getpid())
+    try:
+        with open(tmpfn, "wb") as cachefile:
+            cachefile.write(MAGIC)
+            position = len(MAGIC)
+            for index, frame in enumerate(frames):
+                record = marshal.dumps(frame, MARSHAL_VERSION)
+                positions.append(position)
+                cachefile.write(record)
+                position += len(record)
+                for protocol in frame:
+                    if protocol not in protocols:
+                        protocols[protocol] = array("Q")
+                    protocols[protocol].append(index)
+            positions.append(position)
+            padding = -position % 8
+            cachefile.write(b"\0" * padding)
+            position += padding
+            header = {"key": key, "numframes": len(positions) - 1, "positions": position, "protocols": {}}
+            cachefile.write(positions.tobytes())
+            position += len(positions) * positions.itemsize
+            for protocol, indexes in protocols.items():
+                header["protocols"][protocol] = [position, len(indexes)]
+                cachefile.write(indexes.tobytes())
+                position += len(indexes) * indexes.itemsize
+            encoded = json.dumps(header).encode("utf-8")
+            cachefile.write(encoded)
+            cachefile.write(TRAILER.pack(position, len(encoded)))
+            cachefile.write(MAGIC)
+        os.replace(tmpfn, cachefn)
+    finally:
+        if os.path.exists(tmpfn):
+            os.remove(tmpfn)
+    return len(positions) - 1
+
+
+class FrameCache(object):
+    '''
+    Read access to a cache file. Frames are decoded when they are accessed.
+    Offers the same interface as reader.FrameStream.
+    '''
+
+    def __init__(self, cachefn):
+        '''
+        :param cachefn: path of the cache file. Raises ValueError if the file is not a valid cache file.
+        '''
+        self.logger = logging.getLogger(__name__)
+        self.cachefn = cachefn
+        with open(cachefn, "rb") as cachefile:
+            self.__map = mmap.mmap(cachefile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            mapped = self.__map
+            trailer = len(mapped) - len(MAGIC) - TRAILER.size
+            if trailer < len(MAGIC) or mapped[:len(MAGIC)] != MAGIC or mapped[-len(MAGIC):] != MAGIC:
+                raise ValueError("{} is not a trace cache file".format(cachefn))
+            header_position, header_length = TRAILER.unpack(mapped[trailer:trailer + TRAILER.size])
+            self.header = json.loads(mapped[header_position:header_position + header_length].decode("utf-8"))
+            self.key = self.header["key"]
+            self.numpackets = self.header["numframes"]
+            start = self.header["positions"]
+            self.__positions = array("Q")
+            self.__positions.frombytes(mapped[start:start + (self.numpackets + 1) * self.__positions.itemsize])
+        except Exception:
+            self.__map.close()
+            raise
+
+    @classmethod
+    def open(cls, cachefn, key):
+        '''
+        Opens a cache file if it matches a trace.
+        :param cachefn: path of the cache file.
+        :param key: source_key() of the trace.
+        :return: FrameCache. None if the file does not exist, is not valid, or was written for another trace.
+        '''
+        if not os.path.exists(cachefn):
+            return None
+        try:
+            frame_cache = cls(cachefn)
+        except (ValueError, KeyError, OSError) as error:
+            logging.getLogger(__name__).warning("Ignoring cache file {}: {}".format(cachefn, error))
+            return None
+        if frame_cache.key != key:
+            frame_cache.close()
+            return None
+        return frame_cache
+
+    def get(self, index):
+        '''
+        Gets a frame.
+        :param index: index of the frame.
+        :return: frame layers. None if index is beyond the end of the trace.
+        '''
+        if index >= self.numpackets:
+            return None
+        positions = self.__positions
+        return marshal.loads(self.__map[positions[index]:positions[index + 1]])
+
+    def frames(self):
+        '''
+        :return: generator of all the frames, in trace order.
+        '''
+        for index in range(self.numpackets):
+            yield self.get(index)
+
+    def protocol_index(self):
+        '''
+        Reads the protocol index stored in the cache, without decoding any frame.
+        :return: dict protocol -> array of the indexes of the frames that carry it.
+        '''
+        protocol_index = {}
+        for protocol, (position, count) in self.header["protocols"].items():
+            indexes = array("Q")
+            indexes.frombytes(self.__map[position:position + count * indexes.itemsize])
+            protocol_index[protocol] = indexes
+        return protocol_index
+
+    def close(self):
+        self.__map.close()
@@ -0,0 +1,101 @@
+'''
+Checkpoints of TC runs, to restart a TC whose rules have been edited from the longest unchanged prefix of rules.
+
+The state of a TC before its rule k only depends on the trace, the initial TC variables and rules 0 to k-1. So every
+time a rule is settled, the state of the run at the start of the next rule (frame cursor, TC variables, report of the
+rules so far, last matched frame) is saved under a hash of those three. A later run of the same TC, or of a TC that
+shares its first rules, against the same trace starts from the checkpoint of its longest matching prefix instead of
+frame 0. A TC that is over (passed, or failed at a rule) is saved under the prefix up to its last evaluated rule, so
+re-running it, or a TC that only differs in the rules after the one it failed at, gives back its report at once. A TC
+that has evaluated all its rules is saved under a key of its own, since more rules could change its outcome.
+
+Checkpoints are JSON files named after their key. The trace is identified as for the cache files (see
+cache.source_key()), so checkpoints are dropped along with a trace that changes.
+'''
+
+import os
+import json
+import hashlib
+import logging
+from .frame import to_dict
+
+CHECKPOINT_VERSION = 1
+CHECKPOINT_SUFFIX = ".trzckpt"
+
+
+def prefix_keys(identity, tcvars, rules):
+    '''
+    Gets the keys of all the prefixes of the rules of a TC.
+    :param identity: identity of the trace (see Trace.get_identity()).
+    :param tcvars: initial TC variables, imports included.
+    :param rules: list of the rules of the template.
+    :return: list of len(rules) + 2 keys. Key k identifies the state of a run before rule k, the last key a run
+             that has evaluated all the rules (the outcome of a TC with more rules would still be open).
+    '''
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(json.dumps([CHECKPOINT_VERSION, identity, to_dict(tcvars)], sort_keys=True).encode("utf-8"))
+    keys = [digest.hexdigest()]
+    for rule in rules:
+        digest.update(b"\n" + json.dumps(rule, sort_keys=True, separators=(",", ":")).encode("utf-8"))
+        keys.append(digest.hexdigest())
+    digest.update(b"\nend")
+    keys.append(digest.hexdigest())
+    return keys
+
+
+class CheckpointStore(object):
+    '''
+    Directory of checkpoint files.
+    '''
+
+    def __init__(self, directory):
+        '''
+        :param directory: directory of the checkpoint files. Created when the first checkpoint is saved.
+        '''
+        self.logger = logging.getLogger(__name__)
+        self.directory = directory
+
+    def __path(self, key):
+        return os.path.join(self.directory, key + CHECKPOINT_SUFFIX)
+
+    def load(self, key):
+        '''
+        :return: state saved under the key (see TestRun.get_checkpoints()). None if there is none, or it cannot be
+                 read.
+        '''
+        try:
+            with open(self.__path(key), "r") as checkpointfile:
+                return json.load(checkpointfile)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as error:
+            self.logger.warning("Cannot read checkpoint {}: {}".format(key, error))
+            return None
+
+    def find(self, keys):
+        '''
+        Finds the checkpoint of the longest prefix.
+        :param keys: see prefix_keys().
+        :return: the state, None if no prefix has a checkpoint.
+        '''
+        for key in reversed(keys[1:]):
+            state = self.load(key)
+            if state is not None:
+                return state
+        return None
+
+    def save(self, key, state):
+        '''
+        Saves a state under a key. The file is written under a temporary name and renamed, so that concurrent runs
+        never read a partial checkpoint.
+        :return: void
+        '''
+        path = self.__path(key)
+        temppath = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(temppath, "w") as checkpointfile:
+                json.dump(state, checkpointfile)
+            os.replace(temppath, path)
+        except OSError as error:
+            self.logger.warning("Cannot write checkpoint {}: {}".format(path, error))
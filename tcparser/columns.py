@@ -0,0 +1,231 @@
+'''
+Columnar store of fields, to pre-filter the frames that can match a rule with vectorized operations.
+
+A column holds the values of a field (see index.py for field paths) across all the frames of a trace, as two NumPy
+arrays of the same length: the index of the frame that carries each value, and the value itself. Values are either
+numbers, when every value of the field is a decimal integer (e.g. udp.port, diameter.cmd.code), or codes into a
+dictionary of the distinct strings of the field (e.g. sip.Method).
+
+A condition of a rule is evaluated once per distinct value of its field, not once per frame: conditions that only
+accept whole values (^value$, ^(a|b|c)$, ^10[0-9]$, ...) are looked up, other regular expressions are searched in
+each distinct value. The result is then spread over all the frames at once, and the conditions of a rule are combined
+into a mask of the frames that can match all of them. Only those frames go through the matcher.
+
+Requires NumPy.
+'''
+
+import re
+import logging
+from array import array
+from itertools import product
+from .index import field_values
+from .matcher import MATCH
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    from re import _parser as sre_parse     # Python 3.11+
+except ImportError:
+    try:
+        import sre_parse
+    except ImportError:
+        sre_parse = None    # no whole values: every condition is searched in the distinct values
+
+VALUES_LIMIT = 1024         # largest set of whole values that a condition is expanded into
+MASKS_LIMIT = 256           # conditions whose evaluation is kept by each column
+
+
+def require_numpy():
+    '''
+    Raises ImportError if NumPy is not installed.
+    '''
+    if numpy is None:
+        raise ImportError("Columnar pre-filtering needs NumPy: pip install numpy")
+
+
+def expand(items):
+    '''
+    Gets the strings that a parsed regular expression can match, if they are few.
+    :param items: sequence of (op, argument) from sre_parse.
+    :return: set of strings. None if they cannot be enumerated.
+    '''
+    choices = []
+    for op, argument in items:
+        if op == sre_parse.LITERAL:
+            choices.append({chr(argument)})
+        elif op == sre_parse.IN:
+            chars = set()
+            for inop, inargument in argument:
+                if inop == sre_parse.LITERAL:
+                    chars.add(chr(inargument))
+                elif inop == sre_parse.RANGE and inargument[1] - inargument[0] < VALUES_LIMIT:
+                    chars.update(chr(code) for code in range(inargument[0], inargument[1] + 1))
+                else:
+                    return None     # negated sets, categories (\d, \w), ...
+            choices.append(chars)
+        elif op == sre_parse.SUBPATTERN:
+            group, add_flags, del_flags, pattern = argument
+            strings = expand(pattern) if add_flags == 0 and del_flags == 0 else None
+            if strings is None:
+                return None
+            choices.append(strings)
+        elif op == sre_parse.BRANCH:
+            strings = set()
+            for branch in argument[1]:
+                branch_strings = expand(branch)
+                if branch_strings is None:
+                    return None
+                strings.update(branch_strings)
+            choices.append(strings)
+        else:
+            return None
+        count = 1
+        for choice in choices:
+            count *= len(choice)
+        if count > VALUES_LIMIT:
+            return None
+    return set("".join(combination) for combination in product(*choices))
+
+
+def whole_values(source):
+    '''
+    Gets the values that a regular expression accepts when it only accepts whole values, e.g. ^302$ or ^(INVITE|BYE)$.
+    :param source: regular expression, searched in the values.
+    :return: set of strings. None if the expression is not of that form, or cannot be parsed.
+    '''
+    if sre_parse is None:
+        return None
+    try:
+        parsed = sre_parse.parse(source)
+    except (re.error, OverflowError, RecursionError):
+        return None
+    if parsed.state.flags & (re.IGNORECASE | re.MULTILINE) or len(parsed) < 2:
+        return None
+    items = list(parsed)
+    first, last = items[0], items[-1]
+    if first[0] != sre_parse.AT or first[1] not in (sre_parse.AT_BEGINNING, sre_parse.AT_BEGINNING_STRING):
+        return None
+    if last[0] != sre_parse.AT or last[1] not in (sre_parse.AT_END, sre_parse.AT_END_STRING):
+        return None
+    strings = expand(items[1:-1])
+    if strings is None:
+        return None
+    strings.discard("")     # empty matches do not count
+    if last[1] == sre_parse.AT_END:
+        strings.update([string + "\n" for string in strings])   # $ also matches before a final new line
+    return strings
+
+
+class Column(object):
+
+    def __init__(self, path, frames):
+        '''
+        :param path: tuple with the protocol and the keys down to the field.
+        :param frames: iterable of frame layers, in trace order.
+        '''
+        require_numpy()
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        codes = {}          # distinct value -> code
+        rows = array("q")   # frame of every value
+        values = array("q")  # code of every value
+        unconditional = array("q")      # frames that may match any condition on the field (e.g. empty lists)
+        self.numframes = 0
+        for index, frame in enumerate(frames):
+            if path[0] in frame:
+                frame_values, isunconditional = field_values(path, frame[path[0]])
+                for value in frame_values:
+                    code = codes.get(value)
+                    if code is None:
+                        code = codes[value] = len(codes)
+                    rows.append(index)
+                    values.append(code)
+                if isunconditional:
+                    unconditional.append(index)
+            self.numframes = index + 1
+        self.rows = numpy.frombuffer(rows, dtype=numpy.int64)
+        self.unconditional = numpy.frombuffer(unconditional, dtype=numpy.int64)
+        self.dictionary = list(codes)   # code -> value
+        self.istyped = all(value.isdigit() and value.isascii() and str(int(value)) == value for value in codes)
+        if self.istyped:
+            numbers = numpy.array([int(value) for value in self.dictionary], dtype=numpy.int64)
+            self.values = numbers[numpy.frombuffer(values, dtype=numpy.int64)]
+            self.dictionary = None
+        else:
+            self.values = numpy.frombuffer(values, dtype=numpy.int64)
+        self.__selections = {}      # condition -> codes or numbers of the values that match it
+        self.logger.info("Column for {} built with {} values, {} distinct, {}".format(
+            ".".join(path[1:]), len(self.values), len(codes), "typed" if self.istyped else "dictionary-encoded"))
+
+    def __distinct(self):
+        '''
+        :return: list of (value, code or number) of the distinct values of the field.
+        '''
+        if self.istyped:
+            return [(str(number), number) for number in numpy.unique(self.values).tolist()]
+        return [(value, code) for code, value in enumerate(self.dictionary)]
+
+    def __select(self, pattern):
+        '''
+        :return: numpy array with the codes (or numbers) of the values that match a pattern.
+        '''
+        strings = whole_values(pattern.source) if pattern.search is not None else None
+        if pattern.search is None:
+            strings = {pattern.value} if type(pattern.value) is str else set()
+        if strings is not None:
+            if self.istyped:
+                selected = [int(string) for string in strings if string.isdigit() and string.isascii()
+                            and str(int(string)) == string]
+            else:
+                lookup = dict((value, code) for code, value in enumerate(self.dictionary)) \
+                    if len(strings) > 8 else None
+                if lookup is not None:
+                    selected = [lookup[string] for string in strings if string in lookup]
+                else:
+                    selected = [code for code, value in enumerate(self.dictionary) if value in strings]
+        else:
+            selected = [code for value, code in self.__distinct() if pattern.match_str(value) == MATCH]
+        return numpy.array(selected, dtype=numpy.int64)
+
+    def frame_mask(self, pattern):
+        '''
+        Gets the frames in which the field can match a pattern.
+        :param pattern: bound matcher.Pattern of a condition on the field.
+        :return: numpy boolean array with an item per frame.
+        '''
+        key = (pattern.source, pattern.value) if pattern.search is None else pattern.source
+        selected = self.__selections.get(key)
+        if selected is None:
+            if len(self.__selections) >= MASKS_LIMIT:
+                self.__selections.clear()
+            selected = self.__selections[key] = self.__select(pattern)
+        mask = numpy.zeros(self.numframes, dtype=bool)
+        mask[self.rows[numpy.isin(self.values, selected)]] = True
+        mask[self.unconditional] = True
+        return mask
+
+
+def candidate_frames(columns, fields):
+    '''
+    Gets the frames that can match all the conditions of a rule.
+    :param columns: function that returns the Column of a field path, or None if the field has no column.
+    :param fields: list of (path, pattern), where pattern is a bound matcher.Pattern.
+    :return: sorted array with the indexes of the frames. None if the frames cannot be narrowed down.
+    '''
+    mask = None
+    for path, pattern in fields:
+        column = columns(path)
+        if column is None:
+            continue
+        if mask is None:
+            mask = column.frame_mask(pattern)
+        else:
+            mask &= column.frame_mask(pattern)
+    if mask is None:
+        return None
+    candidates = array("q")
+    candidates.frombytes(numpy.flatnonzero(mask).astype(numpy.int64).tobytes())
+    return candidates
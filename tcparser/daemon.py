@@ -0,0 +1,341 @@
+'''
+Trace analysis service.
+
+Keeps traces loaded between runs, so that a TC can be rerun against a big trace without reloading it. Clients connect
+over localhost TCP or a Unix socket and exchange JSON lines:
+
+Run a TC. "tc" is the TC description, as in a TC file. "name" is optional and only names the TC in the logs. With
+"profile": true, the rule reports get a "perf" block (see profiling.py), without allocations.
+    -> {"trace": "/path/to/trace.json", "tc": {...}, "name": "tc01.json"}
+    <- {"event": "trace", "trace": "/path/to/trace.json", "loaded": true, "load_s": 2.1}
+    <- {"event": "rule", "index": 0, "rule": {...rule report...}}          (one per rule, as soon as it is final)
+    <- {"event": "result", "result": "Passed", "report": {...TC report...}, "run_s": 0.3}
+
+Other requests:
+    -> {"command": "load", "trace": "/path/to/trace.json"}     loads a trace in advance
+    -> {"command": "evict", "trace": "/path/to/trace.json"}    drops a trace
+    -> {"command": "status"}                                   lists the loaded traces
+Errors are answered with {"event": "error", "error": "..."}.
+
+Every request can carry the working directory of the client, e.g. "cwd": "/home/user/tcs". Relative trace paths and the
+relative "import" files of the TC are resolved against it, as test.py would resolve them. Without "cwd", these paths
+must be absolute: the working directory of the service is unrelated to the client's.
+
+Traces are identified by their absolute path and kept in LRU order. A trace whose file has changed since it was loaded
+(modification time or size) is loaded again. When loading a trace would exceed the memory cap,
+the least recently used traces that no TC is running against are dropped first. TCs run in a pool of threads, against
+the shared Trace objects, so traces are loaded in memory (or cache) mode, never in stream mode.
+'''
+
+import os
+import gc
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from .trace import Trace
+from .test_case import TestCase
+
+DEFAULT_PORT = 8765
+DEFAULT_MEMORY_CAP = 2048       # MB
+EXPANSION = 4                   # estimated memory of a loaded trace, per byte of trace file
+LINE_LIMIT = 64 * 1024 * 1024   # longest request line (bytes)
+
+
+def resident_memory():
+    '''
+    :return: current resident memory of this process in bytes. None if it cannot be read on this platform.
+    '''
+    try:
+        with open("/proc/self/statm", "r") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def resolve_path(path, cwd):
+    '''
+    :param path: path sent by a client.
+    :param cwd: working directory of the client, None if it did not send it.
+    :return: absolute path.
+    '''
+    if os.path.isabs(path):
+        return os.path.normpath(path)
+    assert (cwd is not None), "Relative path {} needs the \"cwd\" of the client in the request".format(path)
+    return os.path.normpath(os.path.join(cwd, path))
+
+
+def resolve_imports(tc_description, cwd):
+    '''
+    :return: TC description whose "import" files are absolute paths. The given description is left unchanged.
+    '''
+    if not tc_description.get("import"):
+        return tc_description
+    return dict(tc_description, **{"import": [resolve_path(import_file, cwd)
+                                              for import_file in tc_description["import"]]})
+
+
+def file_version(tracefn):
+    '''
+    :return: (modification time in ns, size) of a trace file, which change whenever the file is rewritten or extended.
+    '''
+    stat = os.stat(tracefn)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class LoadedTrace(object):
+
+    def __init__(self, trace, size, load_s, version):
+        self.trace = trace
+        self.size = size        # estimated memory, in bytes
+        self.load_s = load_s
+        self.version = version  # file_version() of the trace file when it was loaded
+        self.users = 0          # TCs running against the trace
+
+
+class TraceStore(object):
+    '''
+    Loaded traces, in least recently used order, under a memory cap.
+    '''
+
+    def __init__(self, memory_cap, options):
+        '''
+        :param memory_cap: memory cap of the loaded traces, in bytes.
+        :param options: keyword arguments of Trace.
+        '''
+        self.logger = logging.getLogger(__name__)
+        self.memory_cap = memory_cap
+        self.options = dict(options)
+        self.options["stream"] = False      # traces are shared by concurrent TCs
+        self.options["follow"] = False
+        self.traces = OrderedDict()         # path -> LoadedTrace, least recently used first
+        self.lock = threading.Lock()        # held while self.traces is read or changed, not while a trace loads
+
+    def used_memory(self):
+        return sum(loaded.size for loaded in self.traces.values())
+
+    def get(self, tracefn):
+        '''
+        Gets a trace, loading it if needed, or if its file has changed since it was loaded. Blocking: to be run
+        outside the event loop.
+        :param tracefn: absolute path of the trace.
+        :return: tuple (LoadedTrace, True if it was loaded by this call)
+        '''
+        version = file_version(tracefn)
+        with self.lock:
+            if tracefn in self.traces:
+                if self.traces[tracefn].version == version:
+                    self.traces.move_to_end(tracefn)
+                    return self.traces[tracefn], False
+                self.logger.info("Trace {} changed since it was loaded, loading it again".format(tracefn))
+                if self.traces[tracefn].users == 0:
+                    self.__drop(tracefn)
+                else:
+                    del self.traces[tracefn]    # the TCs running against it keep the old trace until they are over
+            self.__make_room(version[1] * EXPANSION)
+        before = resident_memory()
+        start = time.perf_counter()
+        trace = Trace(tracefn, **self.options)
+        load_s = time.perf_counter() - start
+        after = resident_memory()
+        if before is not None and after is not None and after > before:
+            size = after - before
+        else:
+            size = version[1] * EXPANSION
+        loaded = LoadedTrace(trace, size, load_s, version)
+        with self.lock:
+            self.traces[tracefn] = loaded
+        self.logger.info("Trace {} loaded in {:.2f} s, {:.1f} MB".format(tracefn, load_s, size / 1048576.0))
+        return loaded, True
+
+    def __make_room(self, size):
+        '''
+        Drops the least recently used traces that are not in use until "size" bytes fit under the cap.
+        '''
+        for tracefn in list(self.traces):
+            if self.used_memory() + size <= self.memory_cap:
+                break
+            if self.traces[tracefn].users == 0:
+                self.__drop(tracefn)
+
+    def __drop(self, tracefn):
+        loaded = self.traces.pop(tracefn)
+        if loaded.trace.stream is not None:
+            loaded.trace.stream.close()
+        self.logger.info("Trace {} evicted".format(tracefn))
+        gc.collect()
+
+    def evict(self, tracefn):
+        '''
+        Drops a trace, unless a TC is running against it.
+        :return: True if the trace was dropped.
+        '''
+        with self.lock:
+            if tracefn not in self.traces or self.traces[tracefn].users > 0:
+                return False
+            self.__drop(tracefn)
+            return True
+
+    def status(self):
+        with self.lock:
+            return [{"trace": tracefn, "memory_mb": loaded.size / 1048576.0, "load_s": loaded.load_s,
+                     "users": loaded.users} for tracefn, loaded in self.traces.items()]
+
+
+class TraceDaemon(object):
+
+    def __init__(self, memory_cap=DEFAULT_MEMORY_CAP * 1048576, workers=None, options=None):
+        '''
+        :param memory_cap: memory cap of the loaded traces, in bytes.
+        :param workers: threads that run TCs. Number of CPUs if None.
+        :param options: keyword arguments of Trace.
+        '''
+        self.logger = logging.getLogger(__name__)
+        self.store = TraceStore(memory_cap, options or {})
+        self.executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+        self.loading = None     # asyncio.Lock serialising trace loads, created in the event loop
+
+    async def serve(self, host="127.0.0.1", port=DEFAULT_PORT, socket_path=None):
+        '''
+        Serves requests until cancelled.
+        :param host: address to listen on, for TCP.
+        :param port: TCP port.
+        :param socket_path: Unix socket to listen on instead of TCP.
+        :return: void
+        '''
+        self.loading = asyncio.Lock()
+        if socket_path is not None:
+            server = await asyncio.start_unix_server(self.handle, path=socket_path, limit=LINE_LIMIT)
+            self.logger.info("Listening on {}".format(socket_path))
+        else:
+            server = await asyncio.start_server(self.handle, host, port, limit=LINE_LIMIT)
+            self.logger.info("Listening on {}:{}".format(host, port))
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, reader, writer):
+        '''
+        Serves the requests of a connection, one at a time.
+        '''
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    await self.dispatch(request, writer)
+                except ConnectionError:
+                    raise
+                except Exception as error:
+                    self.logger.exception("Request failed")
+                    await self.send(writer, {"event": "error", "error": "{}: {}".format(type(error).__name__, error)})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def send(self, writer, message):
+        writer.write(json.dumps(message).encode("utf-8") + b"\n")
+        await writer.drain()
+
+    async def dispatch(self, request, writer):
+        command = request.get("command", "run")
+        if command == "status":
+            await self.send(writer, {"event": "status", "traces": self.store.status(),
+                                     "memory_mb": self.store.used_memory() / 1048576.0})
+        elif command == "evict":
+            evicted = self.store.evict(resolve_path(request["trace"], request.get("cwd")))
+            await self.send(writer, {"event": "evicted", "trace": request["trace"], "evicted": evicted})
+        elif command == "load":
+            await self.load(resolve_path(request["trace"], request.get("cwd")), writer)
+        elif command == "run":
+            await self.run(request, writer)
+        else:
+            raise ValueError("Unknown command {}".format(command))
+
+    async def load(self, tracefn, writer, use=False):
+        '''
+        Gets a trace, loading it if needed.
+        :param use: if True, the trace is marked in use, so that it is not evicted. The caller must then decrement
+                    LoadedTrace.users when done.
+        :return: LoadedTrace
+        '''
+        loop = asyncio.get_running_loop()
+        async with self.loading:
+            loaded, isloaded = await loop.run_in_executor(self.executor, self.store.get, tracefn)
+            if use:
+                loaded.users += 1
+        await self.send(writer, {"event": "trace", "trace": tracefn, "loaded": isloaded, "load_s": loaded.load_s})
+        return loaded
+
+    async def run(self, request, writer):
+        '''
+        Runs a TC against a trace, streaming the outcome of every rule as soon as it is final.
+        '''
+        loop = asyncio.get_running_loop()
+        assert ("tc" in request and "trace" in request), "A run request needs a \"tc\" and a \"trace\""
+        description = resolve_imports(request["tc"], request.get("cwd"))
+        loaded = await self.load(resolve_path(request["trace"], request.get("cwd")), writer, use=True)
+        events = asyncio.Queue()
+
+        def listener(index, rule):
+            event = {"event": "rule", "index": index, "rule": rule}
+            loop.call_soon_threadsafe(events.put_nowait, event)
+
+        def run_test_case():
+            start = time.perf_counter()
+            test_case = TestCase(request.get("name", "<request>"), loaded.trace, description=description,
+                                 listener=listener)
+            if request.get("profile", False):
+                test_case.profile(allocations=False)    # tracemalloc would mix the TCs of all the threads
+            test_case.run()
+            report = test_case.get_report()
+            return {"event": "result", "result": report["result"], "report": report,
+                    "run_s": time.perf_counter() - start}
+
+        def done(future):
+            loaded.users -= 1       # only once the TC is over, even if the client went away meanwhile
+            events.put_nowait(None)
+
+        future = loop.run_in_executor(self.executor, run_test_case)
+        future.add_done_callback(done)
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            await self.send(writer, event)
+        await self.send(writer, future.result())
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+async def request(message, host="127.0.0.1", port=DEFAULT_PORT, socket_path=None):
+    '''
+    Sends a request to a TraceDaemon.
+    :param message: request dict.
+    :return: async generator of the answers, until the last one of the request ("result", "status", etc.).
+    '''
+    if socket_path is not None:
+        reader, writer = await asyncio.open_unix_connection(socket_path, limit=LINE_LIMIT)
+    else:
+        reader, writer = await asyncio.open_connection(host, port, limit=LINE_LIMIT)
+    try:
+        writer.write(json.dumps(message).encode("utf-8") + b"\n")
+        await writer.drain()
+        while True:
+            line = await reader.readline()
+            if not line:
+                raise ConnectionError("Connection closed by the daemon")
+            answer = json.loads(line)
+            yield answer
+            if answer["event"] not in ("trace", "rule"):
+                break
+            if answer["event"] == "trace" and message.get("command", "run") == "load":
+                break
+    finally:
+        writer.close()
@@ -0,0 +1,238 @@
+'''
+Wireshark display filters derived from Test Cases.
+
+A frame can only be matched by a rule if it carries every protocol of the "match" section of the rule, and if the
+mandatory conditions of the rule hold. The display filter of a TC keeps the frames that could be matched by any of
+its rules, so the trace can be cut down by tshark before Trazer reads it:
+
+    (sip and sip.Request-Line contains "INVITE" and sip.Request-Line contains "+436646997348") or (diameter) or ...
+
+Conditions are regular expressions searched in the value of a field. A condition only adds a term to the filter when
+its field is a string field, and then only for the literal text that every match of the expression contains. Values
+with a variable placeholder are used when the variable is static: it is set in "variables" or "import", and no
+"store" section of the TC writes it. Anything else (other field types, variables stored while the TC runs, optional
+conditions) is left out, so the filter never drops a frame that a rule could match. It keeps more frames than the TC
+needs, never fewer.
+
+Field types are read from tshark (tshark -G fields). Without them, the filter only selects the protocols.
+'''
+
+import re
+import logging
+import subprocess
+from .matcher import VARIABLE
+from .reader import tshark_executable, is_capture
+
+try:
+    from re import _parser as sre_parse     # Python 3.11+
+except ImportError:
+    try:
+        import sre_parse
+    except ImportError:
+        sre_parse = None    # no literals: the filters only select protocols
+
+AUTO = "auto"   # value of the --filter option that derives the filter from the TCs
+
+# Types of the fields whose value, as exported to JSON, is the text compared by the "contains" operator
+STRING_TYPES = frozenset(("FT_STRING", "FT_STRINGZ", "FT_UINT_STRING", "FT_STRINGZPAD", "FT_STRINGZTRUNC"))
+
+
+def string_fields(tshark=None):
+    '''
+    Gets the string fields known by tshark.
+    :param tshark: tshark command. Default: environment variable TRAZER_TSHARK, or "tshark" from the PATH.
+    :return: set of field names. None if tshark cannot be run.
+    '''
+    logger = logging.getLogger(__name__)
+    try:
+        output = subprocess.run(tshark_executable(tshark) + ["-G", "fields"], stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, universal_newlines=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError) as error:
+        logger.warning("Cannot get the field types from tshark, filtering by protocol only: {}".format(error))
+        return None
+    fields = set()
+    for line in output.splitlines():
+        columns = line.split("\t")
+        if len(columns) > 3 and columns[0] == "F" and columns[3] in STRING_TYPES:
+            fields.add(columns[2])
+    return fields
+
+
+def required_literals(source):
+    '''
+    Gets the pieces of literal text that every match of a regular expression contains.
+    :param source: regular expression.
+    :return: list of strings. Empty if nothing is certain, e.g. for alternatives or case insensitive expressions.
+    '''
+    if sre_parse is None:
+        return []
+    try:
+        parsed = sre_parse.parse(source)
+    except (re.error, OverflowError, RecursionError):
+        return []
+    if parsed.state.flags & re.IGNORECASE:
+        return []
+    literals = []
+    run = []
+    for op, argument in parsed:
+        if op == sre_parse.LITERAL:
+            run.append(chr(argument))
+            continue
+        if run:
+            literals.append("".join(run))
+            run = []
+    if run:
+        literals.append("".join(run))
+    return literals
+
+
+def quote(literal):
+    '''
+    :return: the literal as a display filter string. None if it has characters that are exported to JSON in escaped
+             form, so the text of the JSON value does not tell what the field contains.
+    '''
+    if any(char < " " or char > "~" or char == "\\" for char in literal):
+        return None
+    return '"{}"'.format(literal.replace('"', '\\"'))
+
+
+def stored_variables(template):
+    '''
+    :return: set of the variables that the "store" sections of the rules write. Stores map a field to the variable
+             that receives its value, e.g. {"sip.msg_hdr_tree": {"sip.Call-ID": "call_id"}}.
+    '''
+    def collect(storedict, variables):
+        for key, value in storedict.items():
+            if type(value) is dict:
+                collect(value, variables)
+            elif key != "optional":
+                variables.add(value)
+
+    variables = set()
+    for rule in template:
+        for items in rule.get("store", {}).values():
+            for item in items:
+                collect(item, variables)
+    return variables
+
+
+class FilterBuilder(object):
+    '''
+    Builds the display filter of a TC template.
+    '''
+
+    def __init__(self, template, tcvars, fields=None):
+        '''
+        :param template: list of rules.
+        :param tcvars: initial value of the TC variables (after "import" and "variables").
+        :param fields: set of the string fields, see string_fields(). Protocols only if None.
+        '''
+        self.template = template
+        self.fields = fields
+        stored = stored_variables(template)
+        self.static = {name: value for name, value in tcvars.items() if name not in stored and type(value) is str}
+
+    def __source(self, value):
+        '''
+        :return: regular expression searched by a condition, with its variable replaced. None if it is not known
+                 before the TC runs.
+        '''
+        if type(value) is not str:
+            return None
+        search_var = VARIABLE.search(value)
+        if not search_var:
+            return value
+        if search_var.group(1) not in self.static:
+            return None
+        return value[:search_var.start()] + self.static[search_var.group(1)] + value[search_var.end():]
+
+    def __conditions_terms(self, conditions, terms):
+        for key, value in conditions.items():
+            if key == "optional":
+                continue
+            if type(value) is dict:
+                self.__conditions_terms(value, terms)
+                continue
+            if self.fields is None or key not in self.fields:
+                continue
+            source = self.__source(value)
+            if source is None:
+                continue
+            for literal in required_literals(source):
+                quoted = quote(literal)
+                if quoted is not None:
+                    term = "{} contains {}".format(key, quoted)
+                    if term not in terms:
+                        terms.append(term)
+
+    def rule_terms(self, rule):
+        '''
+        :return: list of the terms that a frame must meet to match a rule. Empty if any frame could.
+        '''
+        terms = []
+        for protocol, subrules in rule["match"].items():
+            terms.append(protocol)
+            for subrule in subrules:
+                if subrule.get("optional", False) != True:
+                    self.__conditions_terms(subrule, terms)
+        return terms
+
+    def build(self):
+        '''
+        :return: display filter of the frames that could match any rule. None if any frame could.
+        '''
+        rules = []     # terms of each rule, without the rules that keep a subset of the frames of another
+        for rule in self.template:
+            terms = self.rule_terms(rule)
+            if len(terms) == 0:
+                return None
+            if any(set(kept) <= set(terms) for kept in rules):
+                continue
+            rules = [kept for kept in rules if not set(terms) <= set(kept)] + [terms]
+        return join_filters([" and ".join(terms) for terms in rules])
+
+
+def join_filters(filters):
+    '''
+    Joins display filters with "or".
+    :param filters: list of display filters. None stands for all frames.
+    :return: display filter. None if any of the filters is None, or if there are none.
+    '''
+    if len(filters) == 0 or any(display_filter is None for display_filter in filters):
+        return None
+    unique = []
+    for display_filter in filters:
+        if display_filter not in unique:
+            unique.append(display_filter)
+    if len(unique) == 1:
+        return unique[0]
+    return " or ".join("({})".format(display_filter) for display_filter in unique)
+
+
+def test_cases_filter(test_cases, tshark=None):
+    '''
+    Gets the display filter of the frames that any of a set of TCs could use.
+    :param test_cases: list of TestCase.
+    :param tshark: tshark command, to read the field types.
+    :return: display filter. None if no frame can be left out.
+    '''
+    fields = string_fields(tshark)
+    return join_filters([test_case.get_display_filter(fields) for test_case in test_cases])
+
+
+def apply_auto_filter(options, tracefn, test_cases):
+    '''
+    Replaces the "auto" display filter of the Trace options with the filter of the TCs.
+    :param options: keyword arguments of Trace.
+    :param tracefn: trace file, or list of merged trace files. Only captures are filtered.
+    :param test_cases: list of TestCase that run against the trace.
+    :return: keyword arguments of Trace.
+    '''
+    if options.get("display_filter") != AUTO:
+        return options
+    options = dict(options)
+    tracefns = tracefn if isinstance(tracefn, (list, tuple)) else [tracefn]
+    iscapture = any(is_capture(fn) for fn in tracefns)
+    options["display_filter"] = test_cases_filter(test_cases, options.get("tshark")) if iscapture else None
+    logging.getLogger(__name__).info("Display filter of {}: {}".format(tracefn, options["display_filter"]))
+    return options
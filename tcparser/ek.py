@@ -0,0 +1,234 @@
+'''
+Readers for newline-delimited trace exports, such as tshark -T ek (Elasticsearch bulk format).
+
+An EK export holds two lines per frame: an "index" line for Elasticsearch, and the frame itself:
+
+{"index":{"_index":"packets-2023-05-04","_type":"doc"}}
+{"timestamp":"1683187200010","layers":{"frame":{"frame_frame_number":"1",...},"sip":{"sip_sip_Method":"INVITE",...}}}
+
+The name of an EK field is the name of its protocol followed by its Wireshark name, with dots turned into underscores
+(sip_sip_Method for sip.Method). Frames are normalized to the layers of tshark -T json: fields are renamed back to their
+Wireshark names (with the list of fields of tshark, or from the repeated protocol prefix if tshark cannot be run) and
+values are turned into strings. Only the names and values are normalized, not the shape of the layers: EK exports are
+flat, and the subtrees of tshark -T json (e.g. sip.msg_hdr_tree) cannot be rebuilt from them, since neither the export
+nor the field list of tshark tells which subtree a field belongs to. So the rules of a TC written for -T json traces
+that go through a subtree never match an EK trace: rules for EK traces name the fields directly under the protocol.
+Files with a tshark -T json frame ({"_source": {"layers": ...}}) per line are read as they are, subtrees included.
+
+Since every line stands on its own, a trace is split at line boundaries into chunks that a pool of processes parses in
+parallel, one per CPU at most. The frames of the chunks are then put together in trace order.
+'''
+
+import os
+import json
+import logging
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from .reader import tshark_executable
+
+NDJSON_EXTENSIONS = (".ndjson", ".jsonl", ".ek")
+PARALLEL_MIN_BYTES = 4 << 20    # smaller traces are parsed by a single process
+CHUNKS_PER_WORKER = 4           # chunks of a trace per process, to balance the load
+SNIFF_BYTES = 1 << 16           # bytes read to find out the format of a trace
+
+# State of the parsing processes, set by init_parser()
+parser_state = {"names": {}, "projection": None}
+
+
+def sniff(tracefn):
+    '''
+    Finds out whether a trace file is newline-delimited, from its extension or its first line.
+    :param tracefn: path of the trace file.
+    :return: "ek" for EK exports, "json" for a tshark -T json frame per line, None for other traces (e.g. a JSON array).
+    '''
+    with open(tracefn, "rb") as tracefile:
+        head = tracefile.read(SNIFF_BYTES)
+    line = head.lstrip().split(b"\n", 1)[0]
+    if not line.startswith(b"{"):
+        return "ek" if os.path.splitext(tracefn)[1].lower() in NDJSON_EXTENSIONS else None
+    try:
+        document = json.loads(line)
+    except ValueError:
+        return "ek" if os.path.splitext(tracefn)[1].lower() in NDJSON_EXTENSIONS else None
+    return "json" if "_source" in document else "ek"
+
+
+def ek_field_names(tshark=None):
+    '''
+    Gets the EK names of the fields known by tshark.
+    :param tshark: tshark command. Default: environment variable TRAZER_TSHARK, or "tshark" from the PATH.
+    :return: dict EK name -> Wireshark name, e.g. "sip_sip_Call-ID" -> "sip.Call-ID". Empty if tshark cannot be run.
+    '''
+    logger = logging.getLogger(__name__)
+    try:
+        output = subprocess.run(tshark_executable(tshark) + ["-G", "fields"], stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, universal_newlines=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError) as error:
+        logger.warning("Cannot get the field names from tshark, guessing them from the EK names: {}".format(error))
+        return {}
+    names = {}
+    for line in output.splitlines():
+        columns = line.split("\t")
+        if len(columns) > 4 and columns[0] == "F":
+            names["{}_{}".format(columns[4], columns[2]).replace(".", "_")] = columns[2]
+    return names
+
+
+def field_name(key, names):
+    '''
+    Converts the EK name of a field into its Wireshark name.
+    :param key: EK name, e.g. "sip_sip_Call-ID".
+    :param names: see ek_field_names(). The names worked out from the EK names are added to it.
+    :return: Wireshark name, e.g. "sip.Call-ID". Keys that are not EK field names, e.g. protocols, are kept.
+    '''
+    name = names.get(key)
+    if name is not None:
+        return name
+    name = key
+    position = key.find("_")
+    while position > 0:     # <protocol>_<protocol>_<rest of the name>
+        protocol = key[:position]
+        if key.startswith(protocol + "_", position + 1):
+            name = protocol + "." + key[2 * position + 2:]
+            break
+        position = key.find("_", position + 1)
+    names[key] = name   # the same keys come back in every frame
+    return name
+
+
+def normalize_value(value, names):
+    valuetype = type(value)
+    if valuetype is str:
+        return value
+    if valuetype is dict:
+        normalized = {}
+        for key, item in value.items():
+            name = names.get(key) or field_name(key, names)
+            normalized[name] = item if type(item) is str else normalize_value(item, names)
+        return normalized
+    if valuetype is list:
+        return [item if type(item) is str else normalize_value(item, names) for item in value]
+    if valuetype is bool:
+        return "1" if value else "0"
+    if value is None:
+        return ""
+    return str(value)
+
+
+def normalize(document, names):
+    '''
+    Converts a line of a newline-delimited trace into frame layers, as in tshark -T json.
+    :param document: parsed line.
+    :param names: see ek_field_names().
+    :return: frame layers. None for lines without frame (EK "index" lines).
+    '''
+    if "_source" in document:
+        return document["_source"]["layers"]
+    if "layers" not in document:
+        return None
+    layers = dict((protocol, normalize_value(layer, names)) for protocol, layer in document["layers"].items())
+    frame = layers.get("frame")
+    if type(frame) is dict and "timestamp" in document:
+        try:
+            float(frame["frame.time_epoch"])
+        except (KeyError, TypeError, ValueError):    # missing, or written as a date
+            frame["frame.time_epoch"] = "{:.6f}".format(int(document["timestamp"]) / 1000)
+    return layers
+
+
+def iter_ndjson_frames(lines, names, projection=None):
+    '''
+    Parses the lines of a newline-delimited trace.
+    :param lines: iterable of lines, str or bytes.
+    :param names: see ek_field_names().
+    :param projection: projection.Projection applied to the frames.
+    :return: generator of frame layers.
+    '''
+    for line in lines:
+        if not line.strip():
+            continue
+        frame = normalize(json.loads(line), names)
+        if frame is None:
+            continue
+        yield frame if projection is None else projection.apply(frame)
+
+
+def open_ndjson_frames(tracefn, names, compactor=None):
+    '''
+    Generator of the frames of a newline-delimited trace file, in a single process. The file is closed when the
+    generator is.
+    :param tracefn: path of the trace file.
+    :param names: see ek_field_names().
+    :param compactor: frame.FrameCompactor, to compact the frames. Plain dicts if None.
+    :return: generator of frame layers.
+    '''
+    with open(tracefn, "r") as tracefile:
+        for frame in iter_ndjson_frames(tracefile, names):
+            yield frame if compactor is None else compactor.compact(frame)
+
+
+def split_lines(tracefn, parts):
+    '''
+    Splits a file into byte ranges that start and end at line boundaries.
+    :param tracefn: path of the file.
+    :param parts: number of ranges wanted.
+    :return: list of (start, end) offsets. Fewer than "parts" for short files.
+    '''
+    size = os.path.getsize(tracefn)
+    bounds = [0]
+    with open(tracefn, "rb") as tracefile:
+        for part in range(1, parts):
+            offset = max(size * part // parts, bounds[-1])
+            if offset >= size:
+                break
+            tracefile.seek(offset)
+            tracefile.readline()    # up to the end of the line that holds the offset
+            if tracefile.tell() > bounds[-1] and tracefile.tell() < size:
+                bounds.append(tracefile.tell())
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def init_parser(names, projection):
+    '''
+    Sets up a parsing process.
+    '''
+    parser_state["names"] = names
+    parser_state["projection"] = projection
+
+
+def parse_range(tracefn, start, end):
+    '''
+    Parses the lines of a byte range of a trace, in a parsing process.
+    :return: list of frame layers.
+    '''
+    with open(tracefn, "rb") as tracefile:
+        tracefile.seek(start)
+        data = tracefile.read(end - start)
+    return list(iter_ndjson_frames(data.split(b"\n"), parser_state["names"], parser_state["projection"]))
+
+
+def load_ndjson_frames(tracefn, names, projection=None, workers=None):
+    '''
+    Loads all the frames of a newline-delimited trace file, parsing chunks of the file in parallel.
+    :param tracefn: path of the trace file.
+    :param names: see ek_field_names().
+    :param projection: projection.Projection applied to the frames by the parsing processes.
+    :param workers: number of parsing processes. Number of CPUs if None, and never more: the frames parsed by the
+                    processes are unpickled again by the calling process, so extra processes only add work. Traces
+                    smaller than PARALLEL_MIN_BYTES, or a single worker, are parsed in the calling process.
+    :return: list of frame layers, in trace order.
+    '''
+    logger = logging.getLogger(__name__)
+    cpus = os.cpu_count() or 1
+    workers = cpus if workers is None else min(workers, cpus)
+    if workers <= 1 or os.path.getsize(tracefn) < PARALLEL_MIN_BYTES:
+        with open(tracefn, "rb") as tracefile:
+            return list(iter_ndjson_frames(tracefile, names, projection))
+    chunks = split_lines(tracefn, workers * CHUNKS_PER_WORKER)
+    logger.info("Parsing {} in {} chunks with {} processes".format(tracefn, len(chunks), workers))
+    frames = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_parser, initargs=(names, projection)) as executor:
+        for chunk in executor.map(parse_range, [tracefn] * len(chunks), *zip(*chunks)):
+            frames.extend(chunk)
+    return frames
@@ -0,0 +1,227 @@
+'''
+Readers for traces that are still being written: a capture file that dumpcap keeps appending to, a JSON or
+newline-delimited export that tshark writes as it dissects live traffic, or any of them on a pipe.
+
+A followed file is read up to its current end, then polled for the data appended to it, so frames are passed on as
+soon as they are complete. A pipe is read until its writer closes it. Captures (pcap / pcapng) are fed to a tshark
+subprocess reading from its standard input ("-r -") with line buffering ("-l"), so that tshark writes every frame as
+soon as it has dissected it.
+
+A followed trace ends when:
+- a pipe is closed by its writer,
+- a JSON export reaches the closing "]" of its frame array,
+- no data has been appended for "idle_timeout" seconds, if set. Otherwise a followed file is read until the reader
+  is closed, e.g. because the TC is over.
+'''
+
+import os
+import sys
+import json
+import stat
+import time
+import logging
+import tempfile
+import threading
+import subprocess
+from .reader import CHUNK_SIZE, TextReader, iter_json_frames, is_capture, tshark_command
+from . import ek
+
+DEFAULT_POLL_INTERVAL = 0.2     # seconds between two reads of a followed file that has no new data
+CAPTURE_MAGICS = (b"\xd4\xc3\xb2\xa1", b"\xa1\xb2\xc3\xd4", b"\x4d\x3c\xb2\xa1", b"\xa1\xb2\x3c\x4d",
+                  b"\x0a\x0d\x0d\x0a")   # pcap (microsecond and nanosecond, both byte orders) and pcapng
+
+
+def is_pipe(tracefn):
+    '''
+    Checks whether a trace is read from a pipe (or the standard input, "-"), which can only be read once.
+    :param tracefn: path of the trace.
+    :return: True if the trace is not a regular file.
+    '''
+    if tracefn == "-":
+        return True
+    try:
+        return not stat.S_ISREG(os.stat(tracefn).st_mode)
+    except OSError:
+        return False
+
+
+class TailReader(object):
+    '''
+    Binary reader of a file that is still being written, or of a pipe. At the end of a file, reads wait for more data
+    instead of returning nothing.
+    '''
+
+    def __init__(self, source, idle_timeout=None, poll_interval=DEFAULT_POLL_INTERVAL):
+        '''
+        :param source: path of the file, "-" for the standard input, or file descriptor.
+        :param idle_timeout: seconds without new data in a file after which it is considered complete. Never if None.
+        :param poll_interval: seconds between two reads of a file that has no new data.
+        '''
+        if type(source) is int:
+            self.__fd = source
+            self.__isowned = False
+        elif source == "-":
+            self.__fd = sys.stdin.fileno()
+            self.__isowned = False
+        else:
+            self.__fd = os.open(source, os.O_RDONLY)
+            self.__isowned = True
+        self.ispipe = not stat.S_ISREG(os.fstat(self.__fd).st_mode)
+        self.__idle_timeout = idle_timeout
+        self.__poll_interval = poll_interval
+        self.__pending = b""        # data already read by peek()
+        self.__last_data = time.monotonic()
+        self.__ended = False
+
+    def read(self, size=CHUNK_SIZE):
+        '''
+        Reads the data available, waiting for it if there is none yet.
+        :param size: largest number of bytes returned.
+        :return: bytes. Empty at the end of the trace.
+        '''
+        if self.__pending:
+            data, self.__pending = self.__pending[:size], self.__pending[size:]
+            return data
+        while not self.__ended:
+            data = os.read(self.__fd, size)     # unlike file objects, returns as soon as any data is available
+            if data:
+                self.__last_data = time.monotonic()
+                return data
+            if self.ispipe:
+                self.__ended = True     # the writer has closed the pipe
+            elif self.__idle_timeout is not None and time.monotonic() - self.__last_data >= self.__idle_timeout:
+                self.__ended = True
+            else:
+                time.sleep(self.__poll_interval)
+        return b""
+
+    def peek(self, size):
+        '''
+        Gets the first bytes of the remaining data without consuming them, waiting for them if needed.
+        :param size: number of bytes wanted.
+        :return: bytes. Shorter than "size" only at the end of the trace.
+        '''
+        while len(self.__pending) < size:
+            pending = self.__pending
+            self.__pending = b""
+            data = self.read(size - len(pending))
+            self.__pending = pending + data
+            if not data:
+                break
+        return self.__pending[:size]
+
+    def close(self):
+        if self.__isowned:
+            os.close(self.__fd)
+        self.__ended = True
+
+
+def head_of(reader):
+    '''
+    Gets the first bytes of a trace, skipping leading white space for text traces.
+    :return: bytes, empty for an empty trace.
+    '''
+    size = 4
+    while True:
+        head = reader.peek(size)
+        if len(head) < size or head.lstrip():
+            return head if head[:4] in CAPTURE_MAGICS else head.lstrip()
+        size *= 2
+
+
+def iter_ndjson_lines(lines, tshark=None, compactor=None):
+    '''
+    Parses the lines of a newline-delimited trace as they come. The EK field names are only asked to tshark if the
+    trace is an EK export.
+    :param lines: iterable of lines.
+    :param tshark: see ek.ek_field_names().
+    :param compactor: frame.FrameCompactor, to compact the frames. Plain dicts if None.
+    :return: generator of frame layers.
+    '''
+    names = None
+    for line in lines:
+        if not line.strip():
+            continue
+        document = json.loads(line)
+        if names is None:
+            names = {} if "_source" in document else ek.ek_field_names(tshark)
+        frame = ek.normalize(document, names)
+        if frame is not None:
+            yield frame if compactor is None else compactor.compact(frame)
+
+
+def pump(reader, stream):
+    '''
+    Copies the data of a TailReader to a stream until the end of the trace, then closes the stream.
+    '''
+    try:
+        while True:
+            data = reader.read()
+            if not data:
+                break
+            stream.write(data)
+            stream.flush()
+    except (OSError, ValueError):   # tshark is gone, or the stream was closed because the trace is no longer read
+        pass
+    finally:
+        try:
+            stream.close()
+        except OSError:
+            pass
+
+
+def iter_followed_capture(reader, display_filter=None, tshark=None, object_pairs_hook=None, protocols=None):
+    '''
+    Dissects a followed capture with a tshark subprocess that reads it from its standard input.
+    :param reader: TailReader of the capture.
+    :return: generator of frame layers. Raises RuntimeError if tshark fails.
+    '''
+    command = tshark_command("-", display_filter, tshark, protocols) + ["-l"]
+    logging.getLogger(__name__).info("Running {}".format(command))
+    with tempfile.TemporaryFile() as errfile:
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=errfile)
+        feeder = threading.Thread(target=pump, args=(reader, process.stdin), daemon=True)
+        feeder.start()
+        output = TailReader(process.stdout.fileno())
+        try:
+            yield from iter_json_frames(TextReader(output.read), object_pairs_hook=object_pairs_hook)
+            process.wait()      # the export is complete: tshark is about to exit on its own
+        finally:
+            if process.poll() is None:
+                process.terminate()
+            process.stdout.close()
+            returncode = process.wait()
+        if returncode != 0:
+            errfile.seek(0)
+            raise RuntimeError("tshark exited with code {}: {}".format(
+                returncode, errfile.read().decode("utf-8", "replace").strip()))
+
+
+def open_followed_frames(tracefn, display_filter=None, tshark=None, compactor=None, protocols=None,
+                         idle_timeout=None, poll_interval=DEFAULT_POLL_INTERVAL):
+    '''
+    Generator of the frames of a trace that is still being written, yielded as soon as they are complete. The format
+    is found out from the first bytes of the trace: capture, JSON array, or newline-delimited export. The trace is
+    closed when the generator is.
+    :param tracefn: path of the trace, or "-" for the standard input.
+    :param display_filter: for captures, Wireshark display filter applied by tshark.
+    :param tshark: tshark command. See reader.tshark_command().
+    :param compactor: frame.FrameCompactor, to compact the frames. Plain dicts if None.
+    :param protocols: for captures, protocols (layers) to export. All if None.
+    :param idle_timeout: see TailReader.
+    :param poll_interval: see TailReader.
+    :return: generator of frame layers.
+    '''
+    reader = TailReader(tracefn, idle_timeout, poll_interval)
+    try:
+        head = head_of(reader)
+        if head[:4] in CAPTURE_MAGICS or (tracefn != "-" and is_capture(tracefn)):
+            yield from iter_followed_capture(reader, display_filter, tshark, compactor, protocols)
+            return
+        assert (display_filter is None), "Display filters can only be applied to pcap / pcapng captures"
+        if head.startswith(b"["):
+            yield from iter_json_frames(TextReader(reader.read), object_pairs_hook=compactor)
+        elif head:
+            yield from iter_ndjson_lines(TextReader(reader.read), tshark, compactor)
+    finally:
+        reader.close()
@@ -0,0 +1,144 @@
+'''
+Compact in-memory representation of frames.
+
+tshark repeats the same keys (e.g. "sip.msg_hdr_tree", "ip.src") in every frame, and many values as well (addresses,
+methods, header names). A FrameDict stores only the values of a JSON object; its keys live in a "shape", a dict from
+key to position that is shared by all the objects with the same keys. String values are shared through a table as
+well, so the strings repeated across frames are held once.
+
+FrameDict is read-only and supports the dict operations used on frames: "in", [], get(), len(), iteration over the
+keys, keys(), values() and items().
+'''
+
+_item = tuple.__getitem__
+_len = tuple.__len__
+
+STRINGS_LIMIT = 1 << 16     # shared strings kept by a FrameCompactor that reads a stream
+
+
+class FrameDict(tuple):
+    '''
+    Read-only dict whose first item is its shape, followed by its values.
+    '''
+
+    __slots__ = ()
+
+    def __new__(cls, shape, values):
+        return tuple.__new__(cls, (shape,) + tuple(values))
+
+    def __getnewargs__(self):
+        return _item(self, 0), _item(self, slice(1, None))
+
+    def __contains__(self, key):
+        return key in _item(self, 0)
+
+    def __getitem__(self, key):
+        return _item(self, _item(self, 0)[key])
+
+    def get(self, key, default=None):
+        position = _item(self, 0).get(key)
+        if position is None:
+            return default
+        return _item(self, position)
+
+    def __len__(self):
+        return _len(self) - 1
+
+    def __iter__(self):
+        return iter(_item(self, 0))
+
+    def keys(self):
+        return _item(self, 0).keys()
+
+    def values(self):
+        return _item(self, slice(1, None))
+
+    def items(self):
+        return zip(_item(self, 0), _item(self, slice(1, None)))
+
+    def __eq__(self, other):
+        if isinstance(other, (dict, FrameDict)):
+            return to_dict(self) == to_dict(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(to_dict(self))
+
+
+MAPPING_TYPES = (dict, FrameDict)
+
+
+def to_dict(value):
+    '''
+    Converts a compact frame, or any value inside it, back to plain dicts and lists.
+    :param value: FrameDict, or value of a frame.
+    :return: value with the same content made of dicts, lists and scalars.
+    '''
+    valuetype = type(value)
+    if valuetype is FrameDict or valuetype is dict:
+        return {key: to_dict(item) for key, item in value.items()}
+    if valuetype is list:
+        return [to_dict(item) for item in value]
+    return value
+
+
+class FrameCompactor(object):
+    '''
+    Builds FrameDicts while a trace is decoded. Used as the object_pairs_hook of the JSON decoder.
+    '''
+
+    def __init__(self, strings_limit=None):
+        '''
+        :param strings_limit: maximum number of shared strings. The table is emptied when it is exceeded, so that it
+                              does not grow without bound while a long trace is streamed. No limit if None.
+        '''
+        self.__shapes = {}      # tuple of keys -> shape
+        self.__strings = {}
+        self.__strings_limit = strings_limit
+
+    def __call__(self, pairs):
+        strings = self.__strings
+        if self.__strings_limit is not None and len(strings) > self.__strings_limit:
+            strings.clear()
+        keys = tuple([pair[0] for pair in pairs])
+        shape = self.__shapes.get(keys)
+        if shape is None:
+            if len(set(keys)) != len(keys):     # duplicate keys: the last value wins, as with plain dicts
+                return self(list(dict(pairs).items()))
+            shape = {strings.setdefault(key, key): position for position, key in enumerate(keys, 1)}
+            self.__shapes[keys] = shape
+        items = [shape]
+        for key, value in pairs:
+            valuetype = type(value)
+            if valuetype is str:
+                value = strings.setdefault(value, value)
+            elif valuetype is list:
+                value = [strings.setdefault(item, item) if type(item) is str else item for item in value]
+            items.append(value)
+        return tuple.__new__(FrameDict, items)
+
+    def compact(self, value):
+        '''
+        Converts a value made of plain dicts and lists, e.g. a frame decoded without this compactor, to compact form.
+        :param value: frame, or value inside a frame.
+        :return: value with its dicts converted to FrameDicts.
+        '''
+        valuetype = type(value)
+        if valuetype is dict:
+            return self([(key, self.compact(item)) for key, item in value.items()])
+        if valuetype is list:
+            return [self.compact(item) for item in value]
+        return value
+
+    def release(self):
+        '''
+        Drops the shared strings table once a trace is loaded. The strings remain shared by the frames that hold them.
+        :return: void
+        '''
+        self.__strings = {}
@@ -0,0 +1,146 @@
+'''
+Index of the values of a field across the frames of a trace.
+
+A field is identified by its path inside a frame: the protocol followed by the keys to follow down to the field, for
+example ("sip", "sip.msg_hdr_tree", "sip.Call-ID"). The index maps every value of the field to the frames that carry
+it, so that the frames that can match a condition on the field are found without matching every frame.
+
+Conditions are regular expression searches: a literal value also matches the values that contain it. The frames of a
+literal are those of the value equal to it, looked up in the index, and those of the values that contain it, found with
+a single str.find() pass over the distinct values joined together. Only real regular expressions are matched against
+every distinct value.
+'''
+
+import logging
+from array import array
+from bisect import bisect_right
+from .matcher import MATCH
+from .frame import MAPPING_TYPES
+
+SEPARATOR = "\0"   # between the distinct values of a field, when they are searched for a literal
+
+
+def field_values(path, layer):
+    '''
+    Follows a path inside a frame the same way the matcher does, collecting the values of the field.
+    :param path: tuple with the protocol and the keys down to the field.
+    :param layer: value of the protocol (path[0]) in the frame.
+    :return: tuple (list of the string values of the field, True if the frame may match any condition on the field,
+             e.g. because the field holds an empty list)
+    '''
+    values = []
+    unconditional = [False]
+
+    def walk(value, depth):
+        valuetype = type(value)
+        if depth == len(path):
+            if valuetype is str:
+                values.append(value)
+            elif valuetype is list:
+                if len(value) == 0:
+                    unconditional[0] = True
+                for item in value:
+                    if type(item) is str:
+                        values.append(item)
+                    elif type(item) not in MAPPING_TYPES:
+                        unconditional[0] = True
+            elif valuetype not in MAPPING_TYPES:
+                unconditional[0] = True
+        elif valuetype in MAPPING_TYPES:
+            if path[depth] in value:
+                walk(value[path[depth]], depth + 1)
+        elif valuetype is list:
+            if len(value) == 0:
+                unconditional[0] = True
+            for item in value:
+                if type(item) in MAPPING_TYPES:
+                    walk(item, depth)
+
+    walk(layer, 1)
+    return values, unconditional[0]
+
+
+class FieldIndex(object):
+
+    def __init__(self, path, frames):
+        '''
+        :param path: tuple with the protocol and the keys down to the field.
+        :param frames: iterable of frame layers, in trace order.
+        '''
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.values = {}            # value -> array of the indexes of the frames that carry it
+        self.unconditional = []     # frames that may match any condition on the field (e.g. empty lists)
+        self.__candidates = {}      # pattern source -> candidate frames
+        self.__joined = None        # distinct values joined by SEPARATOR, see __containing()
+        self.__starts = None        # offset of every value in __joined
+        self.__keys = None          # distinct values, in the order of __joined
+        self.numframes = 0
+        for index, frame in enumerate(frames):
+            if path[0] in frame:
+                values, unconditional = field_values(path, frame[path[0]])
+                for value in values:
+                    self.__add(index, value)
+                if unconditional:
+                    self.unconditional.append(index)
+            self.numframes = index + 1
+        self.logger.info("Field index for {} built with {} values".format(".".join(path[1:]), len(self.values)))
+
+    def __add(self, index, value):
+        if value not in self.values:
+            self.values[value] = array("L")
+        frames = self.values[value]
+        if len(frames) == 0 or frames[-1] != index:
+            frames.append(index)
+
+    def candidates(self, pattern):
+        '''
+        Gets the frames in which the field can match a pattern.
+        :param pattern: bound matcher.Pattern of a condition on the field.
+        :return: sorted array with the indexes of the frames.
+        '''
+        if pattern.source in self.__candidates:
+            return self.__candidates[pattern.source]
+        frames = set(self.unconditional)
+        literal = pattern.literal() if pattern.isexact else None
+        if pattern.search is None:
+            pass    # values other than strings are compared by equality, and the index only holds strings
+        elif literal is not None and SEPARATOR not in literal:
+            if literal != "":   # an empty match is not a match
+                for value in self.__containing(literal):
+                    frames.update(self.values[value])
+        else:
+            for value, indexes in self.values.items():
+                if pattern.match_str(value) == MATCH:
+                    frames.update(indexes)
+        candidates = array("L", sorted(frames))
+        self.__candidates[pattern.source] = candidates
+        return candidates
+
+    def __containing(self, literal):
+        '''
+        Finds the distinct values of the field that contain a text.
+        :param literal: text without SEPARATOR.
+        :return: generator of the values, the value equal to the text first.
+        '''
+        if literal in self.values:
+            yield literal
+        if self.__joined is None:
+            self.__keys = list(self.values)
+            self.__starts = array("L")
+            offset = 0
+            for value in self.__keys:
+                self.__starts.append(offset)
+                offset += len(value) + 1
+            self.__joined = SEPARATOR.join(self.__keys)
+        find = self.__joined.find
+        position = find(literal)
+        while position >= 0:
+            # the text holds no separator: the occurrence lies inside a single value
+            number = bisect_right(self.__starts, position) - 1
+            value = self.__keys[number]
+            if value != literal:
+                yield value
+            if number + 1 == len(self.__keys):
+                break
+            position = find(literal, self.__starts[number + 1])
@@ -0,0 +1,61 @@
+'''
+Logging set up shared by the command line tools.
+
+Diagnostics on the matching hot path are only produced when their level is enabled, so the default level (WARNING)
+costs nothing while frames are matched. On request, a structured trace with one JSON record per evaluated rule is
+written to a separate file.
+'''
+
+import os
+import json
+import logging
+
+LOGFORMAT = "%(levelname)-9s[%(filename)s:%(lineno)s - %(funcName)s()] %(message)s"
+LOGLEVELS = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
+DEFAULT_LOGFILE = os.path.join("logs", "Trazer.log")
+RULE_TRACE_LOGGER = "tcparser.ruletrace"    # records of this logger carry a "rule_trace" dict
+
+
+class RuleTraceFormatter(logging.Formatter):
+    '''
+    Formats rule trace records as JSON lines.
+    '''
+
+    def format(self, record):
+        return json.dumps(record.rule_trace)
+
+
+def add_logging_arguments(parser):
+    '''
+    Adds the logging options to the parser of a command line tool.
+    :param parser: argparse.ArgumentParser
+    :return: void
+    '''
+    parser.add_argument("--log-level", choices=LOGLEVELS, default="WARNING",
+                        help="Logging level (default: %(default)s). DEBUG slows down matching considerably.")
+    parser.add_argument("--log-file", default=DEFAULT_LOGFILE, help="Log file (default: %(default)s).")
+    parser.add_argument("--rule-trace", metavar="FILE",
+                        help="Write a JSON line with the outcome of every evaluated rule to FILE.")
+
+
+def setup_logging(level="WARNING", filename=DEFAULT_LOGFILE, rule_trace=None):
+    '''
+    Sets up logging for a command line tool.
+    :param level: name of the logging level.
+    :param filename: log file. Its directory is created if it does not exist.
+    :param rule_trace: file where the rule trace is written. No rule trace if None.
+    :return: void
+    '''
+    logdir = os.path.dirname(filename)
+    if logdir:
+        os.makedirs(logdir, exist_ok=True)
+    logging.basicConfig(filename=filename, filemode='w', level=getattr(logging, level), format=LOGFORMAT)
+    ruletrace_logger = logging.getLogger(RULE_TRACE_LOGGER)
+    ruletrace_logger.propagate = False
+    if rule_trace is not None:
+        handler = logging.FileHandler(rule_trace, mode="w")
+        handler.setFormatter(RuleTraceFormatter())
+        ruletrace_logger.addHandler(handler)
+        ruletrace_logger.setLevel(logging.INFO)
+    else:
+        ruletrace_logger.setLevel(logging.WARNING)
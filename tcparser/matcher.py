@@ -0,0 +1,253 @@
+'''
+Compiled "match" sections of TC rules.
+
+A "match" section is compiled once, when the TC is loaded, into a tree of matcher objects. Regular expressions are
+precompiled, and the keys to look up in a frame are fixed lists, so matching a frame does not need to inspect the rule
+dicts again. Values with a variable placeholder ({{name}}) are compiled when the matcher is bound to the TC variables.
+'''
+
+import re
+from .frame import MAPPING_TYPES
+from .profiling import counted
+
+VARIABLE = re.compile("{{(.*)}}")
+REGEX_SPECIAL = frozenset(".^$*+?{}[]|()\\")
+
+# Result of matching a condition against a frame
+NOT_FOUND = -1      # field not present in the frame
+NO_MATCH = 0        # field present but value does not match
+MATCH = 1           # field present and value matches
+
+MISSING = object()  # default of lookups of frame keys
+
+
+class Pattern(object):
+    '''
+    Value of a single condition of a rule. Strings are regular expressions that may contain a variable placeholder,
+    any other value is compared by equality.
+    '''
+
+    def __init__(self, value):
+        self.value = value
+        self.variable = None
+        self.search = None
+        self.source = None
+        self.counter = None     # profiling.EvaluationCounter of the evaluations of the regular expression
+        self.isexact = False    # True for literal strings and strings with a variable placeholder
+        if type(value) is str:
+            search_var = VARIABLE.search(value)
+            if search_var:
+                self.variable = search_var.group(1)
+                self.__placeholder = search_var
+                self.__prefix = value[:search_var.start()]
+                self.__suffix = value[search_var.end():]
+                self.isexact = True
+            else:
+                self.__compile(value)
+                self.isexact = REGEX_SPECIAL.isdisjoint(value)
+
+    def __compile(self, source):
+        self.source = source
+        self.search = re.compile(source).search
+        if self.counter is not None:
+            self.search = counted(self.search, self.counter)
+
+    def count_evaluations(self, counter):
+        '''
+        Counts the evaluations of the regular expression from now on.
+        :param counter: profiling.EvaluationCounter
+        '''
+        self.counter = counter
+        if self.source is not None:
+            self.__compile(self.source)
+
+    def bind(self, tcvars):
+        '''
+        Replaces the variable placeholder with its current value, as re.sub() does: the value is not escaped, but its
+        backslash escapes and group references are expanded.
+        :param tcvars: TC variables.
+        :return: void. Raises exception if the variable does not exist.
+        '''
+        assert (self.variable in tcvars), "{} not stored.".format(self.variable)
+        value = tcvars[self.variable]
+        if "\\" in value:
+            value = self.__placeholder.expand(value)
+        source = self.__prefix + value + self.__suffix
+        if source != self.source:
+            self.__compile(source)
+
+    def literal(self):
+        '''
+        :return: the text that the bound pattern looks for, if it has no regular expression syntax. None otherwise.
+        '''
+        if self.source is not None and REGEX_SPECIAL.isdisjoint(self.source):
+            return self.source
+        return None
+
+    def match_str(self, value):
+        if self.search is None:
+            return MATCH if self.value == value else NO_MATCH
+        searchres = self.search(value)
+        if searchres is None or searchres.end() == searchres.start():
+            return NO_MATCH
+        return MATCH
+
+    def match_value(self, value):
+        '''
+        Matches a value from a frame.
+        :param value: value of the field in the frame.
+        :return: MATCH or NO_MATCH
+        '''
+        valuetype = type(value)
+        if valuetype is str:
+            return self.match_str(value)
+        if valuetype is list:
+            matchtype = MATCH   # an empty list matches
+            for item in value:
+                itemtype = type(item)
+                if itemtype is str:
+                    matchtype = self.match_str(item)
+                elif itemtype in MAPPING_TYPES:
+                    matchtype = NO_MATCH
+                else:
+                    matchtype = MATCH if self.value == item else NO_MATCH
+                if matchtype == MATCH:
+                    break
+            return matchtype
+        if valuetype in MAPPING_TYPES:
+            return NO_MATCH
+        return MATCH if self.value == value else NO_MATCH
+
+
+class DictMatcher(object):
+    '''
+    Matches a dict of conditions (a subrule, or a dict nested inside it) against a dict of the frame. All the
+    conditions must match.
+    '''
+
+    def __init__(self, subrule, patterns):
+        '''
+        :param subrule: dict of conditions from the rule.
+        :param patterns: list where the patterns with variable placeholders are collected.
+        '''
+        self.entries = []
+        for key, value in subrule.items():
+            if key == "optional":
+                continue
+            if type(value) is dict:
+                child = DictMatcher(value, patterns)
+            else:
+                child = Pattern(value)
+                if child.variable is not None:
+                    patterns.append(child)
+            self.entries.append((key, child))
+
+    def count_evaluations(self, counter):
+        for key, child in self.entries:
+            child.count_evaluations(counter)
+
+    def match(self, framedict):
+        '''
+        :param framedict: dictionary of frame to match against the conditions.
+        :return: NOT_FOUND, NO_MATCH or MATCH
+        '''
+        matchtype = MATCH
+        for key, child in self.entries:
+            value = framedict.get(key, MISSING)
+            if value is MISSING:
+                return NOT_FOUND
+            matchtype = child.match_value(value)
+            if matchtype != MATCH:
+                break
+        return matchtype
+
+    def match_value(self, value):
+        valuetype = type(value)
+        if valuetype in MAPPING_TYPES:
+            return self.match(value)
+        if valuetype is list:
+            matchtype = MATCH   # an empty list matches
+            for item in value:
+                matchtype = self.match(item) if type(item) in MAPPING_TYPES else NO_MATCH
+                if matchtype == MATCH:
+                    break
+            return matchtype
+        return NO_MATCH
+
+
+class RuleMatcher(object):
+    '''
+    Compiled "match" section of a rule.
+    '''
+
+    def __init__(self, match):
+        '''
+        :param match: "match" section of the rule. Keys are protocols, values are lists of subrules.
+        '''
+        self.__patterns = []     # patterns with variable placeholders
+        self.protocols = []
+        self.protocol_names = list(match.keys())
+        self.fields = []         # (path, pattern) of the mandatory conditions
+        self.exact_fields = []   # (path, pattern) of the mandatory conditions with exact values
+        for protocol, subrules in match.items():
+            compiled = []
+            for subrule in subrules:
+                isoptional = subrule.get("optional", False) == True
+                matcher = DictMatcher(subrule, self.__patterns)
+                compiled.append((isoptional, matcher))
+                if not isoptional:
+                    self.__collect_fields((protocol,), matcher)
+            self.protocols.append((protocol, compiled))
+        self.variables = frozenset(pattern.variable for pattern in self.__patterns)    # variables used by the rule
+
+    def __collect_fields(self, path, matcher):
+        for key, child in matcher.entries:
+            if type(child) is DictMatcher:
+                self.__collect_fields(path + (key,), child)
+                continue
+            self.fields.append((path + (key,), child))
+            if child.isexact:
+                self.exact_fields.append((path + (key,), child))
+
+    def count_evaluations(self, counter):
+        '''
+        Counts the evaluations of the regular expressions of the rule from now on.
+        :param counter: profiling.EvaluationCounter
+        '''
+        for protocol, subrules in self.protocols:
+            for isoptional, matcher in subrules:
+                matcher.count_evaluations(counter)
+
+    def is_bindable(self, tcvars):
+        '''
+        :param tcvars: TC variables.
+        :return: True if all the variables used by the rule exist.
+        '''
+        return all(variable in tcvars for variable in self.variables)
+
+    def bind(self, tcvars):
+        '''
+        Sets the current value of the variables used by the rule.
+        :param tcvars: TC variables.
+        :return: void. Raises exception if a variable does not exist.
+        '''
+        for pattern in self.__patterns:
+            pattern.bind(tcvars)
+
+    def match(self, frame):
+        '''
+        Checks whether the frame matches the rule.
+        :param frame: dictionary with the content of a wireshark frame.
+        :return: True if all the mandatory conditions match, and the optional ones either match or are not present.
+        '''
+        if len(frame) == 0:     # empty frame
+            return False
+        for protocol, subrules in self.protocols:
+            layer = frame.get(protocol, MISSING)
+            if layer is MISSING:
+                return False
+            for isoptional, matcher in subrules:
+                matchtype = matcher.match_value(layer)
+                if matchtype != MATCH and (matchtype == NO_MATCH or not isoptional):
+                    return False
+        return True
@@ -0,0 +1,83 @@
+'''
+Merge of the traces of several interfaces (e.g. Gm, Cx, Sh and S6a captured on different probes) into a single
+sequence of frames, ordered by frame.time_epoch.
+
+The traces are read in parallel, one frame at a time, through a k-way merge: only the next frame of every trace is held
+in memory, whatever the size of the traces. Frames with the same time keep the order of the traces, and the frames of
+a trace always keep their order: a frame without time takes the time of the frame before it.
+
+As mergecap does, frame.number is renumbered in merged order. The origin of every frame is kept in an extra layer:
+
+"trazer": {
+    "trazer.file": "gm.json",           trace file of the frame
+    "trazer.frame_number": "12"         frame.number of the frame inside it
+}
+'''
+
+import heapq
+from .frame import MAPPING_TYPES
+
+MERGE_LAYER = "trazer"
+FILE_FIELD = "trazer.file"
+NUMBER_FIELD = "trazer.frame_number"
+
+
+def timed_frames(frames, source):
+    '''
+    Keys the frames of a trace for the merge.
+    :param frames: iterable of frame layers.
+    :param source: position of the trace in the merge.
+    :return: generator of tuples (time, source, position of the frame in the trace, frame layers).
+    '''
+    epoch = float("-inf")
+    for position, frame in enumerate(frames):
+        layer = frame.get("frame")
+        if type(layer) in MAPPING_TYPES:
+            try:
+                epoch = float(layer["frame.time_epoch"])
+            except (KeyError, TypeError, ValueError):
+                pass
+        yield epoch, source, position, frame
+
+
+def merge_frames(sources, tracefns, projection=None, compactor=None):
+    '''
+    Merges the frames of several traces in time order. The traces are closed when the generator is.
+    :param sources: list of generators of the frames of every trace, as plain dicts.
+    :param tracefns: list of the trace files, in the same order.
+    :param projection: projection.Projection applied to the frames of every trace.
+    :param compactor: frame.FrameCompactor, to compact the merged frames. Plain dicts if None.
+    :return: generator of frame layers, with their origin (see module description).
+    '''
+    if projection is not None:
+        streams = [timed_frames(map(projection.apply, frames), source) for source, frames in enumerate(sources)]
+    else:
+        streams = [timed_frames(frames, source) for source, frames in enumerate(sources)]
+    try:
+        for number, (epoch, source, position, frame) in enumerate(heapq.merge(*streams), 1):
+            original = str(position + 1)
+            layer = frame.get("frame")
+            if type(layer) is dict:
+                original = layer.get("frame.number", original)
+                layer["frame.number"] = str(number)
+            frame[MERGE_LAYER] = {FILE_FIELD: tracefns[source], NUMBER_FIELD: original}
+            yield frame if compactor is None else compactor.compact(frame)
+    finally:
+        for frames in sources:
+            frames.close()
+
+
+def frame_origin(frame):
+    '''
+    Gets the origin of a merged frame, for the reports.
+    :param frame: frame layers.
+    :return: dict with the "file" and "frame_number" of the frame in its trace. None if the frame was not merged.
+    '''
+    layer = frame.get(MERGE_LAYER)
+    if layer is None:
+        return None
+    try:
+        number = int(layer[NUMBER_FIELD])
+    except (TypeError, ValueError):
+        number = layer[NUMBER_FIELD]
+    return {"file": layer[FILE_FIELD], "frame_number": number}
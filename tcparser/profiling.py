@@ -0,0 +1,170 @@
+'''
+Per-rule performance instrumentation of Test Cases.
+
+When a TC is profiled (see TestCase.profile()), every rule entry of its report gets a "perf" block:
+
+"perf": {
+  "frames_examined": frames fed to the rule,
+  "regex_evaluations": regular expressions of the rule evaluated against frame values (including the pre-filtering of
+                       the frames by the field indexes or columns of the trace, and the "verify" section),
+  "store_extractions": variables stored by the rule,
+  "start_s": start of the rule, in seconds since the start of the TC,
+  "wall_s": seconds between the start and the end of the rule,
+  "busy_s": seconds spent evaluating the rule. Lower than wall_s when other TCs, or other runs of the TC (optional
+            rules), are evaluated meanwhile,
+  "allocated_bytes": growth of the memory allocated by Python while the rule was evaluated, summed over the frames
+                     (only when allocations are traced, with tracemalloc)
+}
+
+Profiled reports can be exported in the Trace Event Format of Chrome (see write_chrome_trace()), which chrome://tracing,
+Perfetto (https://ui.perfetto.dev) and speedscope display as a timeline of the rules of every TC.
+'''
+
+import json
+import time
+import tracemalloc
+
+# Number of profilers that need tracemalloc, which is shared by the whole process
+tracemalloc_users = [0]
+
+
+class EvaluationCounter(object):
+    '''
+    Number of regular expression evaluations of a TC.
+    '''
+
+    def __init__(self):
+        self.count = 0
+
+
+def counted(search, counter):
+    '''
+    Wraps the search function of a compiled regular expression so that its calls are counted.
+    :param search: re.Pattern.search
+    :param counter: EvaluationCounter
+    :return: function with the same behaviour as "search".
+    '''
+    def search_counted(*args):
+        counter.count += 1
+        return search(*args)
+    return search_counted
+
+
+class Profiler(object):
+    '''
+    Measures the work done for each rule of a TC. Shared by all the runs of the TC (see TestRun).
+    '''
+
+    def __init__(self, allocations=True):
+        '''
+        :param allocations: if True, the memory allocated while each rule is evaluated is measured with tracemalloc.
+                            Slows down the TC several times. The measures of TCs run in parallel threads mix.
+        '''
+        self.counter = EvaluationCounter()
+        self.allocations = allocations
+        self.origin = None
+        self.__istracing = False    # True while this profiler holds tracemalloc
+
+    def start(self):
+        '''
+        Starts profiling, at the start of the TC.
+        '''
+        self.origin = time.perf_counter()
+        if self.allocations and not self.__istracing:
+            if tracemalloc_users[0] == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc_users[0] += 1
+            self.__istracing = True
+
+    def stop(self):
+        '''
+        Stops profiling, at the end of the TC. Stops tracemalloc if no other profiler uses it.
+        '''
+        if self.__istracing:
+            tracemalloc_users[0] -= 1
+            if tracemalloc_users[0] == 0:
+                tracemalloc.stop()
+            self.__istracing = False
+
+    def new_rule(self):
+        '''
+        :return: perf block of a rule that starts now.
+        '''
+        perf = {
+            "frames_examined": 0,
+            "regex_evaluations": 0,
+            "store_extractions": 0,
+            "start_s": time.perf_counter() - self.origin,
+            "wall_s": 0.0,
+            "busy_s": 0.0
+        }
+        if self.__istracing:
+            perf["allocated_bytes"] = 0
+        return perf
+
+    def snapshot(self):
+        '''
+        :return: state of the measures before evaluating a rule, to pass to add().
+        '''
+        memory = tracemalloc.get_traced_memory()[0] if self.__istracing else 0
+        return time.perf_counter(), self.counter.count, memory
+
+    def add(self, perf, snapshot):
+        '''
+        Adds to the perf block of a rule the work done since a snapshot.
+        '''
+        start, count, memory = snapshot
+        if self.__istracing:
+            perf["allocated_bytes"] += max(0, tracemalloc.get_traced_memory()[0] - memory)
+        perf["regex_evaluations"] += self.counter.count - count
+        perf["busy_s"] += time.perf_counter() - start
+
+    def end_rule(self, perf):
+        '''
+        Completes the perf block of a rule that ends now.
+        '''
+        perf["wall_s"] = time.perf_counter() - self.origin - perf["start_s"]
+
+
+def chrome_trace_events(report, pid, name):
+    '''
+    Converts the perf blocks of a TC report into events of the Trace Event Format.
+    :param report: TC report dict (see TcReport.get_report()).
+    :param pid: number of the TC in the trace, shown as a process.
+    :param name: name of the TC.
+    :return: list of events. Rules without "perf" block are left out.
+    '''
+    events = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": name}}]
+    for index, rule in enumerate(report.get("rules", [])):
+        perf = rule.get("perf")
+        if perf is None:
+            continue
+        args = dict(perf, result=rule.get("result"), optional=rule.get("optional", False))
+        if "frame_number" in rule:
+            args["frame_number"] = rule["frame_number"]
+        events.append({
+            "name": (rule.get("metadata") or {}).get("name") or "rule {}".format(index),
+            "cat": "rule",
+            "ph": "X",
+            "ts": perf["start_s"] * 1e6,
+            "dur": perf["wall_s"] * 1e6,
+            "pid": pid,
+            "tid": 0,
+            "args": args
+        })
+    return events
+
+
+def write_chrome_trace(filepath, reports):
+    '''
+    Writes the perf blocks of TC reports as a JSON trace of Chrome (Trace Event Format).
+    :param filepath: trace file.
+    :param reports: list of (TC name, TC report dict).
+    :return: number of rules written.
+    '''
+    events = []
+    for pid, (name, report) in enumerate(reports):
+        events.extend(chrome_trace_events(report, pid, name))
+    with open(filepath, "w") as fp:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fp)
+    return sum(1 for event in events if event["ph"] == "X")
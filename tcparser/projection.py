@@ -0,0 +1,113 @@
+'''
+Projection of frames on the fields used by Test Cases.
+
+Most frames carry layers (eth, ip, udp, rtp, ...) that no rule looks at. A Projection collects the paths that the
+"match" and "store" sections of the rules follow inside a frame, and strips everything else from the frames while the
+trace is loaded. The frame number and time are always kept. "verify" sections work on TC variables only, so they do
+not add any path.
+
+Projected frames match the rules exactly as the complete frames do: every key that a rule follows is kept with its
+whole content, and lists keep all their items.
+'''
+
+import logging
+from .frame import MAPPING_TYPES
+
+ALL = True      # keep the whole content of a key
+
+# Fields kept in every frame
+FRAME_FIELDS = {"frame": {"frame.number": ALL, "frame.time_epoch": ALL, "frame.time_relative": ALL}}
+
+
+class Projection(object):
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.tree = {}      # key -> ALL, or dict with the keys to keep inside the value of the key
+        self.add_paths(FRAME_FIELDS)
+
+    def add_paths(self, paths, tree=None):
+        '''
+        Adds paths to the projection.
+        :param paths: dict key -> ALL, or dict of the keys to keep inside the value of the key.
+        :param tree: node of the projection where the paths are added. The root if None.
+        :return: void
+        '''
+        if tree is None:
+            tree = self.tree
+        for key, subpaths in paths.items():
+            if subpaths is ALL or tree.get(key) is ALL:
+                tree[key] = ALL
+            else:
+                self.add_paths(subpaths, tree.setdefault(key, {}))
+
+    def __conditions_paths(self, conditions):
+        '''
+        Gets the paths followed by a dict of conditions of a "match" or "store" section. Keys whose condition is not a
+        dict are compared, or stored, as a whole.
+        '''
+        paths = {}
+        for key, condition in conditions.items():
+            if key == "optional":
+                continue
+            paths[key] = self.__conditions_paths(condition) if type(condition) is dict else ALL
+        return paths
+
+    def add_rule(self, rule):
+        '''
+        Adds the paths used by a rule.
+        :param rule: rule of a TC template.
+        :return: void
+        '''
+        for section in ("match", "store"):
+            for protocol, items in rule.get(section, {}).items():
+                if len(items) == 0:
+                    self.add_paths({protocol: {}})
+                for item in items:
+                    self.add_paths({protocol: self.__conditions_paths(item)})
+
+    def add_template(self, template):
+        '''
+        Adds the paths used by all the rules of a TC template.
+        :param template: list of rules.
+        :return: void
+        '''
+        for rule in template:
+            self.add_rule(rule)
+
+    def merge(self, other):
+        '''
+        Adds the paths of another projection, e.g. from another TC that runs against the same trace.
+        :param other: Projection
+        :return: void
+        '''
+        self.add_paths(other.tree)
+
+    def protocols(self):
+        '''
+        :return: list of the protocols (layers) kept in the frames.
+        '''
+        return list(self.tree.keys())
+
+    def apply(self, frame):
+        '''
+        Projects a frame.
+        :param frame: frame layers.
+        :return: new dict with the projected frame. Kept values are shared with the original frame.
+        '''
+        return self.__project(frame, self.tree)
+
+    def __project(self, value, tree):
+        valuetype = type(value)
+        if valuetype in MAPPING_TYPES:
+            projected = {}
+            for key, item in value.items():
+                subtree = tree.get(key)
+                if subtree is ALL:
+                    projected[key] = item
+                elif subtree is not None:
+                    projected[key] = self.__project(item, subtree)
+            return projected
+        if valuetype is list:
+            return [self.__project(item, tree) for item in value]
+        return value
@@ -0,0 +1,268 @@
+'''
+Incremental readers for Wireshark JSON exports.
+
+tshark writes a trace as a single top-level JSON array of frames. The readers in this module parse that array one
+element at a time, so a trace never needs to be held in memory as a whole. The array can be read from a file, or
+straight from the output of tshark while it dissects a capture.
+'''
+
+import os
+import json
+import shlex
+import codecs
+import logging
+import tempfile
+import subprocess
+from collections import deque
+
+CHUNK_SIZE = 1 << 16        # characters read from the trace file at a time
+DEFAULT_LOOKBACK = 256      # frames kept in memory behind the furthest frame read
+CAPTURE_EXTENSIONS = (".pcap", ".pcapng", ".cap")
+TSHARK_ENV = "TRAZER_TSHARK"    # environment variable with the tshark command to run
+JSON_LITERALS = ("true", "false", "null", "NaN", "Infinity", "-Infinity")
+
+
+def is_truncated(error):
+    '''
+    Tells whether a JSON decoding error comes from the end of the text, which may be the start of a valid document,
+    rather than from a syntax error.
+    :param error: json.JSONDecodeError
+    :return: True if reading more text may fix the error.
+    '''
+    rest = error.doc[error.pos:]
+    if len(rest) <= 1 or error.msg.startswith("Unterminated string"):
+        return True
+    if error.msg == "Invalid \\uXXXX escape":
+        return len(rest) <= 5
+    if error.msg == "Expecting value":
+        return any(literal.startswith(rest) for literal in JSON_LITERALS)
+    return False
+
+
+def iter_json_frames(fp, chunk_size=CHUNK_SIZE, object_pairs_hook=None):
+    '''
+    Parses the top-level frame array of a tshark JSON export incrementally.
+    Only the frame being decoded (plus one read chunk) is held in memory. A syntax error is raised as soon as it is
+    read, not at the end of the trace.
+    :param fp: text file object positioned at the start of the export.
+    :param chunk_size: number of characters to read from fp at a time.
+    :param object_pairs_hook: builds the objects of the frames from their key / value pairs. Plain dicts if None.
+    :return: generator of the "_source" / "layers" dict of each frame.
+    '''
+    decoder = json.JSONDecoder(object_pairs_hook=object_pairs_hook)
+    buf = ""
+    pos = 0
+    started = False
+    while True:
+        # skip white space and separators between frames
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buf):
+            if not started:
+                if buf[pos] != "[":
+                    raise ValueError("Trace does not start with a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == "]":
+                return
+            try:
+                frame, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError as error:
+                if not is_truncated(error):
+                    raise
+                end = -1    # frame is not complete yet. Read more.
+            if end >= 0:
+                pos = end
+                yield frame["_source"]["layers"]
+                continue
+        buf = buf[pos:]
+        pos = 0
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            if len(buf) > 0:
+                decoder.decode(buf)     # raises an error describing the malformed frame
+            if started:
+                raise ValueError("Trace ends before the closing ']' of the frame array")
+            return
+        buf += chunk
+
+
+class TextReader(object):
+    '''
+    Text reader of a binary source that returns the data available as soon as there is any, instead of waiting for a
+    whole chunk like the text file objects of pipes do. Used to parse a trace while it is being written.
+    '''
+
+    def __init__(self, read):
+        '''
+        :param read: function that reads at most a number of bytes from the source, returning those available, and
+                     nothing at the end of the source. E.g. the read1() method of a buffered pipe.
+        '''
+        self.__read = read
+        self.__decoder = codecs.getincrementaldecoder("utf-8")()
+
+    def read(self, size=CHUNK_SIZE):
+        '''
+        :return: str. Empty at the end of the source.
+        '''
+        while True:
+            data = self.__read(size)
+            text = self.__decoder.decode(data, final=not data)
+            if text or not data:
+                return text
+
+    def __iter__(self):
+        '''
+        Iterates the lines of the source, as soon as each of them is complete.
+        '''
+        buf = ""
+        while True:
+            chunk = self.read()
+            if not chunk:
+                break
+            lines = (buf + chunk).split("\n")
+            buf = lines.pop()
+            for line in lines:
+                yield line
+        if buf:
+            yield buf
+
+
+def open_json_frames(tracefn, object_pairs_hook=None):
+    '''
+    Generator of the frames inside a tshark JSON export file. The file is closed when the generator is.
+    :param tracefn: path of the JSON trace file.
+    :param object_pairs_hook: see iter_json_frames().
+    :return: generator of frame layers.
+    '''
+    with open(tracefn, "r") as tracefile:
+        yield from iter_json_frames(tracefile, object_pairs_hook=object_pairs_hook)
+
+
+def is_capture(tracefn):
+    '''
+    Checks whether a trace file is a capture that must be dissected by tshark, rather than a JSON export.
+    :param tracefn: path of the trace file.
+    :return: True for pcap and pcapng files.
+    '''
+    return os.path.splitext(tracefn)[1].lower() in CAPTURE_EXTENSIONS
+
+
+def tshark_executable(tshark=None):
+    '''
+    :param tshark: tshark command. Default: environment variable TRAZER_TSHARK, or "tshark" from the PATH.
+    :return: list of arguments that run tshark.
+    '''
+    if tshark is None:
+        tshark = os.environ.get(TSHARK_ENV, "tshark")
+    return shlex.split(tshark, posix=(os.name != "nt"))
+
+
+def tshark_command(capturefn, display_filter=None, tshark=None, protocols=None):
+    '''
+    Builds the command line that exports a capture to JSON on the standard output.
+    :param capturefn: path of the pcap or pcapng file.
+    :param display_filter: Wireshark display filter applied to the capture. All frames if None.
+    :param tshark: tshark command. Default: environment variable TRAZER_TSHARK, or "tshark" from the PATH.
+    :param protocols: protocols (layers) to export. All if None.
+    :return: list of arguments.
+    '''
+    command = tshark_executable(tshark)
+    command += ["-n", "-r", capturefn, "-T", "json", "--no-duplicate-keys"]
+    if display_filter:
+        command += ["-Y", display_filter]
+    if protocols:
+        command += ["-J", " ".join(protocols)]
+    return command
+
+
+def open_tshark_frames(capturefn, display_filter=None, tshark=None, object_pairs_hook=None, protocols=None):
+    '''
+    Generator of the frames of a capture, dissected by a tshark subprocess. Frames are yielded as soon as tshark writes
+    them, without an intermediate file. tshark is stopped when the generator is closed.
+    :param capturefn: path of the pcap or pcapng file.
+    :param display_filter: Wireshark display filter applied to the capture. All frames if None.
+    :param tshark: tshark command. See tshark_command().
+    :param object_pairs_hook: see iter_json_frames().
+    :param protocols: protocols (layers) to export. All if None.
+    :return: generator of frame layers. Raises RuntimeError if tshark fails.
+    '''
+    command = tshark_command(capturefn, display_filter, tshark, protocols)
+    logging.getLogger(__name__).info("Running {}".format(command))
+    with tempfile.TemporaryFile() as errfile:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=errfile)
+        try:
+            yield from iter_json_frames(TextReader(process.stdout.read1), object_pairs_hook=object_pairs_hook)
+            process.wait()      # the export is complete: tshark is about to exit on its own
+        finally:
+            if process.poll() is None:
+                process.terminate()
+            process.stdout.close()
+            returncode = process.wait()
+        if returncode != 0:
+            errfile.seek(0)
+            raise RuntimeError("tshark exited with code {}: {}".format(
+                returncode, errfile.read().decode("utf-8", "replace").strip()))
+
+
+class FrameStream(object):
+    '''
+    Random access on top of a frame generator, with a bounded look-back buffer.
+
+    Frames are read forward on demand. The last "lookback" frames stay in memory so that a test case can rewind a
+    short distance for free. Rewinding further back re-opens the source and reads forward again from its start.
+    '''
+
+    def __init__(self, opener, lookback=DEFAULT_LOOKBACK):
+        '''
+        :param opener: callable without arguments that returns a new generator of frames from the start of the trace.
+        :param lookback: number of frames to keep in memory.
+        '''
+        assert(lookback > 0), "Look-back buffer must hold at least one frame"
+        self.logger = logging.getLogger(__name__)
+        self.__opener = opener
+        self.__buffer = deque(maxlen=lookback)
+        self.__frames = None
+        self.__next_index = 0       # index of the next frame to be read from the source
+        self.numpackets = None      # known once the whole source has been read
+        self.__reopen()
+
+    def __reopen(self):
+        if self.__frames is not None:
+            self.__frames.close()
+        self.__frames = self.__opener()
+        self.__buffer.clear()
+        self.__next_index = 0
+
+    def __read_next(self):
+        try:
+            frame = next(self.__frames)
+        except StopIteration:
+            self.numpackets = self.__next_index
+            return False
+        self.__buffer.append(frame)
+        self.__next_index += 1
+        return True
+
+    def get(self, index):
+        '''
+        Returns the frame at position "index" of the trace.
+        :param index: position of the frame inside the trace.
+        :return: layers of the frame, or None if the trace has fewer frames.
+        '''
+        if self.numpackets is not None and index >= self.numpackets:
+            return None
+        first = self.__next_index - len(self.__buffer)    # index of the oldest frame in the buffer
+        if index < first:
+            self.logger.info("Frame {} is out of the look-back buffer. Re-reading trace.".format(index))
+            self.__reopen()
+        while self.__next_index <= index:
+            if not self.__read_next():
+                return None
+        return self.__buffer[index - (self.__next_index - len(self.__buffer))]
+
+    def close(self):
+        if self.__frames is not None:
+            self.__frames.close()
+            self.__frames = None
@@ -0,0 +1,56 @@
+'''
+Runs several test cases against the same trace.
+
+The trace is read once. All the TCs are advanced together, frame by frame, so each frame is fetched from the trace a
+single time for every TC that is waiting for it.
+'''
+
+import heapq
+import logging
+
+
+def run_test_cases(trace, test_cases, on_error=None):
+    '''
+    Runs all test cases against a trace in a single pass.
+    Each TC keeps its own state and report. TCs whose optional rules are not matched rewind on their own, without
+    affecting the others.
+    :param trace: Trace shared by all TCs.
+    :param test_cases: list of TestCase objects built on top of "trace".
+    :param on_error: function called with (TestCase, exception) when a TC raises an exception. The TC is left
+                     unfinished and the others go on. If None, the exception is raised. Exceptions of the trace are
+                     always raised.
+    :return: void
+    '''
+    logger = logging.getLogger(__name__)
+    waiting = {}    # frame index -> TCs waiting for that frame
+    cursors = []    # heap of the frame indexes inside "waiting"
+
+    def schedule(test_case):
+        index = test_case.get_frame_cursor()
+        if index < 0:
+            return  # TC finished
+        if index not in waiting:
+            waiting[index] = []
+            heapq.heappush(cursors, index)
+        waiting[index].append(test_case)
+
+    def advance(test_case, step, *args):
+        try:
+            step(*args)
+            schedule(test_case)
+        except Exception as error:
+            if on_error is None:
+                raise
+            on_error(test_case, error)
+
+    for test_case in test_cases:
+        advance(test_case, test_case.start)
+    while len(cursors) > 0:
+        index = heapq.heappop(cursors)
+        frame = trace.get_frame(index)
+        for test_case in waiting.pop(index):
+            if frame is None:
+                advance(test_case, test_case.end_of_trace)
+            else:
+                advance(test_case, test_case.feed, index, frame)
+    logger.info("{} test cases run".format(len(test_cases)))
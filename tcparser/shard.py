@@ -0,0 +1,247 @@
+'''
+Runs a Test Case on every conversation of a trace, on a pool of processes.
+
+Load test captures hold thousands of independent calls or sessions. The trace is split into shards by a correlation
+key, a field such as the SIP Call-ID or the Diameter Session-Id: a shard holds the frames that carry the same value of
+the key, in trace order. The TC is then evaluated on every shard on its own, as if each shard were a trace, and each
+shard gets its own report.
+
+The key can be given as several fields: the key of a frame is the value of the first of them that the frame carries.
+A frame that carries several values of the key (e.g. a list) belongs to every shard of those values. Frames without
+any of the fields are left out.
+
+The frames of a shard are numbered from 0 while the TC runs on it (in the logs and the rule trace), but the reports give
+the index of every matched frame in the whole trace, as a report on the trace would: "frame_number" is the index in the
+trace and "shard_frame_number" the index in the shard.
+'''
+
+import os
+import json
+import time
+import logging
+import traceback
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from .trace import Trace
+from .test_case import TestCase
+from .frame import MAPPING_TYPES
+from .batch import init_worker, error_result
+from .logs import DEFAULT_LOGFILE
+
+# Short names of common correlation keys
+KEY_ALIASES = {
+    "call-id": ("sip.Call-ID",),
+    "session-id": ("diameter.Session-Id",),
+    "imsi": ("e212.imsi",)
+}
+TASKS_PER_WORKER = 4    # shards are sent to the workers in this many chunks per worker, to balance the load
+
+
+def key_fields(keys):
+    '''
+    Expands the aliases of a correlation key.
+    :param keys: list of field names or aliases (see KEY_ALIASES).
+    :return: list of field names.
+    '''
+    fields = []
+    for key in keys:
+        fields.extend(KEY_ALIASES.get(key.lower(), (key,)))
+    return fields
+
+
+def collect_values(tree, fields, found):
+    '''
+    Collects the values of some fields anywhere inside a frame.
+    :param tree: frame, or a dict or list inside it.
+    :param fields: set of field names.
+    :param found: dict field -> list of values, where the values are added.
+    :return: void
+    '''
+    if type(tree) is list:
+        for item in tree:
+            if type(item) is list or type(item) in MAPPING_TYPES:
+                collect_values(item, fields, found)
+        return
+    for key, value in tree.items():
+        if key in fields and type(value) is not list:
+            found.setdefault(key, []).append(value)
+        elif key in fields:
+            found.setdefault(key, []).extend(item for item in value if type(item) is str)
+        elif type(value) is list or type(value) in MAPPING_TYPES:
+            collect_values(value, fields, found)
+
+
+def frame_keys(frame, fields):
+    '''
+    :param fields: list of field names, by priority.
+    :return: list of the values of the correlation key in the frame. Empty if the frame carries none of the fields.
+    '''
+    found = {}
+    collect_values(frame, set(fields), found)
+    for field in fields:
+        if field in found:
+            return list(OrderedDict.fromkeys(value for value in found[field] if type(value) is str))
+    return []
+
+
+def split_frames(frames, fields, projection=None):
+    '''
+    Splits frames into shards.
+    :param frames: iterable of frame layers, in trace order.
+    :param fields: list of the fields of the correlation key, by priority.
+    :param projection: projection.Projection applied to the frames kept in the shards, after their key is read.
+    :return: tuple (OrderedDict key -> (array of the indexes of the frames in the trace, list of frames), in order of
+             first appearance; number of frames without key)
+    '''
+    shards = OrderedDict()
+    unsharded = 0
+    for index, frame in enumerate(frames):
+        keys = frame_keys(frame, fields)
+        if len(keys) == 0:
+            unsharded += 1
+            continue
+        if projection is not None:
+            frame = projection.apply(frame)
+        for key in keys:
+            if key not in shards:
+                shards[key] = (array("L"), [])
+            shards[key][0].append(index)
+            shards[key][1].append(frame)
+    return shards, unsharded
+
+
+def iter_trace(trace):
+    '''
+    Iterates the frames of a Trace in order, in any of its modes.
+    '''
+    index = 0
+    frame = trace.get_frame(index)
+    while frame is not None:
+        yield frame
+        index += 1
+        frame = trace.get_frame(index)
+
+
+def failed_rule(report):
+    '''
+    :return: name of the rule that failed a TC report (its index if it has no name). None if no rule failed.
+    '''
+    for index, rule in enumerate(report["rules"]):
+        if rule["result"] == "Failed" and not rule.get("optional", False):
+            return (rule.get("metadata") or {}).get("name") or "rule {}".format(index)
+    return None
+
+
+def renumber_frames(report, indexes):
+    '''
+    Replaces the frame indexes of a shard report with those of the frames in the trace.
+    :param report: TC report of the shard.
+    :param indexes: array of the indexes of the frames of the shard in the trace.
+    :return: void
+    '''
+    for rule in report["rules"]:
+        if "frame_number" in rule:
+            rule["shard_frame_number"] = rule["frame_number"]
+            rule["frame_number"] = indexes[rule["frame_number"]]
+
+
+def run_shards(tcfn, shards, report_dir, index_protocols=False, index_fields=False, columns=None):
+    '''
+    Runs a TC on a group of shards and writes their reports.
+    :param tcfn: TC file.
+    :param shards: list of (shard number, key, array of the indexes of the frames in the trace, list of frames).
+    :param report_dir: directory of the reports.
+    :param index_protocols: see Trace.
+    :param index_fields: see Trace.
+    :param columns: see Trace.
+    :return: list with a result dict per shard.
+    '''
+    logger = logging.getLogger(__name__)
+    with open(tcfn, "r") as tcfp:
+        description = json.load(tcfp)
+    results = []
+    for number, key, indexes, frames in shards:
+        start = time.perf_counter()
+        try:
+            trace = Trace.from_frames(frames, "{} shard {}".format(tcfn, key), index_protocols, index_fields,
+                                      columns)
+            test_case = TestCase(tcfn, trace, description=description)
+            test_case.run()
+            report = test_case.get_report()
+            renumber_frames(report, indexes)
+        except Exception as error:
+            logger.error("TC {} failed on shard {}: {}".format(tcfn, key, traceback.format_exc()))
+            result = error_result(tcfn, None, error, start)
+            result.update({"shard": key, "frames": len(frames)})
+            results.append(result)
+            continue
+        report["shard"] = {"key": key, "frames": len(frames)}
+        reportfn = os.path.join(report_dir, "shard_{:05d}.json".format(number))
+        with open(reportfn, "w") as fp:
+            json.dump(report, fp, indent=3)
+        results.append({"shard": key, "frames": len(frames), "report": reportfn, "result": report["result"],
+                        "failed_rule": failed_rule(report), "elapsed": time.perf_counter() - start})
+    return results
+
+
+def run_sharded(tcfn, tracefn, keys, report_dir, options, project=False, workers=None, logging_options=None):
+    '''
+    Runs a TC on every shard of a trace.
+    :param tcfn: TC file.
+    :param tracefn: trace file, or list of trace files to merge (see Trace).
+    :param keys: list of the fields of the correlation key, or aliases (see KEY_ALIASES).
+    :param report_dir: directory of the reports: shard_<number>.json for every shard.
+    :param options: keyword arguments of Trace. The index and column options apply to every shard.
+    :param project: if True, the shards only keep the fields used by the TC.
+    :param workers: number of processes. Number of CPUs if None.
+    :param logging_options: (log level, log file, rule trace file) of the worker processes.
+    :return: summary dict with the totals, a histogram of the results and of the failed rules, and a result per
+             shard.
+    '''
+    logger = logging.getLogger(__name__)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if logging_options is None:
+        logging_options = ("WARNING", DEFAULT_LOGFILE, None)
+    start = time.perf_counter()
+    fields = key_fields(keys)
+    projection = TestCase(tcfn).get_projection() if project else None
+    load_options = dict(options, stream=True, index_protocols=False, index_fields=False, columns=None)   # read once, in order
+    trace = Trace(tracefn, **load_options)
+    shards, unsharded = split_frames(iter_trace(trace), fields, projection)
+    del trace
+    logger.info("Trace {} split into {} shards by {}, {} frames without key".format(
+        tracefn, len(shards), fields, unsharded))
+    split_s = time.perf_counter() - start
+    numbered = [(number, key, indexes, frames) for number, (key, (indexes, frames)) in enumerate(shards.items())]
+    shards.clear()
+    size = max(1, -(-len(numbered) // (workers * TASKS_PER_WORKER)))
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=logging_options) as executor:
+        futures = [executor.submit(run_shards, tcfn, numbered[first:first + size], report_dir,
+                                   options.get("index_protocols", False), options.get("index_fields", False),
+                                   options.get("columns"))
+                   for first in range(0, len(numbered), size)]
+        del numbered
+        for future in futures:
+            results.extend(future.result())
+    histogram = {"Passed": 0, "Failed": 0, "Error": 0}
+    failed_rules = {}
+    for result in results:
+        histogram[result["result"]] += 1
+        if result.get("failed_rule") is not None:
+            failed_rules[result["failed_rule"]] = failed_rules.get(result["failed_rule"], 0) + 1
+    return {
+        "tc": tcfn,
+        "trace": tracefn,
+        "key": fields,
+        "shards": len(results),
+        "unsharded_frames": unsharded,
+        "workers": workers,
+        "split_s": split_s,
+        "elapsed": time.perf_counter() - start,
+        "histogram": histogram,
+        "failed_rules": failed_rules,
+        "results": results
+    }
@@ -17,9 +17,22 @@ A report for a TC is JSON object with the following structure:
 
 The name and value of the tag is taken from the "report" dict inside the TC description.
 Each dict inside "rules" correspond to a dict inside "template" of TC description.
+
+A report can also be written while the TC runs, as JSON lines (NDJSON, see ReportWriter), one record per line:
+
+{"record": "tc", "tc": TC file, "metadata": {TC metadata}}
+{"record": "rule", "index": 0, "rule": {rule report}}       (one per rule, as soon as its outcome is final)
+...
+{"record": "result", "result": "Passed", "rules": number of rules}
+
+A report without its "result" record belongs to a TC that has not finished (or crashed).
 '''
-import logging
+import os
 import json
+import logging
+import itertools
+
+REPORT_FORMATS = ("json", "ndjson")
 
 class TcReport():
 
@@ -29,6 +42,7 @@ class TcReport():
         self.__report["result"] = "Fail"
         self.__report["rules"] = []
         self.current_rule = -1
+        self.__released = 0     # rules whose report has been dropped, see release_rules()
 
     def new_rule(self, metadata: dict = None):
         self.current_rule += 1
@@ -49,9 +63,39 @@ class TcReport():
         else:
             self.__report["rules"][self.current_rule]["result"] = "Failed"
 
+    def restore_rules(self, rules):
+        '''
+        Replaces the rules of the report, e.g. with those of a checkpoint. The last one becomes the current rule.
+        :param rules: list of rule reports.
+        '''
+        self.__report["rules"] = rules
+        self.current_rule = len(rules) - 1
+        self.__released = 0
+
+    def release_rules(self, count):
+        '''
+        Drops the reports of the first rules, once they have been written to a streamed report (see ReportWriter), so
+        that a TC with many rules does not keep them all in memory. Their entries in "rules" become None.
+        :param count: number of rules, from the first one.
+        '''
+        rules = self.__report["rules"]
+        count = min(count, len(rules))
+        for index in range(self.__released, count):
+            rules[index] = None
+        self.__released = max(self.__released, count)
+
     def add_to_current_rule(self, tag, value):
         self.__report["rules"][self.current_rule][tag] = value
 
+    def get_rules(self):
+        return self.__report["rules"]
+
+    def get_report(self):
+        '''
+        :return: the report as a dict, as it is saved to file.
+        '''
+        return self.__report
+
     def set_field(self, tag: str, value):
         self.__report[tag] = value
 
@@ -70,4 +114,167 @@ class TcReport():
         with open(filepath, "w") as fp:
             return json.dump(self.__report, fp, indent=3)
     
-    
\ No newline at end of file
+    
+
+
+class ReportWriter(object):
+    '''
+    Writes a TC report as JSON lines while the TC runs. Each record is flushed as soon as it is written, so the
+    outcome of the rules can be followed while a long trace is processed, and is not lost if the run crashes. Rule
+    reports that have been written are not kept in memory (see TcReport.release_rules()).
+    '''
+
+    def __init__(self, filepath, name, metadata=None):
+        '''
+        :param filepath: report file.
+        :param name: name of the TC (its file).
+        :param metadata: TC metadata.
+        '''
+        self.__fp = open(filepath, "w")
+        self.__rules = 0
+        header = {"record": "tc", "tc": name}
+        if metadata is not None:
+            header["metadata"] = metadata
+        self.__write(header)
+
+    def __write(self, record):
+        self.__fp.write(json.dumps(record) + "\n")
+        self.__fp.flush()
+
+    def write_rule(self, index, rule):
+        '''
+        Writes the report of a rule whose outcome is final. Can be used as TestCase listener.
+        '''
+        self.__write({"record": "rule", "index": index, "rule": rule})
+        self.__rules += 1
+
+    def finish(self, report):
+        '''
+        Writes the final record and closes the file.
+        :param report: TC report dict (see TcReport.get_report()). Its fields other than "rules" and "metadata" are
+                       written in the final record.
+        :return: void
+        '''
+        record = {"record": "result"}
+        record.update((tag, value) for tag, value in report.items() if tag not in ("rules", "metadata"))
+        record["rules"] = self.__rules
+        self.__write(record)
+        self.__fp.close()
+
+
+def iter_report_records(filepath):
+    '''
+    Reads the records of a report, one at a time.
+    :param filepath: report, either a JSON report or JSON lines. A JSON report is converted into records.
+    :return: generator of records (see module description). Raises ValueError before the first record if the file is
+             not a TC report, e.g. the summary.json of batch.py.
+    '''
+    with open(filepath, "r") as fp:
+        first = fp.readline()
+        try:
+            record = json.loads(first)
+        except ValueError:
+            record = None   # first line of an indented JSON report
+        if isinstance(record, dict) and "record" in record:
+            yield record
+            for line in fp:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        fp.seek(0)
+        report = json.load(fp)
+    if not (isinstance(report, dict) and isinstance(report.get("rules"), list)):
+        raise ValueError("not a TC report")
+    header = {"record": "tc", "tc": os.path.basename(filepath)}
+    if "metadata" in report:
+        header["metadata"] = report["metadata"]
+    yield header
+    for index, rule in enumerate(report.get("rules", [])):
+        yield {"record": "rule", "index": index, "rule": rule}
+    record = {"record": "result"}
+    record.update((tag, value) for tag, value in report.items() if tag not in ("rules", "metadata"))
+    record["rules"] = len(report.get("rules", []))
+    yield record
+
+
+def load_report(filepath):
+    '''
+    Loads a report written in any of the formats.
+    :return: report dict, as written by TcReport. Without "result" if the TC did not finish.
+    '''
+    report = {"rules": []}
+    for record in iter_report_records(filepath):
+        if record["record"] == "tc":
+            if "metadata" in record:
+                report["metadata"] = record["metadata"]
+        elif record["record"] == "rule":
+            report["rules"].append(record["rule"])
+        elif record["record"] == "result":
+            report.update((tag, value) for tag, value in record.items() if tag not in ("record", "rules"))
+    return report
+
+
+def merge_reports(filepaths, outpath):
+    '''
+    Merges reports into a single JSON lines file, reading one record at a time. Every record gets a "report" field
+    with the file it comes from. A final "summary" record counts the TCs by result; TCs that did not finish are
+    counted as "Incomplete". Files that are not TC reports (e.g. summary.json) are skipped, and counted as "skipped".
+    :param filepaths: reports, in any of the formats.
+    :param outpath: merged file. Skipped if it is among the reports.
+    :return: summary record.
+    '''
+    logger = logging.getLogger(__name__)
+    summary = {"record": "summary", "reports": 0, "Passed": 0, "Failed": 0, "Incomplete": 0, "skipped": 0}
+    with open(outpath, "w") as out:
+        for filepath in filepaths:
+            if os.path.abspath(filepath) == os.path.abspath(outpath):
+                continue
+            records = iter_report_records(filepath)
+            try:
+                first = next(records)
+            except ValueError as error:
+                logger.warning("Skipping {}: {}".format(filepath, error))
+                summary["skipped"] += 1
+                continue
+            result = "Incomplete"
+            for record in itertools.chain([first], records):
+                if record["record"] == "result":
+                    result = record.get("result", "Incomplete")
+                record["report"] = filepath
+                out.write(json.dumps(record) + "\n")
+            summary["reports"] += 1
+            summary[result] = summary.get(result, 0) + 1
+        out.write(json.dumps(summary) + "\n")
+    return summary
+
+
+def report_name(tcfn, report_format="json"):
+    '''
+    :return: file name of the report of a TC, when reports are written to a directory: the TC file name, with the
+             extension .ndjson for JSON lines reports.
+    '''
+    name = os.path.basename(tcfn)
+    if report_format == "ndjson":
+        name = os.path.splitext(name)[0] + ".ndjson"
+    return name
+
+
+def add_report_arguments(parser):
+    '''
+    Adds the report options to the parser of a command line tool.
+    :param parser: argparse.ArgumentParser
+    :return: void
+    '''
+    parser.add_argument("--report-format", choices=REPORT_FORMATS, default="json",
+                        help="Report format (default: %(default)s). ndjson writes the outcome of every rule as soon as "
+                             "it is final, one JSON object per line.")
+    parser.add_argument("--profile", action="store_true",
+                        help="Add to every rule of the report a \"perf\" block with the frames examined, regular "
+                             "expressions evaluated, variables stored, time and memory allocated. Slows down the TCs.")
+    parser.add_argument("--profile-trace", metavar="FILE",
+                        help="Write the perf blocks of the reports to FILE as a Chrome trace (chrome://tracing, "
+                             "Perfetto). Implies --profile.")
+    parser.add_argument("--checkpoints", metavar="DIR",
+                        help="Save a checkpoint of every TC after each rule into DIR, and restart TCs from the "
+                             "longest prefix of their rules already run against the trace. An unchanged TC gives "
+                             "back its report at once.")
@@ -2,8 +2,11 @@
 Implements TC template functionality
 '''
 
-import re
 import logging
+from numbers import Number
+from .matcher import RuleMatcher
+from .actions import StorePlan, VerifyPlan, ReportPlan
+from .projection import Projection
 
 
 class TestTemplate(object):
@@ -12,6 +15,31 @@ class TestTemplate(object):
         self.logger = logging.getLogger(__name__)
         self.template = template
         self.current_rule_index = -1
+        self.matchers = []
+        self.bounds = []
+        self.actions = []   # (StorePlan, VerifyPlan, ReportPlan) of every rule, None for the sections it has not
+        for rule in template:   # compile the sections of every rule
+            assert ("match" in rule), "Invalid rule. Nothing to match."
+            self.matchers.append(RuleMatcher(rule["match"]))
+            self.bounds.append(self.__parse_within(rule.get("within")))
+            self.actions.append((StorePlan(rule["store"]) if "store" in rule else None,
+                                 VerifyPlan(rule["verify"]) if "verify" in rule else None,
+                                 ReportPlan(rule["report"]) if "report" in rule else None))
+
+    @staticmethod
+    def __parse_within(within):
+        '''
+        Checks the "within" section of a rule.
+        :return: tuple (seconds, frames), None for the bounds not given. None if the rule has no bounds.
+        '''
+        if within is None:
+            return None
+        assert (type(within) is dict and len(within) > 0 and set(within) <= {"seconds", "frames"}), \
+            "Invalid \"within\": {}. Expected {{\"seconds\": N}} and / or {{\"frames\": N}}".format(within)
+        for key, value in within.items():
+            assert (isinstance(value, Number) and not isinstance(value, bool) and value >= 0), \
+                "Invalid \"within\": {} must be a number >= 0".format(key)
+        return within.get("seconds"), within.get("frames")
 
 
     def get_rule(self, index):
@@ -19,6 +47,63 @@ class TestTemplate(object):
         return self.template[index]
 
 
+    def get_matcher(self, index):
+        '''
+        Gets the compiled "match" section of a rule.
+        :param index: index of the rule inside the template.
+        :return: RuleMatcher
+        '''
+        assert(index < len(self.matchers))
+        return self.matchers[index]
+
+
+    def get_actions(self, index):
+        '''
+        Gets the compiled "store", "verify" and "report" sections of a rule (see actions.py).
+        :param index: index of the rule inside the template.
+        :return: tuple (StorePlan, VerifyPlan, ReportPlan), None for the sections that the rule does not have.
+        '''
+        assert(index < len(self.actions))
+        return self.actions[index]
+
+
+    def get_bounds(self, index):
+        '''
+        Gets the bounds of the scan of a rule, from its "within" section.
+        :param index: index of the rule inside the template.
+        :return: tuple (seconds, frames) after the frame matched by the previous rules, None for the bounds not
+                 given. None if the rule is not bounded.
+        '''
+        assert(index < len(self.bounds))
+        return self.bounds[index]
+
+
+    def count_evaluations(self, counter):
+        '''
+        Counts the evaluations of the regular expressions of all the rules from now on.
+        :param counter: profiling.EvaluationCounter
+        '''
+        for matcher in self.matchers:
+            matcher.count_evaluations(counter)
+        for store, verify, reporting in self.actions:
+            if verify is not None:
+                verify.count_evaluations(counter)
+
+
+    def get_num_rules(self):
+        return len(self.template)
+
+
+    def get_projection(self):
+        '''
+        Gets the fields of the frames that the rules of the template use.
+        :return: projection.Projection
+        '''
+        projection = Projection()
+        projection.add_template(self.template)
+        return projection
+
+
     def get_next_rule_index(self):
         '''
         Gets the index of the next rule inside the template.
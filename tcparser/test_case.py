@@ -1,46 +1,69 @@
 '''
 Test Case.
 
-Traverses a trace applying the rules from a template sequentially.
+Traverses a trace applying the rules from a template sequentially. Optional rules are evaluated in the same pass as
+the rules that follow them (see TestCase.__resolve()).
 '''
 
 import json
-import re
 import logging
 from .template import TestTemplate
-from .tc_report import TcReport
+from .tc_report import TcReport, ReportWriter
+from .test_run import TestRun
+from .display_filter import FilterBuilder
+from .profiling import Profiler
+from .checkpoint import CheckpointStore, prefix_keys
+
 
 class TestCase(object):
 
-    def __init__(self, filename, trace):
+    def __init__(self, filename, trace=None, description=None, listener=None):
+        '''
+        :param filename: TC description file.
+        :param trace: Trace to run the TC against. Can be set later with set_trace(), e.g. to load the trace with the
+                      projection of the TC.
+        :param description: TC description, already parsed. If given, "filename" is not read and only names the TC.
+        :param listener: function called with (rule index, rule report) as soon as the outcome of each rule is final,
+                         while the TC runs.
+        '''
         self.logger = logging.getLogger(__name__)
         self.__trace = trace
-        self.__current_rule_index = 0
-        self.__current_frame_index = 0
-        self.__tcvars = {}
+        self.__listener = listener
+        self.__writer = None    # ReportWriter, if the report is written while the TC runs
+        self.__profiler = None  # Profiler, if the TC is profiled
+        self.__checkpoints = None   # CheckpointStore, if the TC restarts from checkpoints
+        self.__checkpoint_keys = None   # keys of the prefixes of the rules, while the TC runs with checkpoints
+        self.__tcvars = {}      # initial value of the TC variables. Every run of the TC starts from a copy.
         self.__report = TcReport()
-        with open(filename, "r") as tcfp:
-            tc_description = json.load(tcfp)
-            assert("template" in tc_description)     # Raise exception if there is not template
-            name = filename.split(".")  # default TC name = filename - extension
-            self.filename = filename
-            if("metadata" in tc_description):
-                self.__report.set_field("metadata", tc_description["metadata"])
-            if("import" in tc_description):
-                if(len(tc_description["import"]) > 0):
-                    for import_file in tc_description["import"]:
-                        self.logger.info("Import variables from file {}".format(import_file))
-                        self.__parse_imported_file(import_file)
-            if("variables" in tc_description):
-                variables = list(tc_description["variables"].keys())
-                if(len(variables) > 0):
-                    for variable in variables:
-                        self.__tcvars[variable] = tc_description["variables"][variable]
-                        self.logger.debug("variable {} set to {}".format(variable,
-                                                                         tc_description["variables"][variable]))
-            self.template = TestTemplate(tc_description["template"])
+        self.__metadata = None
+        self.__finished = False
+        self.__runs = []
+        if description is None:
+            with open(filename, "r") as tcfp:
+                description = json.load(tcfp)
+        self.__load(filename, description)
         self.__result = False
 
+    def __load(self, filename, tc_description):
+        assert("template" in tc_description)     # Raise exception if there is not template
+        self.filename = filename
+        if("metadata" in tc_description):
+            self.__metadata = tc_description["metadata"]
+            self.__report.set_field("metadata", self.__metadata)
+        if("import" in tc_description):
+            if(len(tc_description["import"]) > 0):
+                for import_file in tc_description["import"]:
+                    self.logger.info("Import variables from file {}".format(import_file))
+                    self.__parse_imported_file(import_file)
+        if("variables" in tc_description):
+            variables = list(tc_description["variables"].keys())
+            if(len(variables) > 0):
+                for variable in variables:
+                    self.__tcvars[variable] = tc_description["variables"][variable]
+                    self.logger.debug("variable {} set to {}".format(variable,
+                                                                     tc_description["variables"][variable]))
+        self.template = TestTemplate(tc_description["template"])
+
     def __parse_imported_file(self, import_file):
         '''
         Each line in an imported file contains either a comment or a tag / value.
@@ -65,13 +88,76 @@ class TestCase(object):
                 self.__tcvars[name] = value
                 self.logger.debug("variable {} set to {}".format(name, value))
 
-    def report(self, filepath):
+    def set_trace(self, trace):
+        self.__trace = trace
+
+    def get_projection(self):
+        '''
+        Gets the fields of the frames that the TC uses, from the "match" and "store" sections of its rules.
+        :return: projection.Projection, to pass to the Trace.
+        '''
+        return self.template.get_projection()
+
+    def get_display_filter(self, fields=None):
+        '''
+        Gets a Wireshark display filter that keeps every frame that the TC could match (see display_filter.py).
+        :param fields: set of the string fields known by tshark. The filter only selects protocols if None.
+        :return: display filter. None if no frame can be left out.
+        '''
+        return FilterBuilder(self.template.template, self.__tcvars, fields).build()
+
+    def stream_report(self, filepath):
+        '''
+        Writes the report to a file while the TC runs, as JSON lines (see tc_report.ReportWriter), instead of all at
+        once in report(). Must be called before the TC starts. The rules written are dropped from memory, and are
+        None in get_report(), unless the TC is profiled or uses checkpoints, which need them.
+        :param filepath: report file.
+        :return:
+        '''
+        self.__writer = ReportWriter(filepath, self.filename, self.__metadata)
+
+    def profile(self, allocations=True):
+        '''
+        Adds to every rule of the report a "perf" block with the work done to evaluate it (see profiling.py). Must be
+        called before the TC starts.
+        :param allocations: if True, the memory allocated by every rule is measured as well, with tracemalloc. Slows
+                            down the TC several times.
+        :return:
+        '''
+        self.__profiler = Profiler(allocations)
+        self.template.count_evaluations(self.__profiler.counter)
+
+    def use_checkpoints(self, directory):
+        '''
+        Saves a checkpoint of the TC after every rule, and starts from the checkpoint of the longest prefix of its
+        rules already run against the trace (see checkpoint.py). Must be called before the TC starts. Has no effect
+        on profiled TCs, or on traces that are not complete files.
+        :param directory: directory of the checkpoint files.
+        :return:
+        '''
+        self.__checkpoints = CheckpointStore(directory)
+
+    def report(self, filepath=None):
+        '''
+        Writes the report. If it is streamed (see stream_report()), only completes it: "filepath" is ignored.
+        '''
         self.__report.set_result(self.__result)
-        self.__report.save_report_to_file(filepath)
+        if self.__writer is not None:
+            self.__writer.finish(self.__report.get_report())
+            self.__writer = None
+        else:
+            self.__report.save_report_to_file(filepath)
 
     def get_result(self):
         return self.__result
 
+    def get_report(self):
+        '''
+        :return: the TC report as a dict, as it is saved to file.
+        '''
+        self.__report.set_result(self.__result)
+        return self.__report.get_report()
+
     def run(self):
         '''
         Runs a test case.
@@ -81,374 +167,166 @@ class TestCase(object):
         remaining frames.
         :return:
         '''
-        isframesmatch = False
-        self.__current_rule_index = self.template.get_next_rule_index()
-        self.__current_frame_index = self.__trace.get_next_frame_index()
-        while(self.__current_rule_index >= 0):   # iterate rule by rule
-            self.logger.info("current_rule: {}".format(self.__current_rule_index))
-            start_index = self.__current_frame_index  # store this to reset if it is an unmet optional rule
-            self.logger.info("Storing current frame index: {}".format(start_index))
-            rule = self.template.get_rule(self.__current_rule_index)
-            self.__apply_stored_variables(rule)
-            if "metadata" in rule:
-                self.__report.new_rule(rule["metadata"])
+        self.start()
+        while not self.__finished:
+            index = self.get_frame_cursor()
+            frame = self.__trace.get_frame(index)
+            if frame is None:
+                self.end_of_trace()
             else:
-                self.__report.new_rule()  # build report for new rule inside the TC template
-            if "optional" in rule:
-                isruleoptional = rule["optional"]
-            else:
-                isruleoptional = False
-            while(self.__current_frame_index >= 0):   # match remaining frames to the current rule
-                self.logger.info("Processing frame: {}.".format(self.__current_frame_index))
-                frame = self.__trace.get_frame(self.__current_frame_index)
-                isframesmatch = self.__apply_rule(rule, frame)
-                self.__current_frame_index = self.__trace.get_next_frame_index()  # increment here
-                if isframesmatch:
-                    self.__report.add_to_current_rule("frame_number", self.__current_frame_index - 1)
-                    isruleoptional = False  # Once a rule is matched, it stops being optional
-                    self.logger.debug("isframesmatch: {}. Rule matched!!!".format(isframesmatch))
-                    break   # rule has been matched
-            # Frame matching is independent of rule verification. Once the rule has be matched we can check for
-            # verification conditions.
-            if isframesmatch:
-                is_rule_verified = self.__verify_rule(rule)
-                if not is_rule_verified:
-                    self.logger.debug("Rule verification failed.")
-                    isframesmatch = False
-            self.__report.set_result_of_current_rule(isframesmatch, isruleoptional)
-            if not isframesmatch:
-                if not isruleoptional:
-                    self.logger.debug("No frames matched. TC ends here.")
-                    break   # No packet matched the rule
-                else:
-                    self.logger.info("Restoring current frame index to: {}".format(start_index))
-                    self.__trace.set_frame_index(start_index)  # reset index
-                    self.__current_frame_index = start_index
-                    self.logger.debug("No frames matched but rule is optional.")
-            self.__current_rule_index = self.template.get_next_rule_index()
-            self.logger.debug("Next rule to match {}".format(self.__current_rule_index))
-        if isframesmatch:
-            self.__result = isframesmatch
-        elif isruleoptional:
-            self.__result = True
+                self.feed(index, frame)
 
-    def __verify_rule(self, rule):
+    def start(self):
         '''
-        Checks that all the conditions in the list "verify" of the rule are met.
-        :param rule: rule to verify
+        Prepares the TC to be fed frames from the start of the trace, one at a time. Use either this method together
+        with feed() and end_of_trace(), or run().
         :return:
         '''
-        returnvalue = False
-        if "verify" in rule:
-            for ver_item in rule["verify"]:
-                if "contains" in ver_item:
-                    if ver_item["field"] in self.__tcvars:
-                        if type(self.__tcvars[ver_item["field"]]) is list:
-                            for listitem in self.__tcvars[ver_item["field"]]:
-                                search_var = re.search("(.*)" + ver_item["contains"] + "(.*)", listitem)
-                                if search_var:
-                                    returnvalue = True
-                                    break
-                        else:
-                            search_var = re.search("(.*)" + ver_item["contains"] + "(.*)",
-                                                   self.__tcvars[ver_item["field"]])
-                            if search_var:
-                                returnvalue = True
-                    else:
-                        self.logger.debug("Field {} to verify is not inside __tcvars".format(ver_item["field"]))
-                elif "is" in ver_item:
-                    if ver_item["is"] == self.__tcvars[ver_item["field"]]:
-                        returnvalue = True
-                else:
-                    self.logger.debug("Verify field contains no valid condition")
-        else:
-            returnvalue = True    # Nothing to verify
-        return returnvalue
-
-    def __is_match_dict(self, subrule, framedict):
-        '''
-        Iterator to match subrule dict trees inside a frame.
-        Used to iterate dictionaries inside rules until we get to the actual rule. For example, in rule
-        {
-            "msg_hdr_tree": {
-                "CSeq": "^1"
-            },
-            "optional": false
-        },
-        this iterator will iterate until it find the value of "CSeq".
-
-        :param subrule: dictionary with one field to match
-        :param framedict: dictionary of frame to match against the subrule
-        :return: -1 not found.
-                  0 found but value does not match
-                  1 found and value matches
-        '''
-        matchtype = 1
-        for key in subrule.keys():
-            if(key == "optional"):
-                continue
-            if(matchtype != 1):
-                break
-            frkey = key   # frame key
-            self.logger.debug("Template Key: {}   Frame Key: {}".format(key, frkey))
-            if frkey in framedict.keys():
-                self.logger.debug("frkey is a {}".format(type(framedict[frkey])))
-                if(type(framedict[frkey]) is not dict):
-                    self.logger.debug("Values: {}   {}".format(subrule[key], framedict[frkey]))
-                    if(type(framedict[frkey]) is str):
-                        searchres = re.search(subrule[key], framedict[frkey])
-                        if(searchres == None):
-                            matchtype = 0
-                        elif(len(searchres.group()) == 0):
-                            matchtype = 0
-                        else:
-                            matchtype = 1
-                    elif(type(framedict[frkey]) is list):
-                        for item in framedict[frkey]:
-                            if(type(item) is str):
-                                searchres = re.search(subrule[key], item)
-                                if (searchres == None):
-                                    matchtype = 0
-                                elif (len(searchres.group()) == 0):
-                                    matchtype = 0
-                                else:
-                                    matchtype = 1
-                                    break
-                            elif(type(item) is dict):
-                                matchtype = self.__is_match_dict(subrule[key], item)
-                                if(matchtype == 1):
-                                    break
-                            else:
-                                if (subrule[key] != item):
-                                    matchtype = 0
-                                else:
-                                    matchtype = 1
-                                    break
-                    else:
-                        if(subrule[key] != framedict[frkey]):
-                            matchtype = 0
-                        else:
-                            matchtype = 1
-                else:
-                    self.logger.debug("{} is dictionary. Iterating.".format(frkey))
-                    matchtype = self.__is_match_dict(subrule[key], framedict[frkey])
-            else:
-                matchtype = -1
-            self.logger.debug("matchtype: {}".format(matchtype))
-        return matchtype
-
-    def __apply_rule(self, rule, frame):
-        '''
-        Checks whether the frame matches the current rule.
-        Iterates the rule and the frame to see if the frame contains the parameters defined in the rule and if the value
-        of these parameters match.
-        :param frame: dictionary with the content of a wireshark frame.
-        :return: ismatch -> true if the packet matches the current rule
-        '''
-        self.logger.debug("current rule has subrules for protocols: {}".format(list(rule["match"].keys())))
-        if(len(frame.keys()) == 0): # empty frame
-            return False
-        ismatch = True
-        for protocol in rule["match"]:
-            if(protocol not in frame):
-                ismatch = False
-            if(ismatch == False):
-                self.logger.debug("No match. Breaking loop.")
-                break
-            self.logger.info("checking subrules for protocol {}".format(protocol))
-            for subrule in rule["match"][protocol]:
-                isoptional = False
-                if("optional" in subrule):
-                    isoptional = subrule["optional"]
-                matchtype = self.__is_match_dict(subrule, frame[protocol])
-                if(isoptional == True):
-                    if(matchtype == -1 or matchtype == 1):
-                        msg = "Optional and not present. Match!!!" if(matchtype == -1) else \
-                            "Optional, present and value matches."
-                        self.logger.debug("{}".format(msg))
-                        ismatch = True
-                    else:
-                        self.logger.debug("{}".format("Optional, present and value does not match."))
-                        ismatch = False
-                else:
-                    if(matchtype == 1):
-                        self.logger.debug("Mandatory, present and value matches.")
-                        ismatch = True
-                    else:
-                        msg = "Mandatory and not present. No Match." if (matchtype == -1) else \
-                            "Mandatory, present and value does not match."
-                        self.logger.debug("{}".format(msg))
-                        ismatch = False
-                if(ismatch == False):
-                    break
-        if(ismatch == True):
-            self.logger.info("Frame {} matches rule {}!!!".format(self.__current_frame_index, self.__current_rule_index))
-            self.logger.debug("Now, search \"store\" section.")
-            if "store" in rule:
-                self.__parse_store_fields(rule["store"], frame)
-            if "report" in rule :  # report only if rule is matched
-                self.__build_rule_report(rule["report"])
-        return ismatch
-
-    def __build_rule_report(self, rulereports):
-        '''
-        Builds the report for a rule.
-        Performs variable substitution where required.
-        '''
-        for rulereport in rulereports:
-            assert("tag" in rulereport)
-            assert ("value" in rulereport)
-            search_var = re.search("{{(.*)}}", rulereport["value"])
-            if (search_var):
-                var_name = search_var.group(1)
-                self.logger.debug("Found variable to replace {}".format(var_name))
-                assert (var_name in self.__tcvars), "{} not stored.".format(var_name)
-                if type(self.__tcvars[var_name]) is list:
-                    report_value = "{}".format(self.__tcvars[var_name])
-                else:
-                    report_value = self.__tcvars[var_name]
-                rulereport["value"] = re.sub("{{(.*)}}", report_value, rulereport["value"])
-                self.logger.debug("{} set to value {}".format("value", rulereport["value"]))
-            self.__report.add_to_current_rule(rulereport["tag"], rulereport["value"])
+        self.__finished = False
+        self.__result = False
+        if self.__profiler is not None:
+            self.__profiler.start()
+        checkpoint = self.__find_checkpoint()
+        run = TestRun(self.filename, self.template, self.__trace, self.__tcvars, self.__metadata, self.__profiler,
+                      self.__checkpoint_keys is not None)
+        self.__runs = [run]
+        self.__notified = 0     # rules whose outcome has been passed to the listener
+        run.start(checkpoint)
+        self.__resolve()
 
-    def __iter_frame_for_store_fields(self, storedict, framedict):
+    def __find_checkpoint(self):
         '''
-        Iterates the keys in "storedict" inside framedict until its final value. For example, in the following:
-        "msg_hdr_tree": {
-                "callId": "Call-ID"
-            }
-        it iterates inside "msg_hdr_tree" until it finds "callId". Since "callId" is not a dict, it stops there.
-
-        :param storedict: dictionary from inside "store" object of a rule. Must contains a single key.
-        :param framedict: dictionary from a frame
-        :return: Value of the field iterated if it exists. None otherwise.
-        '''
-        keys = list(storedict.keys())
-        self.logger.debug("Keys: {}".format(keys))
-        field = None
-        value = None
-        if len(keys) > 0:
-            frkey = keys[0]
-            self.logger.debug("Iteration for frkey: {}".format(frkey))
-            if frkey in framedict:  # check that the key exists in the frame
-                self.logger.debug("frkey: {} is a {}".format(frkey, type(framedict[frkey])))
-                if type(framedict[frkey]) is dict:
-                    field, value = self.__iter_frame_for_store_fields(storedict[keys[0]], framedict[frkey])
-                elif type(framedict[frkey]) is list:
-                    for listitem in framedict[frkey]:
-                        self.logger.debug("listitem  type: {}".format(type(listitem)))
-                        self.logger.debug("listitem: {}".format(listitem))
-                        if type(listitem) is dict:
-                            fld, val = self.__iter_frame_for_store_fields(storedict[keys[0]], listitem)
-                            if val is not None:
-                                if value is None:
-                                    self.logger.debug("value set to: {}".format(val))
-                                    value = val
-                                elif type(value) is list:
-                                    self.logger.debug("Appending {} to {}".format(val, value))
-                                    value.append(val)
-                                else:
-                                    value = [value]
-                                    self.logger.debug("Converted to list {} and appending {}".format(value, val))
-                                    value.append(val)
-                            if fld is not None:
-                                field = fld
-                        else:
-                            field = storedict[keys[0]]
-                            value = framedict[frkey]
-                            self.logger.debug("variable is a list of values {}".format(value))
-                        self.logger.debug("Output list {}".format(value))
-                elif value is not None:
-                    values = list()
-                    values.append(value)
-                    field = storedict[keys[0]]
-                    values.append(framedict[frkey])
-                    value = values
-                    self.logger.debug("variable is a list of values {}".format(value))
-                else:
-                    field = storedict[keys[0]]
-                    value = framedict[frkey]
-                    self.logger.debug("variable {} set to value {}".format(field, value))
-            else:
-                self.logger.debug("No Key: {} in frame ".format(frkey))
+        Finds the checkpoint to start the TC from, and the keys under which its checkpoints are saved.
+        :return: state to start from (see TestRun.get_checkpoints()). None to start from the first rule.
+        '''
+        self.__checkpoint_keys = None
+        self.__saved = 0        # index of the last key under which a checkpoint exists
+        if self.__checkpoints is None:
+            return None
+        identity = self.__trace.get_identity()
+        if identity is None or self.__profiler is not None:
+            self.logger.info("No checkpoints for TC {}: the trace is not a complete file, or the TC is profiled".format(
+                self.filename))
+            return None
+        self.__checkpoint_keys = prefix_keys(identity, self.__tcvars, self.template.template)
+        checkpoint = self.__checkpoints.find(self.__checkpoint_keys)
+        if checkpoint is None:
+            return None
+        if checkpoint.get("finished", False):
+            self.logger.info("TC {} unchanged up to rule {}: report taken from checkpoint".format(
+                self.filename, checkpoint["rule"]))
+            self.__saved = len(self.__checkpoint_keys)
         else:
-            self.logger.debug("Empty dictionary")
-        self.logger.debug("Return field {} with value {}".format(field, value))
-        return field, value
+            self.logger.info("TC {} restarts at rule {}, frame {} from checkpoint".format(
+                self.filename, checkpoint["rule"], checkpoint["frame"]))
+            self.__saved = checkpoint["rule"]
+        return checkpoint
 
-
-    def __parse_store_fields(self, store, frame):
+    def __save_checkpoints(self, run):
         '''
-        Parses the "store" area inside the rule and stores the required data into test case variables. If the data is
-        not present, then the variables are defined with empty str value.
-        This method shall only be called when "frame" has been positively matched against the subrules inside "match".
-
-        For example, for the following "store" section of a rule
-        "store": {
-            "sip": [
-                {
-                    "msg_hdr_tree": {
-                        "callId": "Call-ID"
-                    }
-                }
-            ]
-        }
-        We will be looking for a field called sip.Call-ID inside path frame/sip/msg_hdr_tree
-        If this field is found, then we will store is inside self.storedvars with key "callId".
+        Saves the checkpoints of the rules that the first run of the chain has started and will not go back on, and
+        its final state when it is finished.
+        '''
+        keys = self.__checkpoint_keys
+        if run.get_rule_index() > self.__saved:
+            for state in run.get_checkpoints():
+                if self.__saved < state["rule"] <= run.get_rule_index():
+                    self.__checkpoints.save(keys[state["rule"]], state)
+                    self.__saved = state["rule"]
+        if run.is_finished() and self.__saved < len(keys):
+            final = run.get_rule_index() + 1     # failed at a rule: the rules after it do not matter
+            self.__checkpoints.save(keys[min(final, len(keys) - 1)], run.get_final_state())
+            self.__saved = len(keys)
 
-        :param store:   "store" object inside a rule
-        :param frame:   frame from which to extract the value
-        :return: void
-        '''
-        # iterate all the protocols
-        for protocol in store:
-            self.logger.debug("Protocol \"{}\"".format(protocol))
-            for item in store[protocol]:
-                key, value = self.__iter_frame_for_store_fields(item, frame[protocol])
-                if (key is not None):
-                    # store the value for future use
-                    self.logger.debug("Storing key {} with value {}".format(key, value))
-                    if (value is None):
-                        self.__tcvars[key] = ""
-                    else:
-                        self.__tcvars[key] = value
+    def is_finished(self):
+        return self.__finished
 
+    def get_frame_cursor(self):
+        '''
+        Gets the index of the next frame that the TC must be fed.
+        :return: index of the frame, -1 if the TC is finished.
+        '''
+        if self.__finished:
+            return -1
+        return min(run.get_frame_cursor() for run in self.__runs if not run.is_finished() and run.is_viable())
 
-    def __iter_rule_for_vars(self, tempdict):
+    def feed(self, index, frame):
         '''
-        Iterates the keys in tempdict (template) searching for variables to replace.
-        :param tempdict: dictionary to iterate (protocol item inside a TC template).
+        Matches a frame against the current rule of every run waiting for it.
+        :param index: index of the frame inside the trace. Must be the value returned by get_frame_cursor().
+        :param frame: dictionary with the content of the frame.
         :return:
         '''
-        for key in tempdict.keys():
-            if(type(tempdict[key]) is not dict):
-                if(type(tempdict[key]) is str):
-                    search_var = re.search("{{(.*)}}", tempdict[key])
-                    if(search_var):
-                        var_name = search_var.group(1)
-                        self.logger.debug("Found variable to replace {}".format(var_name))
-                        assert (var_name in self.__tcvars), "{} not stored.".format(var_name)
-                        tempdict[key] = re.sub("{{(.*)}}", self.__tcvars[var_name], tempdict[key])
-                        self.logger.debug("{} set to value {}".format(key, tempdict[key]))
-            else:
-                self.logger.debug("{}".format("{} is a dictionary. New iteration.".format(key)))
-                self.__iter_rule_for_vars(tempdict[key])
+        for run in list(self.__runs):
+            if run in self.__runs and run.is_viable() and run.get_frame_cursor() == index:
+                run.feed(index, frame)
+                self.__resolve()
 
+    def end_of_trace(self):
+        '''
+        Signals that the trace has no frame at the index returned by get_frame_cursor().
+        :return:
+        '''
+        index = self.get_frame_cursor()
+        for run in list(self.__runs):
+            if run in self.__runs and run.is_viable() and run.get_frame_cursor() == index:
+                run.end_of_trace()
+                self.__resolve()
 
-    def __apply_stored_variables(self, rule):
-        '''
-        Searches the rule for variables (inside double brackets {{}}) and replaces them with the stored
-        value, if it exists. If it does not exist, then raises an exception.
-        :param rule: index of the rules to which variables shall be set.
-        :return: void . Raises exception if variable does no exist.
-        '''
-        assert ("match" in rule), "Invalid rule. Nothing to match."
-        self.logger.debug("Rule to iterate to apply stored variables\n{}".format(rule["match"]))
-        for protocol in rule["match"]:
-            self.logger.debug("Iterating protocol {} for variable replacement".format(protocol))
-            subrule_index = 0
-            for subrule in rule["match"][protocol]:
-                self.logger.debug("Iterating subrule {} for variable replacement".format(subrule_index))
-                self.__iter_rule_for_vars(subrule)
-                subrule_index += 1
+    def __resolve(self):
+        '''
+        Keeps the chain of runs consistent after any of them has moved on.
+        self.__runs is a chain: each run is a fork of the previous one, which is at an optional rule and assumes that
+        the rule is never matched. So the template is evaluated in a single pass over the trace, instead of rewinding
+        to the start of every optional rule that is not matched. The first run of the chain holds the outcome of the
+        TC.
+        - When a run matches its optional rule (or fails its TC), the runs after it assumed the contrary: they are
+          dropped.
+        - When a run reaches the end of the trace without matching its optional rule, it is superseded by its fork.
+        - A run that starts an optional rule at the end of the chain forks.
+        - A run that is not viable (see TestRun) waits until it is dropped. If it becomes the first run of the chain,
+          the optional rule that would have stored its variables was not matched: the TC raises the same exception as
+          without forks.
+        '''
+        runs = self.__runs
+        position = 0
+        while position < len(runs):
+            run = runs[position]
+            if run.is_superseded():
+                del runs[position]
+                continue
+            if position + 1 < len(runs) and not run.has_fork():
+                del runs[position + 1:]
+            position += 1
+        runs[0].bind_rule()
+        last = runs[-1]
+        while last.is_rule_optional() and not last.has_fork():
+            last = last.fork()
+            runs.append(last)
+        if self.__listener is not None or self.__writer is not None:
+            self.__notify(runs[0])
+        if self.__checkpoint_keys is not None:
+            self.__save_checkpoints(runs[0])
+        if runs[0].is_finished():
+            self.__finished = True
+            self.__result = runs[0].get_result()
+            self.__report = runs[0].get_report()
+            if self.__profiler is not None:
+                self.__profiler.stop()
 
+    def __notify(self, run):
+        '''
+        Passes to the listener and the report writer the rules whose outcome is final: the rules that the first run of
+        the chain has left behind, or all of them when it is finished.
+        '''
+        rules = run.get_report().get_rules()
+        final = len(rules) if run.is_finished() else run.get_rule_index()
+        while self.__notified < final:
+            if self.__writer is not None:
+                self.__writer.write_rule(self.__notified, rules[self.__notified])
+            if self.__listener is not None:
+                self.__listener(self.__notified, rules[self.__notified])
+            self.__notified += 1
+        if self.__writer is not None and self.__checkpoint_keys is None and self.__profiler is None:
+            for chained in self.__runs:     # the runs of the chain share the rules before the current one
+                chained.get_report().release_rules(self.__notified)
@@ -0,0 +1,432 @@
+'''
+Evaluation of the template of a Test Case against a trace.
+
+A TestRun walks the rules of a template in order, keeping its own position in the trace, TC variables and report.
+When a run starts an optional rule, it can fork: the fork assumes that the rule is never matched, and goes on with the
+next rules from the same frame, while the original run keeps looking for the optional rule (see TestCase).
+
+The variables of a rule are bound when the rule is first evaluated. A fork whose rule uses a variable that only the
+skipped optional rule stores is not viable: it stops instead of raising, and only stands for the outcome of the TC if
+the optional rule is never matched.
+'''
+
+import copy
+import time
+import logging
+from bisect import bisect_left
+from .tc_report import TcReport
+from .logs import RULE_TRACE_LOGGER
+from .frame import MAPPING_TYPES, to_dict
+from .merge import frame_origin
+
+
+def frame_stamp(frame, index):
+    '''
+    Gets the position of a frame in the capture, for the "within" bounds of the rules.
+    :param frame: layers of the frame.
+    :param index: index of the frame inside the trace.
+    :return: tuple (frame.number, frame.time_epoch). The number is index + 1 if the frame has no frame.number, and the
+             time None if it has no frame.time_epoch.
+    '''
+    number = index + 1
+    epoch = None
+    layer = frame.get("frame")
+    if type(layer) in MAPPING_TYPES:
+        try:
+            number = int(layer.get("frame.number", number))
+        except (TypeError, ValueError):
+            pass
+        try:
+            epoch = float(layer["frame.time_epoch"])
+        except (KeyError, TypeError, ValueError):
+            pass
+    return number, epoch
+
+
+class TestRun(object):
+
+    def __init__(self, name, template, trace, tcvars, metadata=None, profiler=None, checkpoints=False):
+        '''
+        :param name: name of the TC, for the logs.
+        :param template: TestTemplate
+        :param trace: Trace
+        :param tcvars: initial TC variables. The run works on a copy.
+        :param metadata: TC metadata, copied into the report.
+        :param profiler: profiling.Profiler. If given, every rule of the report gets a "perf" block.
+        :param checkpoints: if True, the state of the run at the start of every rule is recorded (see
+                            get_checkpoints()).
+        '''
+        self.logger = logging.getLogger(__name__)
+        self.ruletrace_logger = logging.getLogger(RULE_TRACE_LOGGER)
+        self.name = name
+        self.template = template
+        self.__trace = trace
+        self.__tcvars = dict(tcvars)
+        self.__metadata = metadata
+        self.__profiler = profiler
+        self.__perf = None          # perf block of the current rule, when profiling
+        self.__branch = 0           # number of optional rules that the run assumes not matched
+        self.__forked_rule = None   # rule at which a fork of this run was created
+        self.__checkpoints = [] if checkpoints else None   # states at the start of the rules, see get_checkpoints()
+
+    def start(self, checkpoint=None):
+        '''
+        Prepares the run to be fed frames from the start of the trace, one at a time.
+        :param checkpoint: state saved by an earlier run (see get_checkpoints()) to start from, instead of the first
+                           rule and frame.
+        :return:
+        '''
+        self.__report = TcReport()
+        if self.__metadata is not None:
+            self.__report.set_field("metadata", self.__metadata)
+        self.__result = False
+        self.__finished = False
+        self.__superseded = False
+        self.__current_rule_index = -1
+        self.__isframesmatch = False
+        self.__isruleoptional = False
+        self.__current_frame_index = 0
+        self.__last_stamp = None        # frame_stamp() of the last matched frame
+        self.__error = None             # exception that stopped the run, see __suspend()
+        self.__isdebug = self.logger.isEnabledFor(logging.DEBUG)
+        self.__isruletrace = self.ruletrace_logger.isEnabledFor(logging.INFO)
+        if checkpoint is not None:
+            self.__restore(checkpoint)
+            if self.__finished:
+                return
+        self.__start_next_rule()
+
+    def __restore(self, state):
+        self.__report.restore_rules(state["rules"])
+        self.__tcvars = state["variables"]
+        self.__result = state.get("result", False)
+        if state.get("finished", False):
+            self.__current_rule_index = state["rule"]
+            self.__finished = True
+            return
+        self.__current_rule_index = state["rule"] - 1
+        self.__current_frame_index = state["frame"]
+        self.__isframesmatch = state["matched"]
+        self.__isruleoptional = state["optional"]     # of the previous rule: the result of a run that ends there
+        if state["last_stamp"] is not None:
+            self.__last_stamp = tuple(state["last_stamp"])
+
+    def get_checkpoints(self):
+        '''
+        Gets the states of the run at the start of its rules, from which a later run of the same rules against the
+        same trace can start (see checkpoint.py). Only recorded if the run was created with "checkpoints".
+        :return: list of dicts, by rule.
+        '''
+        return self.__checkpoints
+
+    def get_final_state(self):
+        '''
+        :return: state of a finished run, that a later run of the same rules can start from to finish at once.
+        '''
+        return {"rule": self.__current_rule_index, "finished": True, "result": self.__result,
+                "rules": to_dict(self.__report.get_rules()), "variables": to_dict(self.__tcvars)}
+
+    def is_finished(self):
+        return self.__finished
+
+    def get_result(self):
+        return self.__result
+
+    def get_report(self):
+        '''
+        :return: TcReport of the run.
+        '''
+        self.__report.set_result(self.__result)
+        return self.__report
+
+    def get_rule_index(self):
+        return self.__current_rule_index
+
+    def is_rule_optional(self):
+        '''
+        :return: True if the current rule is optional, viable and has not been matched yet.
+        '''
+        return not self.__finished and self.__isruleoptional and self.__isviable
+
+    def is_viable(self):
+        '''
+        :return: True if the run can evaluate its current rule: the variables used by the rule exist.
+        '''
+        return self.__finished or self.__isviable
+
+    def bind_rule(self):
+        '''
+        Binds the current rule to the TC variables and finds the first frame that can match it, if not done yet.
+        :return: void. Raises exception if a variable does not exist, or the exception that stopped the run.
+        '''
+        if self.__error is not None:
+            raise self.__error
+        if self.__finished or self.__isbound:
+            return
+        if self.__perf is not None:
+            snapshot = self.__profiler.snapshot()
+        self.__matcher.bind(self.__tcvars)
+        self.__isbound = True
+        self.__set_limits(self.template.get_bounds(self.__current_rule_index))
+        self.__candidates = self.__trace.candidate_frames(self.__matcher)
+        self.__current_frame_index = self.__seek(self.__current_frame_index)
+        if self.__perf is not None:
+            self.__profiler.add(self.__perf, snapshot)     # pre-filtering of the frames by the trace
+
+    def fork(self):
+        '''
+        Creates a run that assumes that the current optional rule is never matched: the fork records the rule as
+        failed, and starts the next rule from the frame where this one started. This run goes on looking for the
+        optional rule. If it does not find it, the run is superseded by the fork (see is_superseded()).
+        :return: TestRun
+        '''
+        assert (self.is_rule_optional()), "Only runs at an optional rule can fork"
+        branch = copy.copy(self)
+        branch.__tcvars = dict(self.__tcvars)
+        branch.__report = copy.deepcopy(self.__report)
+        branch.__branch = self.__branch + 1
+        branch.__forked_rule = None
+        if self.__perf is not None:
+            branch.__perf = dict(self.__perf)
+        if self.__checkpoints is not None:
+            branch.__checkpoints = list(self.__checkpoints)
+        self.__forked_rule = self.__current_rule_index
+        branch.__end_rule(False, False)
+        return branch
+
+    def has_fork(self):
+        '''
+        :return: True if the fork created at the current rule is still valid, i.e. the rule has been neither matched
+                 nor given up.
+        '''
+        return self.__forked_rule is not None and self.__forked_rule == self.__current_rule_index \
+            and not self.__finished
+
+    def is_superseded(self):
+        '''
+        :return: True if the optional rule at which the run forked was not matched. The fork then holds the outcome.
+        '''
+        return self.__superseded
+
+    def get_frame_cursor(self):
+        '''
+        Gets the index of the next frame that the TC must be fed.
+        :return: index of the frame, -1 if the TC is finished.
+        '''
+        if self.__finished:
+            return -1
+        self.bind_rule()
+        return self.__current_frame_index
+
+    def feed(self, index, frame):
+        '''
+        Matches a frame against the current rule.
+        :param index: index of the frame inside the trace. Must be the value returned by get_frame_cursor().
+        :param frame: dictionary with the content of the frame.
+        :return:
+        '''
+        assert (index == self.__current_frame_index), "Frame {} fed, {} expected".format(index,
+                                                                                       self.__current_frame_index)
+        if self.__isdebug:
+            self.logger.debug("Processing frame: {}.".format(index))
+        if self.__limits is not None and self.__is_out_of_bounds(index, frame):
+            return
+        self.__frames_examined += 1
+        if self.__perf is not None:
+            snapshot = self.__profiler.snapshot()
+        try:
+            isframesmatch = self.__apply_rule(frame)
+        except AssertionError as error:     # variable of the "report" section not stored
+            self.__suspend(error)
+            return
+        if isframesmatch:
+            self.__current_frame_index = index + 1
+            self.__matched_index = index
+            self.__last_stamp = frame_stamp(frame, index)
+            self.__report.add_to_current_rule("frame_number", index)
+            origin = frame_origin(frame)
+            if origin is not None:
+                self.__report.add_to_current_rule("source", origin)
+            self.__isruleoptional = False  # Once a rule is matched, it stops being optional
+            # Frame matching is independent of rule verification. Once the rule has be matched we can check for
+            # verification conditions.
+            try:
+                is_rule_verified = self.__verify is None or self.__verify.verify(self.__tcvars)
+            except KeyError as error:   # variable of an "is" condition not stored
+                self.__suspend(error)
+                return
+            if not is_rule_verified:
+                self.logger.debug("Rule verification failed.")
+                isframesmatch = False
+            if self.__perf is not None:
+                self.__profiler.add(self.__perf, snapshot)
+            self.__end_rule(isframesmatch)
+        else:
+            self.__current_frame_index = self.__seek(index + 1)
+            if self.__perf is not None:
+                self.__profiler.add(self.__perf, snapshot)
+
+    def end_of_trace(self):
+        '''
+        Signals that the trace has no frame at the index returned by get_frame_cursor().
+        :return:
+        '''
+        self.bind_rule()
+        self.__end_rule(False)
+
+    def __suspend(self, error):
+        '''
+        Stops the run at a variable that its current rule uses and that does not exist. The error is raised by
+        bind_rule(), if the run turns out to hold the outcome of the TC.
+        '''
+        self.logger.info("Run stopped at rule {}: {}".format(self.__current_rule_index, error))
+        self.__error = error
+        self.__isviable = False
+
+    def __start_next_rule(self):
+        self.__current_rule_index += 1
+        if self.__current_rule_index >= self.template.get_num_rules():
+            self.__finish()
+            return
+        if self.__checkpoints is not None and self.__current_rule_index > 0:
+            self.__checkpoints.append({"rule": self.__current_rule_index, "frame": self.__current_frame_index,
+                                       "variables": to_dict(self.__tcvars),
+                                       "rules": to_dict(self.__report.get_rules()),
+                                       "last_stamp": self.__last_stamp, "matched": self.__isframesmatch,
+                                       "optional": self.__isruleoptional})
+        self.__start_index = self.__current_frame_index  # store this to reset if it is an unmet optional rule
+        self.logger.info("Rule {} starts at frame {}".format(self.__current_rule_index, self.__start_index))
+        self.__frames_examined = 0
+        self.__matched_index = None
+        if self.__isruletrace:
+            self.__rule_start_time = time.perf_counter()
+        if self.__profiler is not None:
+            self.__perf = self.__profiler.new_rule()
+        self.__rule = self.template.get_rule(self.__current_rule_index)
+        self.__matcher = self.template.get_matcher(self.__current_rule_index)
+        self.__store, self.__verify, self.__reporting = self.template.get_actions(self.__current_rule_index)
+        self.__isbound = False      # bound when the rule is first evaluated, see bind_rule()
+        self.__isviable = self.__matcher.is_bindable(self.__tcvars)
+        if "metadata" in self.__rule:
+            self.__report.new_rule(self.__rule["metadata"])
+        else:
+            self.__report.new_rule()  # build report for new rule inside the TC template
+        if "optional" in self.__rule:
+            self.__isruleoptional = self.__rule["optional"]
+        else:
+            self.__isruleoptional = False
+
+    def __set_limits(self, bounds):
+        '''
+        Sets the last frame number and time that the current rule can match, from its "within" bounds and the last
+        matched frame. Rules are not bounded until a frame has been matched.
+        '''
+        self.__limits = None
+        if bounds is None or self.__last_stamp is None:
+            return
+        seconds, frames = bounds
+        number, epoch = self.__last_stamp
+        max_number = number + frames if frames is not None else None
+        max_epoch = epoch + seconds if seconds is not None and epoch is not None else None
+        if max_number is not None or max_epoch is not None:
+            self.__limits = (max_number, max_epoch)
+
+    def __is_out_of_bounds(self, index, frame):
+        '''
+        Ends the current rule as not matched if a frame is beyond its "within" bounds. Frames are in capture order, so
+        no later frame can match the rule either.
+        :return: True if the rule has been ended.
+        '''
+        max_number, max_epoch = self.__limits
+        number, epoch = frame_stamp(frame, index)
+        if (max_number is None or number <= max_number) and (max_epoch is None or epoch is None or epoch <= max_epoch):
+            return False
+        self.logger.info("Rule {} not matched within its bounds, frame {} is beyond them".format(
+            self.__current_rule_index, index))
+        self.__report.add_to_current_rule("within_exceeded", True)
+        self.__end_rule(False)
+        return True
+
+    def __seek(self, index):
+        '''
+        Skips the frames that cannot match the current rule, according to the indexes of the trace.
+        :param index: index of the first frame to consider.
+        :return: index of the next frame that can match the rule.
+        '''
+        if self.__candidates is not None:
+            pos = bisect_left(self.__candidates, index)
+            if pos < len(self.__candidates):
+                return self.__candidates[pos]
+            return self.__trace.numpackets
+        return self.__trace.next_frame_with(self.__matcher.protocol_names, index)
+
+    def __end_rule(self, isframesmatch, islogged=True):
+        self.__isframesmatch = isframesmatch
+        self.__report.set_result_of_current_rule(isframesmatch, self.__isruleoptional)
+        if self.__perf is not None:
+            self.__perf["frames_examined"] = self.__frames_examined
+            self.__profiler.end_rule(self.__perf)
+            self.__report.add_to_current_rule("perf", self.__perf)
+        if self.__isruletrace and islogged:
+            self.__log_rule_trace(isframesmatch)
+        if not isframesmatch and self.__isruleoptional and self.__forked_rule == self.__current_rule_index:
+            self.logger.debug("Optional rule {} not matched. Superseded by fork.".format(self.__current_rule_index))
+            self.__finished = True
+            self.__superseded = True
+            return
+        if not isframesmatch:
+            if not self.__isruleoptional:
+                self.logger.debug("No frames matched. TC ends here.")
+                self.__finish()
+                return   # No packet matched the rule
+            else:
+                self.logger.info("Restoring current frame index to: {}".format(self.__start_index))
+                self.__current_frame_index = self.__start_index  # reset index
+                self.logger.debug("No frames matched but rule is optional.")
+        self.__start_next_rule()
+
+    def __log_rule_trace(self, isframesmatch):
+        '''
+        Writes the outcome of the current rule to the rule trace.
+        '''
+        metadata = self.__rule.get("metadata") or {}
+        self.ruletrace_logger.info("rule %d", self.__current_rule_index, extra={"rule_trace": {
+            "tc": self.name,
+            "rule": self.__current_rule_index,
+            "branch": self.__branch,
+            "name": metadata.get("name"),
+            "result": "Passed" if isframesmatch else "Failed",
+            "optional": self.__isruleoptional,
+            "start_frame": self.__start_index,
+            "frame_number": self.__matched_index,
+            "frames_examined": self.__frames_examined,
+            "elapsed": time.perf_counter() - self.__rule_start_time
+        }})
+
+    def __finish(self):
+        self.__finished = True
+        if self.__isframesmatch:
+            self.__result = self.__isframesmatch
+        elif self.__isruleoptional:
+            self.__result = True
+
+    def __apply_rule(self, frame):
+        '''
+        Checks whether the frame matches the current rule. If it does, the "store" and "report" sections of the rule
+        are applied.
+        :param frame: dictionary with the content of a wireshark frame.
+        :return: ismatch -> true if the packet matches the current rule
+        '''
+        ismatch = self.__matcher.match(frame)
+        if(ismatch == True):
+            self.logger.info("Frame {} matches rule {}!!!".format(self.__current_frame_index, self.__current_rule_index))
+            if self.__store is not None:
+                stored = self.__store.apply(frame, self.__tcvars)
+                if self.__isdebug:
+                    for key in stored:
+                        self.logger.debug("Storing key {} with value {}".format(key, self.__tcvars[key]))
+                if self.__perf is not None:
+                    self.__perf["store_extractions"] += len(stored)
+            if self.__reporting is not None:  # report only if rule is matched
+                self.__reporting.apply(self.__tcvars, self.__report.add_to_current_rule)
+        return ismatch
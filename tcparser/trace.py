@@ -2,30 +2,448 @@
 Trace storage and tracing functionality.
 '''
 
+import os
 import json
 import logging
+from array import array
+from bisect import bisect_left
+from .reader import FrameStream, open_json_frames, open_tshark_frames, is_capture, DEFAULT_LOOKBACK
+from .index import FieldIndex
+from . import columns as columnar
+from . import ek
+from . import follow as live
+from .merge import merge_frames
+from .frame import FrameCompactor, STRINGS_LIMIT
+from .cache import FrameCache, source_key, cache_path, write_cache
 
 
 class Trace(object):
 
-    def __init__(self, tracefn):
+    def __init__(self, tracefn, stream=False, lookback=DEFAULT_LOOKBACK, index_protocols=False, index_fields=False,
+                 display_filter=None, tshark=None, compact=False, cache=False, cache_dir=None, projection=None,
+                 columns=None, parse_workers=None, follow=False, idle_timeout=None):
+        '''
+        :param tracefn: JSON trace file exported from Wireshark, newline-delimited export (tshark -T ek, see ek.py),
+                        or pcap / pcapng capture. Captures are dissected by a tshark subprocess whose JSON output is
+                        read as it is produced. A list of trace files, e.g. of different interfaces, is merged into a
+                        single trace in time order (see merge.py); merged traces cannot be cached or followed.
+        :param stream: if True, frames are parsed incrementally while they are accessed instead of loading the whole
+                       trace into memory. Memory use then stays flat whatever the size of the trace.
+        :param lookback: in stream mode, number of already read frames kept in memory for cheap rewinds.
+        :param index_protocols: if True, build an index of the frames that carry each protocol, so that frames without
+                                the protocols of a rule can be skipped. In stream mode, this takes an extra pass over
+                                the trace.
+        :param index_fields: if True, the fields that rules match against exact values (literals or stored
+                             variables) are indexed by value the first time they are used, so that the matcher goes
+                             straight to the frames that carry the value. In stream mode, building the index of a
+                             field takes an extra pass over the trace.
+        :param display_filter: for captures, Wireshark display filter that tshark applies to the capture.
+        :param tshark: for captures, tshark command to run. Default: environment variable TRAZER_TSHARK, or "tshark".
+                       Rewinding beyond the look-back buffer, and every extra pass, runs tshark again.
+        :param compact: if True, frames are held as FrameDicts, with keys and repeated strings shared across frames.
+                        Uses several times less memory than plain dicts, at the cost of a slower load.
+        :param cache: if True, frames are read from a binary cache file of the trace, which is mapped into memory and
+                      decoded frame by frame when accessed. The cache file is written by the first run, and rebuilt
+                      whenever the trace file changes. Frames are not held in memory, so "stream" and "compact" have
+                      no effect, and the protocol index is read from the cache file.
+        :param cache_dir: directory of the cache files. Default: the directory of the trace.
+        :param projection: projection.Projection. If given, frames only keep the fields that the TCs use, which cuts
+                           memory use. tshark only exports the protocols of the projection. The cache file holds
+                           the complete frames, so cached traces are not projected.
+        :param columns: if not None, the fields that rules match against are held in columns (see columns.py) the
+                        first time they are used, and the frames that can match all the conditions of a rule are
+                        found with vectorized operations before running the matcher. List of the names of the
+                        fields to hold in columns (e.g. "sip.Method"), or an empty list for all fields. Requires
+                        NumPy. In stream mode, building a column takes an extra pass over the trace.
+        :param parse_workers: number of processes that parse a newline-delimited trace when it is loaded into memory.
+                              Number of CPUs if None, and never more.
+        :param follow: if True, the trace is still being written (a capture, JSON or newline-delimited export, or any
+                       of them on a pipe, "-" for the standard input): frames are read in stream mode as soon as they
+                       are appended, waiting for more at the end of the file (see follow.py). Cannot be combined with
+                       the cache, the indexes or the columns, which need the whole trace.
+        :param idle_timeout: in follow mode, seconds without new frames after which the trace is considered complete.
+                             The trace is followed until the TC is over if None.
+        '''
+        self.logger = logging.getLogger(__name__)
+        self.tracefn = tracefn
+        self.__source = None if follow else (tracefn, display_filter)   # see get_identity()
         self.trace = {}
-        with open(tracefn, "r") as tracefile:
-            self.trace = json.load(tracefile)
-        self.numpackets = len(self.trace)
+        self.stream = None
+        self.field_indexes = {} if index_fields else None  # path -> FieldIndex
+        self.__init_columns(columns)
+        compactor = None
+        if compact:
+            compactor = FrameCompactor(STRINGS_LIMIT if stream else None)
+        protocols = projection.protocols() if projection is not None else None
+        merged = isinstance(tracefn, (list, tuple))
+        ndjson = None if follow or merged or is_capture(tracefn) else ek.sniff(tracefn)
+        if merged:
+            assert not (follow or cache), "Merged traces cannot be followed or cached"
+            openers = [file_opener(fn, display_filter if is_capture(fn) else None, tshark, protocols)
+                       for fn in tracefn]
+            merge_projection = projection
+            projection = None   # applied to the frames of every trace, before their origin is added
+            open_frames = lambda hook: merge_frames([opener(None) for opener in openers], list(tracefn),
+                                                    merge_projection, hook)
+        elif follow:
+            assert not (cache or index_protocols or index_fields or columns is not None), \
+                "A followed trace cannot be cached, indexed or held in columns"
+            stream = True
+            open_frames = self.__follower(display_filter, tshark, protocols, idle_timeout)
+        elif is_capture(tracefn):
+            open_frames = lambda hook: open_tshark_frames(tracefn, display_filter, tshark, hook, protocols)
+        elif ndjson is not None:
+            assert (display_filter is None), "Display filters can only be applied to pcap / pcapng captures"
+            names = ek.ek_field_names(tshark) if ndjson == "ek" else {}
+            open_frames = lambda hook: ek.open_ndjson_frames(tracefn, names, hook)
+        else:
+            assert (display_filter is None), "Display filters can only be applied to pcap / pcapng captures"
+            open_frames = lambda hook: open_json_frames(tracefn, hook)
+        if projection is None:
+            self.__opener = lambda: open_frames(compactor)
+        elif compactor is None:
+            self.__opener = lambda: map(projection.apply, open_frames(None))
+        else:
+            self.__opener = lambda: (compactor.compact(projection.apply(frame)) for frame in open_frames(None))
+        frame_cache = None
+        if cache:
+            frame_cache = self.__open_cache(lambda: open_frames(None), display_filter, cache_dir)
+        if frame_cache is not None:
+            self.stream = frame_cache
+            self.__opener = frame_cache.frames
+            self.numpackets = frame_cache.numpackets
+        elif stream:
+            self.stream = FrameStream(self.__opener, lookback)
+            self.numpackets = None      # unknown until the whole trace has been read
+        else:
+            if ndjson is not None:
+                self.trace = ek.load_ndjson_frames(tracefn, names, projection, parse_workers)
+                if compactor is not None:
+                    self.trace = [compactor.compact(frame) for frame in self.trace]
+            elif merged or is_capture(tracefn) or compactor is not None or projection is not None:
+                self.trace = list(self.__opener())     # the text of the trace is not held in memory as a whole
+            else:
+                with open(tracefn, "r") as tracefile:
+                    self.trace = [frame["_source"]["layers"] for frame in json.load(tracefile)]
+            if compactor is not None:
+                compactor.release()
+            self.numpackets = len(self.trace)
         self.current_frame_index = -1      # current frame number inside a trace
-        self.logger = logging.getLogger(__name__)
+        self.protocol_index = None         # protocol -> sorted array of the indexes of the frames that carry it
+        if index_protocols:
+            if frame_cache is not None:
+                self.protocol_index = frame_cache.protocol_index()
+            else:
+                self.__build_protocol_index(self.__iter_frames())
+
+    @classmethod
+    def from_frames(cls, frames, tracefn, index_protocols=False, index_fields=False, columns=None):
+        '''
+        Builds a trace from frames already in memory, e.g. a shard of another trace.
+        :param frames: list of frame layers.
+        :param tracefn: name of the trace, for the logs.
+        :param index_protocols: see __init__().
+        :param index_fields: see __init__().
+        :param columns: see __init__().
+        :return: Trace
+        '''
+        trace = cls.__new__(cls)
+        trace.logger = logging.getLogger(__name__)
+        trace.tracefn = tracefn
+        trace.__source = None
+        trace.trace = frames
+        trace.stream = None
+        trace.field_indexes = {} if index_fields else None
+        trace.__init_columns(columns)
+        trace.numpackets = len(frames)
+        trace.current_frame_index = -1
+        trace.protocol_index = None
+        trace.__opener = lambda: iter(frames)
+        if index_protocols:
+            trace.__build_protocol_index(iter(frames))
+        return trace
+
+    def __follower(self, display_filter, tshark, protocols, idle_timeout):
+        '''
+        Gets the function that opens a followed trace. A trace read from a pipe can only be opened once, so it cannot
+        be rewound beyond the look-back buffer.
+        :return: function that returns a generator of the frames, see __init__().
+        '''
+        opened = []
+
+        def open_frames(hook):
+            assert not (opened and live.is_pipe(self.tracefn)), \
+                "Cannot rewind a trace read from a pipe beyond the look-back buffer. Increase --lookback."
+            opened.append(True)
+            return live.open_followed_frames(self.tracefn, display_filter, tshark, hook, protocols, idle_timeout)
+        return open_frames
+
+    def get_identity(self):
+        '''
+        Identifies the content of the trace, for the checkpoints of the TCs (see checkpoint.py).
+        :return: dict (see cache.source_key()), list of them for merged traces. None if the trace is not made of
+                 complete files: built from frames in memory, or followed.
+        '''
+        if self.__source is None:
+            return None
+        tracefn, display_filter = self.__source
+        if isinstance(tracefn, (list, tuple)):
+            return [source_key(fn, display_filter) for fn in tracefn]
+        return source_key(tracefn, display_filter)
+
+    def __init_columns(self, columns):
+        self.columns = None     # path -> Column
+        self.column_fields = None   # names of the fields held in columns, None for all
+        if columns is not None:
+            columnar.require_numpy()
+            self.columns = {}
+            if len(columns) > 0:
+                self.column_fields = set(columns)
+
+    def __open_cache(self, open_frames, display_filter, cache_dir):
+        '''
+        Opens the cache file of the trace, writing it first if it does not exist or is out of date.
+        :param open_frames: function that returns a generator of the frames parsed from the trace.
+        :return: FrameCache. None if the cache file cannot be written.
+        '''
+        key = source_key(self.tracefn, display_filter)
+        cachefn = cache_path(self.tracefn, cache_dir)
+        frame_cache = FrameCache.open(cachefn, key)
+        if frame_cache is None:
+            self.logger.info("Writing cache file {}".format(cachefn))
+            try:
+                if cache_dir is not None:
+                    os.makedirs(cache_dir, exist_ok=True)
+                numframes = write_cache(cachefn, key, open_frames())
+            except OSError as error:
+                self.logger.warning("Cannot write cache file {}: {}".format(cachefn, error))
+                return None
+            self.logger.info("Cache file {} written with {} frames".format(cachefn, numframes))
+            frame_cache = FrameCache(cachefn)
+        return frame_cache
+
+    def __iter_frames(self):
+        '''
+        Iterates all the frames of the trace, without moving any cursor.
+        '''
+        if self.stream is not None:
+            return self.__opener()
+        return iter(self.trace)
+
+    def __build_protocol_index(self, frames):
+        self.protocol_index = {}
+        numframes = 0
+        for index, frame in enumerate(frames):
+            for protocol in frame:
+                if protocol not in self.protocol_index:
+                    self.protocol_index[protocol] = array("L")
+                self.protocol_index[protocol].append(index)
+            numframes = index + 1
+        self.numpackets = numframes
+        self.logger.info("Protocol index built for {} frames and {} protocols".format(numframes,
+                                                                                   len(self.protocol_index)))
+
+    def get_field_index(self, path):
+        '''
+        Gets the index of the values of a field, building it the first time it is requested.
+        :param path: tuple with the protocol and the keys down to the field.
+        :return: FieldIndex, None if field indexing is not enabled for this trace.
+        '''
+        if self.field_indexes is None:
+            return None
+        if path not in self.field_indexes:
+            self.field_indexes[path] = FieldIndex(path, self.__iter_frames())
+            self.numpackets = self.field_indexes[path].numframes
+        return self.field_indexes[path]
+
+    def get_column(self, path):
+        '''
+        Gets the column of the values of a field, building it the first time it is requested.
+        :param path: tuple with the protocol and the keys down to the field.
+        :return: columns.Column, None if the field is not held in columns for this trace.
+        '''
+        if self.columns is None or (self.column_fields is not None and path[-1] not in self.column_fields):
+            return None
+        if path not in self.columns:
+            self.columns[path] = columnar.Column(path, self.__iter_frames())
+            self.numpackets = self.columns[path].numframes
+        return self.columns[path]
+
+    def candidate_frames(self, matcher):
+        '''
+        Gets the frames that can match the conditions of a rule. With columns, all the mandatory conditions are
+        checked; with field indexes, the conditions on exact values.
+        :param matcher: bound matcher.RuleMatcher of the rule.
+        :return: sorted array with the indexes of the frames that can match all the conditions. None if the frames
+                 cannot be narrowed down.
+        '''
+        if self.columns is not None:
+            candidates = columnar.candidate_frames(self.get_column, matcher.fields)
+            if candidates is not None or self.field_indexes is None:
+                return candidates
+        if self.field_indexes is None:
+            return None
+        smallest = None
+        for path, pattern in matcher.exact_fields:
+            candidates = self.get_field_index(path).candidates(pattern)
+            if smallest is None or len(candidates) < len(smallest):
+                smallest = candidates
+        return smallest
+
+    def next_frame_with(self, protocols, index):
+        '''
+        Finds the first frame, starting at "index", that carries all the given protocols.
+        Without a protocol index, no frame can be skipped and "index" is returned as such.
+        :param protocols: list of protocol names.
+        :param index: index of the first frame to consider.
+        :return: index of the frame. Number of frames in the trace if no frame carries all protocols.
+        '''
+        if self.protocol_index is None or len(protocols) == 0:
+            return index
+        indexes = []
+        for protocol in protocols:
+            if protocol not in self.protocol_index:
+                return self.numpackets
+            indexes.append(self.protocol_index[protocol])
+        indexes.sort(key=len)   # rarest protocol first
+        candidate = index
+        while True:     # leapfrog over the sorted arrays until all of them contain the candidate
+            for frames in indexes:
+                pos = bisect_left(frames, candidate)
+                if pos == len(frames):
+                    return self.numpackets
+                if frames[pos] != candidate:
+                    candidate = frames[pos]
+                    break
+            else:
+                return candidate
 
     def set_frame_index(self, index):
         self.current_frame_index = index
 
     def get_next_frame_index(self):
         self.current_frame_index += 1
-        if(self.current_frame_index >= self.numpackets):
+        if self.stream is not None:
+            if self.stream.get(self.current_frame_index) is None:
+                self.numpackets = self.stream.numpackets
+                return -1
+        elif(self.current_frame_index >= self.numpackets):
             return -1
         return self.current_frame_index
 
     def get_frame(self, index):
-        assert(index < len(self.trace))
-        return self.trace[index]["_source"]["layers"]
+        '''
+        Gets a frame of the trace.
+        :param index: index of the frame inside the trace.
+        :return: layers of the frame. None if index is beyond the end of the trace.
+        '''
+        if self.stream is not None:
+            return self.stream.get(index)
+        if index >= len(self.trace):
+            return None
+        return self.trace[index]
+
+
+def file_opener(tracefn, display_filter=None, tshark=None, protocols=None):
+    '''
+    Gets the function that opens a trace file, whatever its format: capture, JSON export or newline-delimited export.
+    :param tracefn: path of the trace file.
+    :param display_filter: for captures, Wireshark display filter applied by tshark.
+    :param tshark: tshark command. See reader.tshark_command().
+    :param protocols: for captures, protocols (layers) to export. All if None.
+    :return: function that takes a frame.FrameCompactor (or None) and returns a generator of the frames of the trace.
+    '''
+    if is_capture(tracefn):
+        return lambda hook: open_tshark_frames(tracefn, display_filter, tshark, hook, protocols)
+    assert (display_filter is None), "Display filters can only be applied to pcap / pcapng captures"
+    ndjson = ek.sniff(tracefn)
+    if ndjson is not None:
+        names = ek.ek_field_names(tshark) if ndjson == "ek" else {}
+        return lambda hook: ek.open_ndjson_frames(tracefn, names, hook)
+    return lambda hook: open_json_frames(tracefn, hook)
+
+
+def trace_files(tracefn, merge=None):
+    '''
+    Gets the trace argument of Trace from the command line.
+    :param tracefn: trace file.
+    :param merge: list of the trace files merged with it (option --merge), or None.
+    :return: trace file, or list of trace files to merge.
+    '''
+    if not merge:
+        return tracefn
+    return [tracefn] + list(merge)
+
+
+def add_merge_argument(parser):
+    '''
+    Adds the option that merges several traces to the parser of a command line tool.
+    :param parser: argparse.ArgumentParser
+    :return: void
+    '''
+    parser.add_argument("--merge", nargs="+", metavar="TRACE",
+                        help="Traces of other interfaces merged with the trace, in time order (frame.time_epoch).")
+
+
+def add_trace_arguments(parser):
+    '''
+    Adds the options of Trace to the parser of a command line tool.
+    :param parser: argparse.ArgumentParser
+    :return: void
+    '''
+    parser.add_argument("--stream", action="store_true",
+                        help="Parse the trace incrementally instead of loading it into memory. Use for big traces.")
+    parser.add_argument("--lookback", type=int, default=DEFAULT_LOOKBACK,
+                        help="Frames kept in memory in stream mode (default: %(default)s).")
+    parser.add_argument("--index", action="store_true",
+                        help="Index the frames by protocol to skip frames that cannot match a rule.")
+    parser.add_argument("--index-fields", action="store_true",
+                        help="Index the fields matched against exact values, to go straight to correlated frames.")
+    parser.add_argument("--columns", nargs="*", metavar="FIELD",
+                        help="Hold the fields that the rules match in columns, to pre-filter the frames with "
+                             "vectorized operations (needs NumPy). Optionally, the names of the fields to hold "
+                             "(default: all).")
+    parser.add_argument("--compact", action="store_true",
+                        help="Hold frames in a compact form that shares keys and repeated values. Uses less memory.")
+    parser.add_argument("--cache", action="store_true",
+                        help="Read the trace from a binary cache file, written next to it on the first run.")
+    parser.add_argument("--cache-dir", help="Directory of the cache files (default: the directory of the trace).")
+    parser.add_argument("--project", action="store_true",
+                        help="Keep only the protocols and fields that the TC rules use. Cuts memory use.")
+    parser.add_argument("--filter", dest="display_filter",
+                        help="Wireshark display filter applied by tshark when the trace is a pcap / pcapng capture. "
+                             "\"auto\" derives it from the TCs, keeping every frame that they could match.")
+    parser.add_argument("--parse-jobs", type=int,
+                        help="Processes that parse newline-delimited traces (tshark -T ek) loaded into memory "
+                             "(default and maximum: number of CPUs).")
+    parser.add_argument("--follow", action="store_true",
+                        help="Follow a trace that is still being written (capture, export, or \"-\" for a pipe on the "
+                             "standard input), evaluating the rules as frames are appended.")
+    parser.add_argument("--idle-timeout", type=float,
+                        help="In follow mode, seconds without new frames after which the trace is considered "
+                             "complete (default: follow until the TCs are over).")
+    parser.add_argument("--tshark",
+                        help="tshark command used to dissect captures (default: $TRAZER_TSHARK or tshark).")
+
 
+def trace_options(args):
+    '''
+    Gets the Trace options from the parsed command line.
+    :param args: arguments parsed by a parser set up with add_trace_arguments().
+    :return: dict of keyword arguments of Trace, except "projection".
+    '''
+    return {
+        "stream": args.stream,
+        "lookback": args.lookback,
+        "index_protocols": args.index,
+        "index_fields": args.index_fields,
+        "columns": args.columns,
+        "compact": args.compact,
+        "cache": args.cache,
+        "cache_dir": args.cache_dir,
+        "display_filter": args.display_filter,
+        "tshark": args.tshark,
+        "parse_workers": args.parse_jobs,
+        "follow": args.follow,
+        "idle_timeout": args.idle_timeout
+    }
@@ -1,39 +1,61 @@
 #!/usr/bin/env python
+'''
+Test case parser code
+'''
 
-import os
-import sys
+import argparse
 import logging
 from tcparser import trace
 from tcparser import test_case
+from tcparser.trace import add_trace_arguments, add_merge_argument, trace_options, trace_files
+from tcparser.display_filter import apply_auto_filter
+from tcparser.logs import add_logging_arguments, setup_logging
+from tcparser.tc_report import add_report_arguments
+from tcparser.profiling import write_chrome_trace
 
-LOGLEVEL = logging.DEBUG  # DEBUG, INFO, WARNING, ERROR or CRITICAL
-LOGFORMAT = "%(levelname)-9s[%(filename)s:%(lineno)s - %(funcName)s()] %(message)s"
 
-def usage():
+def parse_args():
     '''
-    Prints usage
-    :return:
+    Parses the command line.
+    :return: parsed arguments
     '''
-    print("Usage: test <template_file> <trace_file>")
-    print("\t<tc_file>\tTest Case description file.")
-    print("\t<trace_file>\tJSON trace file obtained from Wireshark.")
-    print("\t<report_file>\tTC report.")
-    sys.exit(1)
+    parser = argparse.ArgumentParser(prog="test", description="Runs a Test Case against a Wireshark JSON trace.")
+    parser.add_argument("tc_file", help="Test Case description file.")
+    parser.add_argument("trace_file", help="JSON trace file obtained from Wireshark, or pcap / pcapng capture.")
+    parser.add_argument("report_file", help="TC report.")
+    add_trace_arguments(parser)
+    add_merge_argument(parser)
+    add_report_arguments(parser)
+    add_logging_arguments(parser)
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 4:
-        usage()
+    args = parse_args()
 
-    logging.basicConfig(filename=os.path.join(os.getcwd(), "logs", "Trazer.log"), filemode='w',
-                        level=LOGLEVEL,
-                        format=LOGFORMAT)
+    setup_logging(args.log_level, args.log_file, args.rule_trace)
     logger = logging.getLogger("TraceAnaliser")
     logger.info('Logging started ...')
-    trace = trace.Trace(sys.argv[2])
-    test_case = test_case.TestCase(sys.argv[1], trace)
+    listener = None
+    if args.follow:
+        listener = lambda index, rule: print("Rule {}: {}".format(index, rule["result"]), flush=True)
+    test_case = test_case.TestCase(args.tc_file, listener=listener)
+    tracefn = trace_files(args.trace_file, args.merge)
+    options = apply_auto_filter(trace_options(args), tracefn, [test_case])
+    trace = trace.Trace(tracefn, **options,
+                        projection=test_case.get_projection() if args.project else None)
+    test_case.set_trace(trace)
+    if args.report_format == "ndjson":
+        test_case.stream_report(args.report_file)
+    if args.profile or args.profile_trace:
+        test_case.profile()
+    if args.checkpoints:
+        test_case.use_checkpoints(args.checkpoints)
     test_case.run()
+    if args.follow:
+        trace.stream.close()    # stops reading the live trace
     logger.info("Test Case Result: {}".format(test_case.get_result()))
     print("Test Case Result: {}".format(test_case.get_result()))
-    test_case.report(sys.argv[3])
-
+    test_case.report(args.report_file)
+    if args.profile_trace:
+        write_chrome_trace(args.profile_trace, [(test_case.filename, test_case.get_report())])
@@ -0,0 +1,22 @@
+'''
+Fixtures shared by the tests.
+'''
+
+import os
+import sys
+import shlex
+import pytest
+from tcparser.reader import TSHARK_ENV
+
+FAKE_TSHARK = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools", "fake_tshark.py")
+
+
+@pytest.fixture
+def tshark(monkeypatch):
+    '''
+    Runs tools/fake_tshark.py instead of tshark, through the TRAZER_TSHARK environment variable.
+    :return: the tshark command.
+    '''
+    command = "{} {}".format(shlex.quote(sys.executable), shlex.quote(FAKE_TSHARK))
+    monkeypatch.setenv(TSHARK_ENV, command)
+    return command
@@ -0,0 +1,40 @@
+'''
+Builders of the frames and traces used by the tests, in the shape of "tshark -T json" exports.
+'''
+
+import json
+
+
+def frame(number, epoch=None, **layers):
+    '''
+    :param number: frame.number.
+    :param epoch: frame.time_epoch. Number seconds after 1600000000 if None.
+    :param layers: protocols of the frame, e.g. sip={"sip.Method": "INVITE"}.
+    :return: frame layers.
+    '''
+    if epoch is None:
+        epoch = 1600000000 + number
+    return dict(frame={"frame.number": str(number), "frame.time_epoch": "{:.6f}".format(epoch)}, **layers)
+
+
+def sip(number, line, callid="c1", epoch=None, **headers):
+    '''
+    :param line: Request-Line (requests) or Status-Line (responses starting with "SIP/2.0").
+    :param headers: other fields of sip.msg_hdr_tree, with "_" for ".", e.g. sip_to_tag="t1".
+    :return: frame layers of a SIP message.
+    '''
+    tree = {"sip.Call-ID": callid}
+    tree.update((name.replace("_", "."), value) for name, value in headers.items())
+    key = "sip.Status-Line" if line.startswith("SIP/2.0") else "sip.Request-Line"
+    return frame(number, epoch, sip={key: line, "sip.msg_hdr_tree": tree})
+
+
+def write_trace(path, frames):
+    '''
+    Writes frames as a JSON trace exported from Wireshark.
+    :param path: pathlib.Path of the trace.
+    :return: path of the trace, as a string.
+    '''
+    path.write_text(json.dumps([{"_index": "packets", "_type": "doc", "_source": {"layers": layers}}
+                                for layers in frames]))
+    return str(path)
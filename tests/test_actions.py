@@ -0,0 +1,118 @@
+'''
+Tests of the compiled "store", "verify" and "report" sections of the rules.
+'''
+
+import re
+import pytest
+from tcparser.actions import Extraction, StorePlan, VerifyPlan, ReportPlan
+from tcparser.frame import FrameCompactor
+from tcparser.profiling import EvaluationCounter
+
+SIP = {"sip.Request-Line": "INVITE sip:b SIP/2.0",
+       "sip.msg_hdr_tree": {"sip.Call-ID": "c1", "sip.Contact": None, "sip.Via": []},
+       "sip.Route": [{"sip.Route.uri": "r1"}, {"sip.Route.host": "h2"}, {"sip.Route.uri": ["r3", "r4"]}, "x"]}
+FRAME = {"sip": SIP, "udp": "not a dict"}
+
+
+def step_by_step_verify(verify, tcvars):
+    '''
+    Verification of a rule before VerifyPlan: every condition is checked, in order.
+    '''
+    returnvalue = False
+    for ver_item in verify:
+        if "contains" in ver_item:
+            if ver_item["field"] in tcvars:
+                if type(tcvars[ver_item["field"]]) is list:
+                    for listitem in tcvars[ver_item["field"]]:
+                        if re.search("(.*)" + ver_item["contains"] + "(.*)", listitem):
+                            returnvalue = True
+                            break
+                elif re.search("(.*)" + ver_item["contains"] + "(.*)", tcvars[ver_item["field"]]):
+                    returnvalue = True
+        elif "is" in ver_item:
+            if ver_item["is"] == tcvars[ver_item["field"]]:
+                returnvalue = True
+    return returnvalue
+
+
+def outcome(verify, tcvars):
+    try:
+        return verify(tcvars)
+    except KeyError as error:
+        return "KeyError {}".format(error)
+
+
+@pytest.mark.parametrize("item, found, value", [
+    ({"sip.Request-Line": "line"}, True, "INVITE sip:b SIP/2.0"),
+    ({"sip.msg_hdr_tree": {"sip.Call-ID": "call_id"}}, True, "c1"),
+    ({"sip.msg_hdr_tree": {"sip.Contact": "contact"}}, True, None),
+    ({"sip.msg_hdr_tree": {"sip.Via": "via"}}, False, None),
+    ({"sip.msg_hdr_tree": {"sip.From": "from"}}, False, None),
+    ({"sip.Route": {"sip.Route.uri": "uri"}}, True, ["r1", ["r3", "r4"]]),
+    ({"sip.Route": {"sip.Route.host": "host"}}, True, "h2"),
+    ({"sip.Request-Line": {"sip.Method": "method"}}, False, None)])
+def test_extraction(item, found, value):
+    extraction = Extraction("sip", item)
+    assert extraction.extract(FRAME) == (found, value)
+    assert extraction.extract(FrameCompactor().compact(FRAME)) == (found, value)
+
+
+def test_store_plan():
+    plan = StorePlan({"sip": [{"sip.msg_hdr_tree": {"sip.Call-ID": "call_id"}},
+                              {"sip.msg_hdr_tree": {"sip.Contact": "contact"}},
+                              {"sip.msg_hdr_tree": {"sip.From": "from"}},
+                              {"sip.msg_hdr_tree": {}}],
+                      "udp": [{"udp.port": "port"}], "sdp": [{"sdp.media": "media"}]})
+    assert [extraction.variable for extraction in plan.extractions] == ["call_id", "contact", "from", "port", "media"]
+    tcvars = {"from": "kept", "call_id": "c0"}
+    assert plan.apply(FRAME, tcvars) == ["call_id", "contact"]
+    assert tcvars == {"from": "kept", "call_id": "c1", "contact": ""}
+
+
+VERIFY = [{"field": "a", "contains": "b+"},
+          {"field": "list", "contains": "^x"},
+          {"field": "a", "is": "abb"},
+          {"field": "missing", "is": "v"},
+          {"field": "missing", "contains": "v"},
+          {"field": "a"}]
+TCVARS = [{"a": "abb", "list": ["y", "x1"], "missing": "v"}, {"a": "a", "list": ["y"], "missing": "w"},
+          {"a": "abb", "list": []}, {"a": "a", "list": ["x"]}, {"a": "zz", "list": ["y"]}, {}]
+
+
+@pytest.mark.parametrize("tcvars", TCVARS)
+@pytest.mark.parametrize("conditions", [VERIFY[:1], VERIFY[1:2], VERIFY[:3], VERIFY, VERIFY[::-1], VERIFY[3:],
+                                        [VERIFY[4], VERIFY[0]], [VERIFY[5]], []])
+def test_verify_plan_as_step_by_step(conditions, tcvars):
+    plan = VerifyPlan(conditions)
+    assert outcome(plan.verify, tcvars) == outcome(lambda tcvars: step_by_step_verify(conditions, tcvars), tcvars)
+
+
+def test_verify_plan_stops_at_first_condition_met():
+    plan = VerifyPlan([{"field": "a", "contains": "b"}, {"field": "a", "contains": "c"}])
+    plan.count_evaluations(EvaluationCounter())
+    assert plan.verify({"a": "b"})
+    assert plan.counter.count == 1
+    assert not plan.verify({"a": "d"})
+    assert plan.counter.count == 3
+
+
+@pytest.mark.parametrize("value, tcvars, reported", [
+    ("fixed", {}, "fixed"),
+    (5, {}, 5),
+    ("id {{call_id}}!", {"call_id": "c1"}, "id c1!"),
+    ("{{call_id}}", {"call_id": r"a\\b"}, "a\\b"),
+    ("{{routes}}", {"routes": ["r1", "r2"]}, "['r1', 'r2']"),
+    ("{{a}}\n{{a}}", {"a": "x"}, "x\nx")])
+def test_report_plan(value, tcvars, reported):
+    added = []
+    ReportPlan([{"tag": "t", "value": value}]).apply(tcvars, lambda tag, text: added.append((tag, text)))
+    assert added == [("t", reported)]
+    if type(value) is str and "{{" in value:
+        replacement = tcvars[re.search("{{(.*)}}", value).group(1)]
+        assert reported == re.sub("{{(.*)}}", "{}".format(replacement) if type(replacement) is list else replacement,
+                                  value)
+
+
+def test_report_plan_variable_not_stored():
+    with pytest.raises(AssertionError, match="call_id not stored"):
+        ReportPlan([{"tag": "t", "value": "{{call_id}}"}]).apply({}, lambda tag, text: None)
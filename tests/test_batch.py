@@ -0,0 +1,104 @@
+'''
+Tests of the batch runner.
+'''
+
+import os
+import json
+from tcparser import batch
+from .frames import sip, write_trace
+
+TC = {"template": [{"match": {"sip": [{"sip.Request-Line": "^INVITE"}]}}]}
+
+
+def write_tc(path, description=TC):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(description))
+    return str(path)
+
+
+def test_unique_names_same_directory():
+    names = batch.unique_names(["traces/a.json", "traces/b.pcapng"], keep_extension=False)
+    assert names == {"traces/a.json": "a", "traces/b.pcapng": "b"}
+
+
+def test_unique_names_same_name_in_different_directories():
+    names = batch.unique_names(["site1/call.json", "site2/call.json", "site2/tcs/call.json"])
+    assert names == {"site1/call.json": os.path.join("site1", "call.json"),
+                     "site2/call.json": os.path.join("site2", "call.json"),
+                     "site2/tcs/call.json": os.path.join("site2", "tcs", "call.json")}
+
+
+def test_unique_names_only_differ_by_extension():
+    names = batch.unique_names(["traces/call.json", "traces/call.pcapng"], keep_extension=False)
+    assert names == {"traces/call.json": "call.json", "traces/call.pcapng": "call.pcapng"}
+
+
+def test_reports_of_traces_with_the_same_name(tmp_path):
+    (tmp_path / "site1").mkdir()
+    (tmp_path / "site2").mkdir()
+    tracefns = [write_trace(tmp_path / "site1" / "call.json", [sip(1, "INVITE sip:b SIP/2.0")]),
+                write_trace(tmp_path / "site2" / "call.json", [sip(1, "BYE sip:b SIP/2.0")])]
+    tcfns = [write_tc(tmp_path / "tcs" / "tc.json")]
+    summary = batch.run_batch(tracefns, tcfns, str(tmp_path / "reports"), {}, workers=1,
+                              logging_options=("WARNING", str(tmp_path / "trazer.log"), None))
+    results = dict((result["trace"], result) for result in summary["results"])
+    assert results[tracefns[0]]["report"] == str(tmp_path / "reports" / "site1" / "call" / "tc.json")
+    assert results[tracefns[1]]["report"] == str(tmp_path / "reports" / "site2" / "call" / "tc.json")
+    assert json.loads((tmp_path / "reports" / "site1" / "call" / "tc.json").read_text())["result"] == "Passed"
+    assert json.loads((tmp_path / "reports" / "site2" / "call" / "tc.json").read_text())["result"] == "Failed"
+
+
+def test_error_in_tc_does_not_rerun_others(tmp_path, monkeypatch):
+    tracefn = write_trace(tmp_path / "call.json", [sip(1, "INVITE sip:b SIP/2.0"), sip(2, "BYE sip:b SIP/2.0")])
+    good = write_tc(tmp_path / "good.json")
+    bad = write_tc(tmp_path / "bad.json", {"template": [
+        {"match": {"sip": [{"sip.Request-Line": "^INVITE"}]}},
+        {"match": {"sip": [{"sip.msg_hdr_tree": {"sip.Call-ID": "{{call_id}}"}}]}}]})   # never stored
+    def run(test_case):
+        raise AssertionError("TC run again")
+    monkeypatch.setattr(batch.TestCase, "run", run)
+    results = dict((result["tc"], result) for result in
+                   batch.run_job(tracefn, [good, bad], str(tmp_path / "reports"), {}))
+    assert results[good]["result"] == "Passed"
+    assert results[bad]["result"] == "Error"
+    assert "call_id not stored" in results[bad]["error"]
+
+
+def test_trace_error_reruns_unfinished_tcs(tmp_path, monkeypatch):
+    tracefn = write_trace(tmp_path / "call.json", [sip(1, "INVITE sip:b SIP/2.0"), sip(2, "BYE sip:b SIP/2.0")])
+    first = write_tc(tmp_path / "first.json")
+    second = write_tc(tmp_path / "second.json", {"template": [{"match": {"sip": [{"sip.Request-Line": "^BYE"}]}}]})
+    get_frame = batch.Trace.get_frame
+    def broken(trace, index):
+        if index > 0:
+            raise OSError("trace truncated")
+        return get_frame(trace, index)
+    monkeypatch.setattr(batch.Trace, "get_frame", broken)
+    rerun = []
+    run = batch.TestCase.run
+    def run_again(test_case):
+        rerun.append(test_case.filename)
+        run(test_case)
+    monkeypatch.setattr(batch.TestCase, "run", run_again)
+    results = dict((result["tc"], result) for result in
+                   batch.run_job(tracefn, [first, second], str(tmp_path / "reports"), {}))
+    assert results[first]["result"] == "Passed"
+    assert results[second]["result"] == "Error"
+    assert rerun == [second]
+
+
+def test_directory_of_traces_in_every_format(tmp_path):
+    traces = tmp_path / "traces"
+    traces.mkdir()
+    write_trace(traces / "array.json", [sip(1, "INVITE sip:b SIP/2.0")])
+    for name in ("lines.ndjson", "lines.jsonl"):
+        (traces / name).write_text(json.dumps({"_source": {"layers": sip(1, "INVITE sip:b SIP/2.0")}}) + "\n")
+    for name in ("export.ek", "capture.pcapng", "notes.txt"):
+        (traces / name).write_text("")
+    tracefns = batch.find_files([str(traces)], batch.TRACE_EXTENSIONS)
+    assert [os.path.basename(tracefn) for tracefn in tracefns] == [
+        "array.json", "capture.pcapng", "export.ek", "lines.jsonl", "lines.ndjson"]
+    summary = batch.run_batch([tracefn for tracefn in tracefns if "lines" in tracefn], [write_tc(tmp_path / "tc.json")],
+                              str(tmp_path / "reports"), {}, workers=1,
+                              logging_options=("WARNING", str(tmp_path / "trazer.log"), None))
+    assert [result["result"] for result in summary["results"]] == ["Passed", "Passed"]
@@ -0,0 +1,92 @@
+'''
+Tests of the binary sidecar cache of parsed traces.
+'''
+
+import os
+import pytest
+from tcparser import cache
+from tcparser import trace as trace_module
+from tcparser.trace import Trace
+from .frames import frame, sip, write_trace
+
+CALL = [sip(1, "INVITE sip:b SIP/2.0"), frame(2, udp={"udp.port": "5060"}), sip(3, "SIP/2.0 200 OK")]
+
+
+def frames_of(trace):
+    frames = []
+    index = 0
+    while trace.get_frame(index) is not None:
+        frames.append(trace.get_frame(index))
+        index += 1
+    return frames
+
+
+def test_write_and_reopen(tmp_path, monkeypatch):
+    tracefn = write_trace(tmp_path / "call.json", CALL)
+    first = Trace(tracefn, cache=True, index_protocols=True)
+    assert os.path.exists(tracefn + cache.CACHE_SUFFIX)
+    assert frames_of(first) == CALL
+    def fail(*args, **kwargs):
+        raise AssertionError("trace parsed again")
+    monkeypatch.setattr(trace_module, "open_json_frames", fail)
+    monkeypatch.setattr(trace_module, "write_cache", fail)
+    second = Trace(tracefn, cache=True, index_protocols=True)
+    assert second.numpackets == 3
+    assert frames_of(second) == CALL
+    assert dict((protocol, list(indexes)) for protocol, indexes in second.protocol_index.items()) == {
+        "frame": [0, 1, 2], "sip": [0, 2], "udp": [1]}
+
+
+def test_cache_directory(tmp_path):
+    tracefn = write_trace(tmp_path / "call.json", CALL)
+    Trace(tracefn, cache=True, cache_dir=str(tmp_path / "caches"))
+    assert os.listdir(str(tmp_path / "caches")) == ["call.json" + cache.CACHE_SUFFIX]
+    assert not os.path.exists(tracefn + cache.CACHE_SUFFIX)
+
+
+def test_changed_trace_rebuilds_cache(tmp_path):
+    tracefn = write_trace(tmp_path / "call.json", CALL)
+    Trace(tracefn, cache=True)
+    write_trace(tmp_path / "call.json", CALL[:2])
+    assert frames_of(Trace(tracefn, cache=True)) == CALL[:2]
+
+
+def test_same_size_and_time_with_other_content(tmp_path):
+    tracefn = write_trace(tmp_path / "call.json", CALL)
+    stat = os.stat(tracefn)
+    Trace(tracefn, cache=True)
+    edited = [sip(1, "INVITE sip:c SIP/2.0")] + CALL[1:]
+    write_trace(tmp_path / "call.json", edited)
+    os.utime(tracefn, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert os.stat(tracefn).st_size == stat.st_size
+    assert frames_of(Trace(tracefn, cache=True)) == edited
+
+
+def test_key_depends_on_display_filter(tmp_path):
+    tracefn = write_trace(tmp_path / "call.json", CALL)
+    assert cache.source_key(tracefn) == cache.source_key(tracefn)
+    assert cache.source_key(tracefn, "sip") != cache.source_key(tracefn)
+
+
+def test_invalid_cache_file_rebuilt(tmp_path):
+    tracefn = write_trace(tmp_path / "call.json", CALL)
+    (tmp_path / ("call.json" + cache.CACHE_SUFFIX)).write_bytes(b"not a cache")
+    assert cache.FrameCache.open(tracefn + cache.CACHE_SUFFIX, cache.source_key(tracefn)) is None
+    assert frames_of(Trace(tracefn, cache=True)) == CALL
+    assert cache.FrameCache.open(tracefn + cache.CACHE_SUFFIX, cache.source_key(tracefn)) is not None
+
+
+def test_interrupted_write_keeps_previous_cache(tmp_path):
+    tracefn = write_trace(tmp_path / "call.json", CALL)
+    cachefn = tracefn + cache.CACHE_SUFFIX
+    key = cache.source_key(tracefn)
+    cache.write_cache(cachefn, key, CALL)
+    def interrupted():
+        yield CALL[0]
+        raise KeyboardInterrupt()
+    with pytest.raises(KeyboardInterrupt):
+        cache.write_cache(cachefn, dict(key, size=0), interrupted())
+    assert sorted(os.listdir(str(tmp_path))) == ["call.json", "call.json" + cache.CACHE_SUFFIX]     # no temporary file
+    frame_cache = cache.FrameCache.open(cachefn, key)
+    assert list(frame_cache.frames()) == CALL
+    frame_cache.close()
@@ -0,0 +1,101 @@
+'''
+Tests of the restart of TCs from the checkpoints of their unchanged rules.
+'''
+
+import pytest
+from tcparser.trace import Trace
+from tcparser import test_case
+from .frames import sip, write_trace
+
+INVITE = {"match": {"sip": [{"sip.Request-Line": "^INVITE"}]},
+          "store": {"sip": [{"sip.msg_hdr_tree": {"sip.Call-ID": "call_id"}}]}}
+RINGING = {"match": {"sip": [{"sip.Status-Line": "180"}, {"sip.msg_hdr_tree": {"sip.Call-ID": "{{call_id}}"}}]},
+           "report": [{"tag": "Call-ID", "value": "{{call_id}}"}]}
+EARLY = {"optional": True, "match": {"sip": [{"sip.Status-Line": "183"}]}}
+ANSWER = {"match": {"sip": [{"sip.Status-Line": "200 OK"}]}}
+ACK = {"match": {"sip": [{"sip.Request-Line": "^ACK"}]}}
+BYE = {"match": {"sip": [{"sip.Request-Line": "^BYE"}]}}
+CALL = [sip(1, "INVITE sip:b SIP/2.0"), sip(2, "SIP/2.0 100 Trying"), sip(3, "SIP/2.0 180 Ringing"),
+        sip(4, "SIP/2.0 200 OK"), sip(5, "ACK sip:b SIP/2.0")]
+
+
+@pytest.fixture
+def fed(monkeypatch):
+    '''
+    :return: list of the indexes of the frames read by the TCs.
+    '''
+    indexes = []
+    get_frame = Trace.get_frame
+    def recorded(trace, index):
+        indexes.append(index)
+        return get_frame(trace, index)
+    monkeypatch.setattr(Trace, "get_frame", recorded)
+    return indexes
+
+
+def run(tracefn, template, checkpoint_dir=None, variables=None):
+    description = {"template": template}
+    if variables is not None:
+        description["variables"] = variables
+    tc = test_case.TestCase("tc.json", Trace(tracefn), description=description)
+    if checkpoint_dir is not None:
+        tc.use_checkpoints(str(checkpoint_dir))
+    tc.run()
+    return tc.get_report()
+
+
+def test_unchanged_tc_taken_from_checkpoint(tmp_path, fed):
+    tracefn = write_trace(tmp_path / "call.json", CALL)
+    first = run(tracefn, [INVITE, RINGING, ANSWER], tmp_path / "checkpoints")
+    del fed[:]
+    assert run(tracefn, [INVITE, RINGING, ANSWER], tmp_path / "checkpoints") == first
+    assert fed == []
+
+
+def test_edited_last_rule_restarts_after_the_rule_before(tmp_path, fed):
+    tracefn = write_trace(tmp_path / "call.json", CALL)
+    run(tracefn, [INVITE, RINGING, ANSWER], tmp_path / "checkpoints")
+    del fed[:]
+    report = run(tracefn, [INVITE, RINGING, ACK], tmp_path / "checkpoints")
+    assert fed[0] == 3      # frame after the 180 Ringing of rule 1
+    assert report["result"] == "Passed"
+    assert [rule.get("frame_number") for rule in report["rules"]] == [0, 2, 4]
+    assert report["rules"][1]["Call-ID"] == "c1"    # variable stored before the checkpoint
+
+
+def test_failed_tc_reused_for_edits_after_the_failed_rule(tmp_path, fed):
+    tracefn = write_trace(tmp_path / "call.json", CALL)
+    first = run(tracefn, [INVITE, BYE, ANSWER], tmp_path / "checkpoints")
+    del fed[:]
+    assert run(tracefn, [INVITE, BYE, ACK], tmp_path / "checkpoints") == first
+    assert fed == []
+
+
+@pytest.mark.parametrize("variables", [None, {"user": "b"}, {"user": "a", "domain": "example.org"}])
+def test_variables_change_invalidates_checkpoints(tmp_path, fed, variables):
+    tracefn = write_trace(tmp_path / "call.json", CALL)
+    run(tracefn, [INVITE, RINGING, ANSWER], tmp_path / "checkpoints", {"user": "a"})
+    del fed[:]
+    run(tracefn, [INVITE, RINGING, ACK], tmp_path / "checkpoints", variables)
+    assert fed[0] == 0
+
+
+def test_trace_change_invalidates_checkpoints(tmp_path, fed):
+    tracefn = write_trace(tmp_path / "call.json", CALL)
+    run(tracefn, [INVITE, RINGING, ANSWER], tmp_path / "checkpoints")
+    write_trace(tmp_path / "call.json", [sip(1, "INVITE sip:b SIP/2.0", "c2"), sip(2, "SIP/2.0 180 Ringing", "c2"),
+                                         sip(3, "SIP/2.0 200 OK", "c2")])
+    del fed[:]
+    report = run(tracefn, [INVITE, RINGING, ANSWER], tmp_path / "checkpoints")
+    assert fed[0] == 0
+    assert report["rules"][1]["Call-ID"] == "c2"
+
+
+@pytest.mark.parametrize("template", [[INVITE, RINGING, ANSWER, ACK], [INVITE, EARLY, ANSWER, BYE],
+                                      [INVITE, EARLY, RINGING], [BYE, ANSWER]])
+def test_same_report_with_checkpoints(tmp_path, template):
+    tracefn = write_trace(tmp_path / "call.json", CALL)
+    expected = run(tracefn, template)
+    for edited in [template[:1], template[:-1] + [ACK], template]:
+        run(tracefn, edited, tmp_path / "checkpoints")
+        assert run(tracefn, template, tmp_path / "checkpoints") == expected
@@ -0,0 +1,83 @@
+'''
+Tests of the columnar pre-filter of the frames that can match a rule.
+'''
+
+import pytest
+from tcparser import columns
+from tcparser.index import field_values
+from tcparser.matcher import Pattern, MATCH
+from .frames import frame
+
+pytest.importorskip("numpy")
+
+PORT = ("udp", "udp.port")
+METHOD = ("sip", "sip.Method")
+FRAMES = [frame(1, udp={"udp.port": "5060"}, sip={"sip.Method": "INVITE"}),
+          frame(2, udp={"udp.port": "5061"}, sip={"sip.Method": "BYE"}),
+          frame(3, udp={"udp.port": ["5060", "53"]}, sip={"sip.Method": "INVITE\n"}),
+          frame(4, udp={"udp.port": "1002"}, sip={"sip.Method": "a.b"}),
+          frame(5, udp={"udp.port": []}, sip={"sip.Method": ["aXb", "ACK"]}),
+          frame(6, rtp={}),
+          frame(7, udp={"udp.port": "100"}, sip={"sip.Method": "INVITES"})]
+PATTERNS = ["^5060$", r"\A(5060|53)\Z", "^10[0-2]$", "^100[0-9]$", "50", "^05060$", "^(INVITE|BYE)$",
+            "^INVITE$", r"^INVITE\Z", r"^a\.b$", "^a.b$", "(?i)^invite$", "^[^B]YE$", r"^\d+$", "^(?:ACK)$",
+            "^$", "^[0-9][0-9][0-9][0-9]$"]
+
+
+def expected(path, source):
+    pattern = Pattern(source)
+    indexes = []
+    for index, layers in enumerate(FRAMES):
+        if path[0] in layers:
+            values, unconditional = field_values(path, layers[path[0]])
+            if unconditional or any(pattern.match_str(value) == MATCH for value in values):
+                indexes.append(index)
+    return indexes
+
+
+@pytest.mark.parametrize("source, values", [
+    ("^302$", {"302", "302\n"}),
+    (r"\A(INVITE|BYE)\Z", {"INVITE", "BYE"}),
+    ("^10[0-2]$", {"100", "101", "102", "100\n", "101\n", "102\n"}),
+    (r"^a\.b\Z", {"a.b"}),
+    ("^(?:a|b)(c|d)$", {"ac", "ad", "bc", "bd", "ac\n", "ad\n", "bc\n", "bd\n"}),
+    ("^$", set()),
+    ("^a.b$", None),
+    ("INVITE", None),
+    ("^INVITE", None),
+    ("(?i)^a$", None),
+    ("(?m)^a$", None),
+    ("^[^a]$", None),
+    (r"^\d$", None),
+    ("^a+$", None),
+    ("^[0-9][0-9][0-9][0-9]$", None),   # more than VALUES_LIMIT
+    ("^(", None)])
+def test_whole_values(source, values):
+    assert columns.whole_values(source) == values
+
+
+@pytest.mark.parametrize("source", PATTERNS)
+@pytest.mark.parametrize("path", [PORT, METHOD])
+def test_candidate_frames(path, source):
+    column = columns.Column(path, FRAMES)
+    assert column.istyped == (path == PORT)
+    candidates = columns.candidate_frames(lambda field: column if field == path else None, [(path, Pattern(source))])
+    assert list(candidates) == expected(path, source)
+
+
+def test_conditions_on_several_columns():
+    built = dict((path, columns.Column(path, FRAMES)) for path in [PORT, METHOD])
+    candidates = columns.candidate_frames(built.get, [(PORT, Pattern("^5060$")), (METHOD, Pattern("^INVITE$")),
+                                                      (("ip", "ip.src"), Pattern("10.0.0.1"))])
+    assert list(candidates) == [0, 2]
+    assert columns.candidate_frames(built.get, [(("ip", "ip.src"), Pattern("10.0.0.1"))]) is None
+
+
+@pytest.mark.parametrize("source", PATTERNS)
+def test_without_sre_parse(monkeypatch, source):
+    monkeypatch.setattr(columns, "sre_parse", None)
+    assert columns.whole_values(source) is None
+    for path in [PORT, METHOD]:
+        column = columns.Column(path, FRAMES)
+        assert list(columns.candidate_frames(lambda field: column, [(path, Pattern(source))])) == \
+            expected(path, source)
@@ -0,0 +1,159 @@
+'''
+Tests of the trace analysis service.
+'''
+
+import os
+import asyncio
+import pytest
+from tcparser import daemon
+from tcparser.daemon import TraceStore, TraceDaemon, resolve_path, resolve_imports
+from .frames import sip, write_trace
+
+MEMORY_CAP = 64 * 1048576
+
+
+def touch(path, seconds):
+    os.utime(path, ns=(seconds * 10 ** 9, seconds * 10 ** 9))
+
+
+def test_trace_kept_loaded(tmp_path):
+    tracefn = write_trace(tmp_path / "call.json", [sip(1, "INVITE sip:b SIP/2.0")])
+    store = TraceStore(MEMORY_CAP, {})
+    first, isloaded = store.get(tracefn)
+    assert isloaded
+    second, isloaded = store.get(tracefn)
+    assert not isloaded
+    assert second is first
+
+
+def test_rewritten_trace_loaded_again(tmp_path):
+    tracefn = write_trace(tmp_path / "call.json", [sip(1, "INVITE sip:b SIP/2.0")])
+    touch(tracefn, 1000)
+    store = TraceStore(MEMORY_CAP, {})
+    old, isloaded = store.get(tracefn)
+    write_trace(tmp_path / "call.json", [sip(1, "BYE sip:b SIP/2.0")])     # same size
+    touch(tracefn, 2000)
+    new, isloaded = store.get(tracefn)
+    assert isloaded
+    assert new.trace.get_frame(0)["sip"]["sip.Request-Line"] == "BYE sip:b SIP/2.0"
+    assert len(store.status()) == 1
+
+
+def test_extended_trace_loaded_again_while_in_use(tmp_path):
+    tracefn = write_trace(tmp_path / "call.json", [sip(1, "INVITE sip:b SIP/2.0")])
+    touch(tracefn, 1000)
+    store = TraceStore(MEMORY_CAP, {})
+    old, isloaded = store.get(tracefn)
+    old.users += 1      # a TC is running against it
+    write_trace(tmp_path / "call.json", [sip(1, "INVITE sip:b SIP/2.0"), sip(2, "BYE sip:b SIP/2.0")])
+    touch(tracefn, 1000)    # same time, different size
+    new, isloaded = store.get(tracefn)
+    assert isloaded
+    assert new.trace.numpackets == 2
+    assert old.trace.get_frame(0) is not None   # still usable by the running TC
+    assert store.status()[0]["users"] == 0
+
+
+def test_in_use_trace_not_evicted(tmp_path):
+    first = write_trace(tmp_path / "first.json", [sip(1, "INVITE sip:b SIP/2.0")])
+    second = write_trace(tmp_path / "second.json", [sip(1, "BYE sip:b SIP/2.0")])
+    store = TraceStore(MEMORY_CAP, {})
+    loaded, isloaded = store.get(first)
+    loaded.users += 1
+    assert not store.evict(first)
+    store.memory_cap = 0    # loading another trace must make room
+    store.get(second)
+    assert [status["trace"] for status in store.status()] == [first, second]
+    assert loaded.trace.get_frame(0) is not None
+    loaded.users -= 1
+    assert store.evict(first)
+    assert not store.evict(first)
+    assert [status["trace"] for status in store.status()] == [second]
+
+
+def test_least_recently_used_evicted_first(tmp_path):
+    tracefns = [write_trace(tmp_path / "{}.json".format(name), [sip(1, "INVITE sip:b SIP/2.0")])
+                for name in ["a", "b", "c"]]
+    store = TraceStore(MEMORY_CAP, {})
+    for tracefn in tracefns[:2]:
+        store.get(tracefn)
+    store.get(tracefns[0])      # b is now the least recently used
+    store.memory_cap = store.used_memory() + 1
+    store.get(tracefns[2])
+    assert tracefns[1] not in [status["trace"] for status in store.status()]
+
+
+@pytest.mark.parametrize("path, cwd, resolved", [
+    ("/traces/call.json", None, "/traces/call.json"),
+    ("/traces/../call.json", "/tcs", "/call.json"),
+    ("call.json", "/tcs", "/tcs/call.json"),
+    ("../traces/call.json", "/tcs", "/traces/call.json")])
+def test_resolve_path(path, cwd, resolved):
+    assert resolve_path(path, cwd) == resolved
+
+
+def test_relative_path_needs_cwd():
+    with pytest.raises(AssertionError, match="cwd"):
+        resolve_path("call.json", None)
+
+
+def test_resolve_imports():
+    description = {"import": ["vars.txt", "/common/vars.txt"], "template": []}
+    assert resolve_imports(description, "/tcs") == {"import": ["/tcs/vars.txt", "/common/vars.txt"], "template": []}
+    assert description["import"] == ["vars.txt", "/common/vars.txt"]
+    assert resolve_imports({"template": []}, None) == {"template": []}
+
+
+async def exchange(socket_path, messages):
+    '''
+    Sends requests to a service listening on a Unix socket.
+    :param messages: requests, or functions called between two requests.
+    :return: list of the answers to every request.
+    '''
+    service = TraceDaemon(MEMORY_CAP, workers=2)
+    server = asyncio.ensure_future(service.serve(socket_path=socket_path))
+    try:
+        while not os.path.exists(socket_path):
+            await asyncio.sleep(0.01)
+        answers = []
+        for message in messages:
+            if callable(message):
+                message()
+            else:
+                answers.append([answer async for answer in daemon.request(message, socket_path=socket_path)])
+        return answers
+    finally:
+        server.cancel()
+        service.close()
+
+
+def test_run_with_client_cwd(tmp_path):
+    write_trace(tmp_path / "call.json", [sip(1, "INVITE sip:b SIP/2.0")])
+    (tmp_path / "vars.txt").write_text("method INVITE\n")
+    tc = {"import": ["vars.txt"], "template": [{"match": {"sip": [{"sip.Request-Line": "^{{method}}"}]}}]}
+    answers = asyncio.run(exchange(str(tmp_path / "daemon.sock"), [
+        {"trace": "call.json", "tc": tc, "cwd": str(tmp_path)},
+        {"trace": str(tmp_path / "call.json"), "tc": tc},
+        {"trace": "call.json", "tc": {"template": []}},
+        {"command": "status"}]))
+    assert answers[0][0] == {"event": "trace", "trace": str(tmp_path / "call.json"), "loaded": True,
+                             "load_s": answers[0][0]["load_s"]}
+    assert answers[0][-1]["result"] == "Passed"
+    assert [answer["error"] for answer in answers[1] + answers[2]] == [
+        "AssertionError: Relative path {} needs the \"cwd\" of the client in the request".format(path)
+        for path in ["vars.txt", "call.json"]]
+    assert [status["users"] for status in answers[3][0]["traces"]] == [0]
+
+
+def test_run_reloads_changed_trace(tmp_path):
+    tracefn = write_trace(tmp_path / "call.json", [sip(1, "INVITE sip:b SIP/2.0")])
+    touch(tracefn, 1000)
+
+    def rewrite():
+        write_trace(tmp_path / "call.json", [sip(1, "BYE sip:b SIP/2.0")])     # same size
+        touch(tracefn, 2000)
+
+    run = {"trace": tracefn, "tc": {"template": [{"match": {"sip": [{"sip.Request-Line": "^BYE"}]}}]}}
+    runs = asyncio.run(exchange(str(tmp_path / "daemon.sock"), [run, run, rewrite, run]))
+    assert [answers[0]["loaded"] for answers in runs] == [True, False, True]
+    assert [answers[-1]["result"] for answers in runs] == ["Failed", "Failed", "Passed"]
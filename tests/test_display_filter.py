@@ -0,0 +1,108 @@
+'''
+Tests of the display filters derived from the TCs. tshark is replaced by tools/fake_tshark.py (see conftest.py).
+'''
+
+import pytest
+from tcparser import display_filter
+from tcparser.display_filter import FilterBuilder, required_literals, quote
+from tcparser.trace import Trace
+from tcparser import test_case
+from .frames import frame, sip, write_trace
+
+FIELDS = {"sip.Request-Line", "sip.Status-Line", "sip.Call-ID", "sip.To"}
+CALL = [sip(1, "INVITE sip:b SIP/2.0", sip_To="<sip:+43664@ims>"), frame(2, udp={"udp.port": "5060"}),
+        sip(3, "SIP/2.0 180 Ringing"), sip(4, "SIP/2.0 200 OK"), sip(5, "ACK sip:b SIP/2.0"),
+        frame(6, diameter={"diameter.Session-Id": "s1"})]
+
+
+def rule(match, **options):
+    return dict(options, match=match)
+
+
+@pytest.mark.parametrize("source, literals", [
+    ("^INVITE sip:", ["INVITE sip:"]),
+    (r"a\.b\$", ["a.b$"]),
+    ("ab.c", ["ab", "c"]),
+    ("abc?d", ["ab", "d"]),
+    ("x+y", ["y"]),
+    ("INVITE|BYE", []),
+    ("180|183", ["18"]),
+    ("(INVITE)", []),
+    ("[AB]YE", ["YE"]),
+    ("(?i)invite", []),
+    ("(", [])])
+def test_required_literals(source, literals):
+    assert required_literals(source) == literals
+
+
+def test_without_sre_parse(monkeypatch):
+    monkeypatch.setattr(display_filter, "sre_parse", None)
+    assert required_literals("^INVITE") == []
+    assert FilterBuilder([rule({"sip": [{"sip.Request-Line": "^INVITE"}]})], {}, FIELDS).build() == "sip"
+
+
+@pytest.mark.parametrize("literal, quoted", [
+    ("INVITE", '"INVITE"'),
+    ('say "hi"', r'"say \"hi\""'),
+    ("C:\\dir", None),
+    ("caf\u00e9", None),
+    ("a\tb", None)])
+def test_quote(literal, quoted):
+    assert quote(literal) == quoted
+
+
+def test_conditions_of_rules():
+    template = [rule({"sip": [{"sip.Request-Line": "^INVITE"}, {"sip.msg_hdr_tree": {"sip.To": "43664"}}]}),
+                rule({"diameter": [{"diameter.Session-Id": "s1"}]})]
+    assert FilterBuilder(template, {}, FIELDS).build() == \
+        '(sip and sip.Request-Line contains "INVITE" and sip.To contains "43664") or (diameter)'
+    assert FilterBuilder(template, {}, None).build() == "(sip) or (diameter)"
+
+
+def test_optional_and_regex_conditions_do_not_narrow():
+    assert FilterBuilder([rule({"sip": [{"sip.Request-Line": "^INVITE"}, {"optional": True, "sip.To": "43664"}]}),
+                          rule({"sip": [{"sip.Request-Line": "INVITE|BYE"}]})], {}, FIELDS).build() == "sip"
+    assert FilterBuilder([rule({"sip": [{"sip.Status-Line": "200"}]}, optional=True)], {}, FIELDS).build() == \
+        'sip and sip.Status-Line contains "200"'    # an optional rule only keeps the frames it could match
+
+
+def test_rule_without_conditions_keeps_every_frame():
+    assert FilterBuilder([rule({"sip": [{"sip.Request-Line": "^INVITE"}]}), rule({})], {}, FIELDS).build() is None
+
+
+def test_stored_variables_are_not_literals():
+    template = [rule({"sip": [{"sip.Request-Line": "^INVITE {{uri}}"}]},
+                     store={"sip": [{"sip.msg_hdr_tree": {"sip.Call-ID": "call_id"}}]}),
+                rule({"sip": [{"sip.msg_hdr_tree": {"sip.Call-ID": "{{call_id}}"}}]}),
+                rule({"sip": [{"sip.To": "{{user}}"}]})]
+    builder = FilterBuilder(template, {"uri": "sip:b", "call_id": "c0", "user": "43664"}, FIELDS)
+    assert [builder.rule_terms(rule) for rule in template] == [
+        ["sip", 'sip.Request-Line contains "INVITE sip:b"'], ["sip"], ["sip", 'sip.To contains "43664"']]
+    assert builder.build() == "sip"
+
+
+@pytest.mark.parametrize("template", [
+    [rule({"sip": [{"sip.Request-Line": "^INVITE"}]}, store={"sip": [{"sip.msg_hdr_tree": {"sip.Call-ID": "id"}}]}),
+     rule({"sip": [{"sip.Status-Line": "180|183"}, {"sip.msg_hdr_tree": {"sip.Call-ID": "{{id}}"}}]}),
+     rule({"sip": [{"sip.Status-Line": "200 OK"}]}),
+     rule({"sip": [{"sip.Request-Line": "ACK"}]})],
+    [rule({"sip": [{"sip.Request-Line": "^INVITE"}]}),
+     rule({"sip": [{"sip.Status-Line": "183"}]}, optional=True),
+     rule({"diameter": [{"diameter.Session-Id": "s1"}]}),
+     rule({"sip": [{"sip.Request-Line": "BYE"}]})]])
+def test_same_report_with_auto_filter(tmp_path, tshark, template):
+    capturefn = write_trace(tmp_path / "call.pcap", CALL)
+    description = {"template": template}
+    options = display_filter.apply_auto_filter({"display_filter": display_filter.AUTO}, capturefn,
+                                               [test_case.TestCase("tc.json", description=description)])
+    assert options["display_filter"] is not None
+    reports = []
+    for trace in [Trace(capturefn), Trace(capturefn, **options)]:
+        tc = test_case.TestCase("tc.json", trace, description=description)
+        tc.run()
+        report = tc.get_report()
+        for rule_report in report["rules"]:
+            rule_report.pop("frame_number", None)   # index in the filtered trace
+        reports.append((report, trace.numpackets))
+    assert reports[0][0] == reports[1][0]
+    assert reports[1][1] < reports[0][1]
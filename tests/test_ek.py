@@ -0,0 +1,92 @@
+'''
+Tests of the newline-delimited (tshark -T ek) trace reader.
+'''
+
+import os
+import json
+import pytest
+from tcparser import ek
+from tcparser.trace import Trace
+from tcparser import test_case
+from .frames import sip
+
+EK_LINES = [
+    {"index": {"_index": "packets-2023-05-04", "_type": "doc"}},
+    {"timestamp": "1683187200010", "layers": {
+        "frame": {"frame_frame_number": "1"},
+        "sip": {"sip_sip_Request-Line": "INVITE sip:b SIP/2.0", "sip_sip_Call-ID": "c1", "sip_sip_CSeq": ["1 INVITE"]}}},
+    {"index": {"_index": "packets-2023-05-04", "_type": "doc"}},
+    {"timestamp": "1683187200020", "layers": {
+        "frame": {"frame_frame_number": "2", "frame_frame_time_epoch": "1683187200.020000"},
+        "sip": {"sip_sip_Status-Line": "SIP/2.0 200 OK", "sip_sip_Call-ID": "c1"},
+        "udp": {"udp_udp_port": [5060, 5060], "udp_udp_checksum_good": False}}}]
+
+
+def write_lines(path, documents):
+    path.write_text("".join(json.dumps(document) + "\n" for document in documents))
+    return str(path)
+
+
+def test_sniff(tmp_path):
+    assert ek.sniff(write_lines(tmp_path / "trace.json", EK_LINES)) == "ek"
+    assert ek.sniff(write_lines(tmp_path / "frames.txt", [{"_source": {"layers": sip(1, "BYE sip:b SIP/2.0")}}])) \
+        == "json"
+    array = tmp_path / "array.json"
+    array.write_text(json.dumps([{"_source": {"layers": sip(1, "BYE sip:b SIP/2.0")}}]))
+    assert ek.sniff(str(array)) is None
+
+
+def test_field_names_from_tshark(tshark):
+    names = ek.ek_field_names()
+    assert names["sip_sip_Call-ID"] == "sip.Call-ID"
+    assert names["diameter_diameter_cmd_code"] == "diameter.cmd.code"
+
+
+def test_field_names_without_tshark(tmp_path):
+    assert ek.ek_field_names(str(tmp_path / "no-tshark")) == {}
+    names = {}
+    assert ek.field_name("sip_sip_Call-ID", names) == "sip.Call-ID"
+    assert ek.field_name("sip_sip_Via_transport", names) == "sip.Via_transport"     # the second dot is lost
+    assert ek.field_name("layers", names) == "layers"
+
+
+def test_normalize(tshark):
+    names = ek.ek_field_names()
+    assert ek.normalize(EK_LINES[0], names) is None
+    frame = ek.normalize(EK_LINES[3], names)
+    assert frame["sip"] == {"sip.Status-Line": "SIP/2.0 200 OK", "sip.Call-ID": "c1"}
+    assert frame["udp"] == {"udp.port": ["5060", "5060"], "udp.checksum_good": "0"}
+    assert frame["frame"]["frame.time_epoch"] == "1683187200.020000"
+    assert ek.normalize(EK_LINES[1], names)["frame"]["frame.time_epoch"] == "1683187200.010000"    # from timestamp
+
+
+def test_parallel_load_matches_sequential(tmp_path, monkeypatch):
+    tracefn = write_lines(tmp_path / "trace.ek", EK_LINES * 200)
+    sequential = ek.load_ndjson_frames(tracefn, {}, workers=1)
+    monkeypatch.setattr(ek, "PARALLEL_MIN_BYTES", 0)
+    monkeypatch.setattr(os, "cpu_count", lambda: 4)
+    assert ek.load_ndjson_frames(tracefn, {}, workers=3) == sequential
+    assert len(sequential) == 400
+
+
+def test_no_more_workers_than_cpus(tmp_path, monkeypatch):
+    tracefn = write_lines(tmp_path / "trace.ek", EK_LINES * 10)
+    monkeypatch.setattr(ek, "PARALLEL_MIN_BYTES", 0)
+    monkeypatch.setattr(os, "cpu_count", lambda: 1)
+    def no_pool(*args, **kwargs):
+        raise AssertionError("process pool started on a single CPU")
+    monkeypatch.setattr(ek, "ProcessPoolExecutor", no_pool)
+    assert len(ek.load_ndjson_frames(tracefn, {}, workers=4)) == 20
+
+
+@pytest.mark.parametrize("options", [{}, {"stream": True}, {"index_protocols": True}])
+def test_tc_against_ek_trace(tmp_path, tshark, options):
+    tracefn = write_lines(tmp_path / "trace.ek", EK_LINES)
+    template = [{"match": {"sip": [{"sip.Request-Line": "^INVITE"}]},
+                 "store": {"sip": [{"sip.Call-ID": "call_id"}]}},
+                {"match": {"sip": [{"sip.Status-Line": "200 OK"}, {"sip.Call-ID": "{{call_id}}"}]}}]
+    tc = test_case.TestCase("tc.json", Trace(tracefn, **options), description={"template": template})
+    tc.run()
+    report = tc.get_report()
+    assert report["result"] == "Passed"
+    assert [rule["frame_number"] for rule in report["rules"]] == [0, 1]
@@ -0,0 +1,132 @@
+'''
+Tests of traces followed while they are being written. A writer thread writes the first part of a trace, then waits
+until the reader has got a frame from it before writing the rest: a reader that waited for the whole trace would only
+get its first frame after the writer has given up waiting.
+'''
+
+import os
+import json
+import threading
+import pytest
+from tcparser import follow
+from tcparser.trace import Trace
+from tcparser import test_case
+from .frames import sip
+
+CALL = [sip(1, "INVITE sip:b SIP/2.0"), sip(2, "SIP/2.0 180 Ringing"), sip(3, "SIP/2.0 200 OK")]
+WAIT = 10   # seconds that the writer waits for the reader
+
+
+def json_parts(frames):
+    documents = [json.dumps({"_source": {"layers": layers}}) for layers in frames]
+    return ["[\n" + documents[0] + ",\n", ",\n".join(documents[1:]) + "\n]\n"]
+
+
+def ek_parts(frames):
+    lines = [json.dumps({"index": {}}) + "\n" + json.dumps({"timestamp": "1600000000000", "layers": {
+        "sip": dict(("sip_" + key.replace(".", "_"), value) for key, value in layers["sip"].items()
+                    if type(value) is str)}}) + "\n" for layers in frames]
+    return [lines[0], "".join(lines[1:])]
+
+
+class Writer(threading.Thread):
+
+    def __init__(self, path, parts):
+        threading.Thread.__init__(self, daemon=True)
+        self.path = path
+        self.parts = parts
+        self.gate = threading.Event()   # set by the test once it has got a frame
+        self.waited = None              # True if the gate was set before the writer gave up
+
+    def run(self):
+        with open(self.path, "a") as tracefile:
+            tracefile.write(self.parts[0])
+            tracefile.flush()
+            self.waited = self.gate.wait(WAIT)
+            tracefile.write(self.parts[1])
+
+
+def start_writer(path, parts):
+    writer = Writer(path, parts)
+    if not os.path.exists(path):
+        open(path, "w").close()
+    writer.start()
+    return writer
+
+
+def test_is_pipe(tmp_path):
+    regular = tmp_path / "trace.json"
+    regular.write_text("[]")
+    os.mkfifo(str(tmp_path / "fifo"))
+    assert not follow.is_pipe(str(regular))
+    assert follow.is_pipe(str(tmp_path / "fifo"))
+    assert follow.is_pipe("-")
+
+
+def read_while_written(path, parts, **options):
+    writer = start_writer(path, parts)
+    frames = follow.open_followed_frames(path, poll_interval=0.01, **options)
+    first = next(frames)
+    writer.gate.set()
+    rest = list(frames)
+    writer.join()
+    assert writer.waited
+    return [first] + rest
+
+
+def test_followed_json_trace(tmp_path):
+    # ends at the closing "]" of the frame array, without a timeout
+    assert read_while_written(str(tmp_path / "trace.json"), json_parts(CALL)) == CALL
+
+
+def test_followed_ek_trace(tmp_path, tshark):
+    frames = read_while_written(str(tmp_path / "trace.ek"), ek_parts(CALL), idle_timeout=0.5)
+    assert [frame["sip"] for frame in frames] == [dict((key, value) for key, value in layers["sip"].items()
+                                                       if type(value) is str) for layers in CALL]
+
+
+def test_followed_capture(tmp_path, tshark):
+    # fake_tshark reads the "capture" (a JSON trace) from its standard input
+    assert read_while_written(str(tmp_path / "trace.pcap"), json_parts(CALL), idle_timeout=0.5) == CALL
+
+
+def test_followed_fifo(tmp_path):
+    path = str(tmp_path / "fifo")
+    os.mkfifo(path)
+    writer = Writer(path, json_parts(CALL)[:1] + [""])     # the frame array is never closed: the pipe is
+    writer.start()
+    frames = follow.open_followed_frames(path)
+    first = next(frames)
+    writer.gate.set()
+    with pytest.raises(ValueError, match="closing"):
+        list(frames)
+    writer.join()
+    assert first == CALL[0]
+
+
+def test_tc_reports_rules_while_trace_is_written(tmp_path):
+    path = str(tmp_path / "trace.json")
+    writer = start_writer(path, json_parts(CALL))
+    rules = []
+
+    def listener(index, rule):
+        rules.append((index, rule["result"]))
+        writer.gate.set()
+    template = [{"match": {"sip": [{"sip.Request-Line": "^INVITE"}]}},
+                {"match": {"sip": [{"sip.Status-Line": "200 OK"}]}}]
+    trace = Trace(path, follow=True, idle_timeout=5)
+    tc = test_case.TestCase("tc.json", trace, description={"template": template}, listener=listener)
+    tc.run()
+    trace.stream.close()
+    writer.join()
+    assert writer.waited
+    assert rules == [(0, "Passed"), (1, "Passed")]
+    assert tc.get_result()
+
+
+@pytest.mark.parametrize("options", [{"cache": True}, {"index_protocols": True}, {"columns": []}])
+def test_follow_needs_whole_trace(tmp_path, options):
+    path = str(tmp_path / "trace.json")
+    open(path, "w").close()
+    with pytest.raises(AssertionError, match="followed"):
+        Trace(path, follow=True, **options)
@@ -0,0 +1,68 @@
+'''
+Tests of the compact representation of frames.
+'''
+
+import json
+import pickle
+import pytest
+from tcparser.frame import FrameDict, FrameCompactor, to_dict
+from .frames import frame, sip
+
+FRAMES = [sip(1, "INVITE sip:b SIP/2.0", sip_Via=["v1", "v2"], sip_Contact=None),
+          frame(2, udp={"udp.port": ["5060", "5060"], "udp.length": 8, "udp.checksum_good": False},
+                rtp={"rtp.ext": [], "rtp.csrc": [{"rtp.csrc.item": "1"}, {"rtp.csrc.item": "2"}, "x"]}),
+          {"empty": {}, "nested": [[{"a": {"b": [1.5, None, "s"]}}]]}]
+
+
+@pytest.mark.parametrize("layers", FRAMES)
+def test_to_dict_round_trip(layers):
+    text = json.dumps(layers)
+    compact = json.loads(text, object_pairs_hook=FrameCompactor())
+    assert type(compact) is FrameDict
+    plain = to_dict(compact)
+    assert plain == layers
+    assert json.dumps(plain) == text    # same keys in the same order
+    assert to_dict(FrameCompactor().compact(layers)) == layers
+    assert to_dict(layers) == layers
+
+
+def test_dict_operations():
+    compact = FrameCompactor().compact(FRAMES[1])
+    udp = compact["udp"]
+    assert "udp.port" in udp and "udp.src" not in udp
+    assert udp["udp.length"] == 8 and udp.get("udp.src") is None and udp.get("udp.src", 0) == 0
+    assert len(udp) == 3
+    assert list(udp) == list(udp.keys()) == ["udp.port", "udp.length", "udp.checksum_good"]
+    assert list(udp.values()) == [["5060", "5060"], 8, False]
+    assert dict(udp.items()) == FRAMES[1]["udp"]
+    assert compact == FRAMES[1] and FRAMES[1] == compact and not compact != FRAMES[1]
+    with pytest.raises(KeyError):
+        udp["udp.src"]
+
+
+def test_duplicate_keys_last_wins():
+    assert to_dict(json.loads('{"a": "1", "b": "2", "a": "3"}', object_pairs_hook=FrameCompactor())) == \
+        json.loads('{"a": "1", "b": "2", "a": "3"}')
+
+
+def test_shapes_and_strings_shared():
+    compactor = FrameCompactor()
+    first, second = [json.loads(json.dumps(layers), object_pairs_hook=compactor) for layers in FRAMES[:1] * 2]
+    assert tuple.__getitem__(first["sip"], 0) is tuple.__getitem__(second["sip"], 0)
+    assert first["sip"]["sip.Request-Line"] is second["sip"]["sip.Request-Line"]
+    compactor.release()
+    third = json.loads(json.dumps(FRAMES[0]), object_pairs_hook=compactor)
+    assert third == first
+
+
+def test_strings_limit():
+    compactor = FrameCompactor(strings_limit=4)
+    frames = [compactor.compact({"k": "value {}".format(number)}) for number in range(20)]
+    assert [to_dict(compact) for compact in frames] == [{"k": "value {}".format(number)} for number in range(20)]
+
+
+def test_pickle():
+    compact = FrameCompactor().compact(FRAMES[1])
+    restored = pickle.loads(pickle.dumps(compact))
+    assert type(restored) is FrameDict
+    assert to_dict(restored) == FRAMES[1]
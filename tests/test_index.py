@@ -0,0 +1,58 @@
+'''
+Tests of the indexes of the values of a field across the frames of a trace.
+'''
+
+import pytest
+from tcparser.index import FieldIndex
+from tcparser.matcher import Pattern, MATCH
+
+PATH = ("sip", "sip.Call-ID")
+VALUES = ["abc", "xabcx", "ab", "abcabc", "a.c", "a\0abc", "", "c1", "c10", "zzz"]
+
+
+def index_of(values):
+    frames = [{"sip": {"sip.Call-ID": value}} for value in values]
+    frames.append({"sip": {"sip.Call-ID": []}})     # matches any condition
+    frames.append({"udp": {}})                      # no field
+    return FieldIndex(PATH, frames)
+
+
+def scan(values, pattern):
+    frames = [index for index, value in enumerate(values) if pattern.match_str(value) == MATCH]
+    return frames + [len(values)]
+
+
+def bound(value):
+    pattern = Pattern("{{call_id}}")
+    pattern.bind({"call_id": value})
+    return pattern
+
+
+@pytest.mark.parametrize("value", ["abc", "ab", "c1", "bca", "zzz", "nothing", "", "a.c", "a\0abc", "c"])
+def test_candidates_of_literal_as_regex_search(value):
+    pattern = bound(value)
+    assert list(index_of(VALUES).candidates(pattern)) == scan(VALUES, pattern)
+
+
+def test_literal_is_not_matched_against_every_value(monkeypatch):
+    index = index_of(VALUES)
+    pattern = bound("abc")
+    monkeypatch.setattr(pattern, "match_str", lambda value: pytest.fail("scanned {}".format(value)))
+    assert list(index.candidates(pattern)) == [0, 1, 3, 5, len(VALUES)]
+    assert list(index.candidates(bound("c1"))) == [7, 8, len(VALUES)]
+
+
+def test_regex_scans_values():
+    pattern = Pattern("^a.c$")
+    assert pattern.literal() is None
+    assert list(index_of(VALUES).candidates(pattern)) == scan(VALUES, pattern)
+
+
+def test_bound_value_with_regex_syntax():
+    pattern = bound("c1$")
+    assert pattern.isexact and pattern.literal() is None
+    assert list(index_of(VALUES).candidates(pattern)) == [7, len(VALUES)]
+
+
+def test_value_that_is_not_a_string():
+    assert list(index_of(VALUES).candidates(Pattern(5))) == [len(VALUES)]
@@ -0,0 +1,52 @@
+'''
+Tests of the compiled "match" sections of the rules.
+'''
+
+import re
+import pytest
+from tcparser.matcher import Pattern, RuleMatcher
+
+VALUES = ["10.0.0.1", "+436646997338", "a+b*", r"a\.b", r"C:\\dir", r"x\1y", "tab\\there", ""]
+
+
+@pytest.mark.parametrize("value", VALUES)
+def test_bind_substitutes_as_re_sub(value):
+    pattern = Pattern("^tel:{{msisdn}};phone")
+    pattern.bind({"msisdn": value})
+    assert pattern.source == re.sub("{{(.*)}}", value, "^tel:{{msisdn}};phone")
+
+
+def test_bind_does_not_escape_value():
+    pattern = Pattern("sip:{{host}}$")
+    pattern.bind({"host": "10.0.0.1"})
+    assert pattern.search("sip:10.0.0.1")
+    assert pattern.search("sip:10a0b0c1")   # "." in the stored value is a regular expression
+
+
+def test_bind_expands_escapes():
+    pattern = Pattern("^{{path}}$")
+    pattern.bind({"path": r"C:\\dir"})     # "\\" in the replacement is a single backslash: "\d" in the regex
+    assert pattern.source == r"^C:\dir$"
+    assert pattern.search("C:4ir")
+
+
+def test_bind_missing_variable():
+    with pytest.raises(AssertionError, match="msisdn not stored"):
+        Pattern("tel:{{msisdn}}").bind({})
+
+
+def test_rebind_follows_variable():
+    matcher = RuleMatcher({"sip": [{"sip.msg_hdr_tree": {"sip.Call-ID": "{{call_id}}"}}]})
+    frame = {"sip": {"sip.msg_hdr_tree": {"sip.Call-ID": "c2"}}}
+    matcher.bind({"call_id": "c1"})
+    assert not matcher.match(frame)
+    matcher.bind({"call_id": "c2"})
+    assert matcher.match(frame)
+
+
+def test_optional_subrule():
+    matcher = RuleMatcher({"sip": [{"sip.Method": "INVITE"}, {"sip.To": "b", "optional": True}]})
+    assert matcher.match({"sip": {"sip.Method": "INVITE"}})
+    assert matcher.match({"sip": {"sip.Method": "INVITE", "sip.To": "b"}})
+    assert not matcher.match({"sip": {"sip.Method": "INVITE", "sip.To": "c"}})
+    assert not matcher.match({"diameter": {}})
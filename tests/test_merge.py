@@ -0,0 +1,88 @@
+'''
+Tests of the merge of the traces of several interfaces into a single trace, in time order.
+'''
+
+import copy
+import pytest
+from tcparser import merge
+from tcparser import test_case
+from tcparser.trace import Trace, trace_files
+from .frames import frame, sip, write_trace
+
+GM = [sip(1, "INVITE sip:b SIP/2.0", epoch=10), sip(2, "SIP/2.0 200 OK", epoch=30)]
+CX = [frame(1, epoch=20, diameter={"diameter.cmd.code": "301"}),
+      frame(2, epoch=30, diameter={"diameter.cmd.code": "303"})]
+MERGED = [("gm.json", 1), ("cx.json", 1), ("gm.json", 2), ("cx.json", 2)]
+
+
+def generators(*traces):
+    return [(layers for layers in copy.deepcopy(frames)) for frames in traces]
+
+
+def origins(frames):
+    return [(merge.frame_origin(layers)["file"], merge.frame_origin(layers)["frame_number"]) for layers in frames]
+
+
+def test_merge_in_time_order():
+    frames = list(merge.merge_frames(generators(GM, CX), ["gm.json", "cx.json"]))
+    assert origins(frames) == MERGED    # same time: the order of the traces
+    assert [layers["frame"]["frame.number"] for layers in frames] == ["1", "2", "3", "4"]
+    assert frames[1]["trazer"] == {"trazer.file": "cx.json", "trazer.frame_number": "1"}
+
+
+def test_frame_without_time_keeps_its_place():
+    untimed = {"sip": {"sip.Request-Line": "ACK sip:b SIP/2.0"}}
+    frames = list(merge.merge_frames(generators(GM[:1] + [untimed], CX), ["gm.json", "cx.json"]))
+    assert origins(frames) == [("gm.json", 1), ("gm.json", 2), ("cx.json", 1), ("cx.json", 2)]
+
+
+def test_merge_closes_traces():
+    closed = []
+
+    def frames(layers):
+        try:
+            yield from copy.deepcopy(layers)
+        finally:
+            closed.append(layers)
+    merged = merge.merge_frames([frames(GM), frames(CX)], ["gm.json", "cx.json"])
+    next(merged)
+    merged.close()
+    assert len(closed) == 2
+
+
+def test_frame_origin_of_frame_not_merged():
+    assert merge.frame_origin(GM[0]) is None
+
+
+def test_trace_files():
+    assert trace_files("gm.json") == "gm.json"
+    assert trace_files("gm.json", ["cx.json", "sh.pcap"]) == ["gm.json", "cx.json", "sh.pcap"]
+
+
+@pytest.mark.parametrize("options", [{}, {"stream": True}, {"index_protocols": True}])
+def test_merged_trace(tmp_path, tshark, options):
+    gmfn = write_trace(tmp_path / "gm.json", GM)
+    cxfn = write_trace(tmp_path / "cx.pcap", CX)     # dissected by fake_tshark
+    trace = Trace([gmfn, cxfn], **options)
+    frames = [trace.get_frame(index) for index in range(4)]
+    assert trace.get_frame(4) is None
+    assert origins(frames) == [(gmfn, 1), (cxfn, 1), (gmfn, 2), (cxfn, 2)]
+    assert len(trace.get_identity()) == 2
+
+
+def test_merged_trace_cannot_be_cached(tmp_path):
+    tracefns = [write_trace(tmp_path / "gm.json", GM), write_trace(tmp_path / "cx.json", CX)]
+    with pytest.raises(AssertionError, match="Merged"):
+        Trace(tracefns, cache=True)
+
+
+def test_report_gives_source_of_frames(tmp_path):
+    tracefns = [write_trace(tmp_path / "gm.json", GM), write_trace(tmp_path / "cx.json", CX)]
+    template = [{"match": {"sip": [{"sip.Request-Line": "^INVITE"}]}},
+                {"match": {"diameter": [{"diameter.cmd.code": "303"}]}}]
+    tc = test_case.TestCase("tc.json", Trace(tracefns), description={"template": template})
+    tc.run()
+    report = tc.get_report()
+    assert report["result"] == "Passed"
+    assert [(rule["frame_number"], rule["source"]) for rule in report["rules"]] == \
+        [(0, {"file": tracefns[0], "frame_number": 1}), (3, {"file": tracefns[1], "frame_number": 2})]
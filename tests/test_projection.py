@@ -0,0 +1,68 @@
+'''
+Tests of the projection of frames on the fields used by the TCs.
+'''
+
+from tcparser.projection import Projection
+from tcparser.trace import Trace
+from tcparser import test_case
+from .frames import frame, sip, write_trace
+
+TEMPLATE = [{"match": {"sip": [{"sip.Request-Line": "^INVITE"},
+                               {"optional": True, "sip.msg_hdr_tree": {"sip.To": "b"}}]},
+             "store": {"sip": [{"sip.msg_hdr_tree": {"sip.Call-ID": "call_id"}}],
+                       "sdp": [{"sdp.media": "media"}]}},
+            {"match": {"diameter": []}, "verify": [{"field": "media", "contains": "audio"}]}]
+FULL = dict(sip(1, "INVITE sip:b SIP/2.0", sip_To="<sip:b>", sip_From="<sip:a>", sip_Via=["v1", "v2"]),
+            eth={"eth.src": "00:01"}, ip={"ip.src": "10.0.0.1"},
+            sdp={"sdp.media": ["audio 4000", "video 4002"], "sdp.version": "0"},
+            diameter={"diameter.Session-Id": "s1"})
+FULL["frame"]["frame.time_relative"] = "0.5"
+FULL["frame"]["frame.len"] = "1500"
+
+
+def projection_of(template):
+    projection = Projection()
+    projection.add_template(template)
+    return projection
+
+
+def test_projection_keeps_match_and_store_paths():
+    projected = projection_of(TEMPLATE).apply(FULL)
+    assert projected == {
+        "frame": {"frame.number": "1", "frame.time_epoch": FULL["frame"]["frame.time_epoch"],
+                  "frame.time_relative": "0.5"},
+        "sip": {"sip.Request-Line": "INVITE sip:b SIP/2.0",
+                "sip.msg_hdr_tree": {"sip.Call-ID": "c1", "sip.To": "<sip:b>"}},
+        "sdp": {"sdp.media": ["audio 4000", "video 4002"]},
+        "diameter": {}}     # protocol without conditions
+    assert projected["sdp"]["sdp.media"] is FULL["sdp"]["sdp.media"]   # kept values are shared
+
+
+def test_projection_of_lists():
+    projection = projection_of([{"match": {"rtp": [{"rtp.csrc": {"rtp.csrc.item": "1"}}]}}])
+    layers = frame(1, rtp={"rtp.csrc": [{"rtp.csrc.item": "1", "rtp.csrc.other": "x"}, "y", []], "rtp.seq": "7"})
+    assert projection.apply(layers)["rtp"] == {"rtp.csrc": [{"rtp.csrc.item": "1"}, "y", []]}
+
+
+def test_merged_projections():
+    projection = projection_of(TEMPLATE)
+    projection.merge(projection_of([{"match": {"ip": [{"ip.src": "10.0.0.1"}]}},
+                                    {"match": {"sip": [{"sip.msg_hdr_tree": {"sip.From": "a"}}]}},
+                                    {"match": {"sdp": [{"sdp.version": "0"}]}}]))
+    assert sorted(projection.protocols()) == ["diameter", "frame", "ip", "sdp", "sip"]
+    projected = projection.apply(FULL)
+    assert sorted(projected["sip"]["sip.msg_hdr_tree"]) == ["sip.Call-ID", "sip.From", "sip.To"]
+    assert projected["sdp"] == FULL["sdp"]
+    assert "eth" not in projected
+
+
+def test_same_report_with_projected_trace(tmp_path):
+    tracefn = write_trace(tmp_path / "call.json", [FULL, frame(2, diameter={"diameter.Session-Id": "s1"})])
+    reports = []
+    for projection in [None, projection_of(TEMPLATE)]:
+        tc = test_case.TestCase("tc.json", Trace(tracefn, projection=projection), description={
+            "template": TEMPLATE[:1] + [dict(TEMPLATE[1], report=[{"tag": "id", "value": "{{call_id}}"}])]})
+        tc.run()
+        reports.append(tc.get_report())
+    assert reports[0] == reports[1]
+    assert reports[1]["result"] == "Passed"
@@ -0,0 +1,67 @@
+'''
+Tests of the index of the frames that carry each protocol.
+'''
+
+import pytest
+from tcparser.trace import Trace
+from tcparser import test_case
+from .frames import frame, sip, write_trace
+
+FRAMES = [frame(1, eth={}, udp={}),
+          dict(sip(2, "INVITE sip:b SIP/2.0"), udp={}, sdp={"sdp.media": "audio 4000"}),
+          frame(3, udp={}, rtp={}),
+          dict(sip(4, "SIP/2.0 200 OK"), udp={}),
+          frame(5, tcp={}, diameter={}),
+          dict(sip(6, "ACK sip:b SIP/2.0"), tcp={}, sdp={"sdp.media": "audio 4002"}),
+          frame(7, udp={}, rtp={}),
+          frame(8, tcp={}, sip={}, diameter={})]
+PROTOCOLS = [[], ["udp"], ["sip"], ["sip", "sdp"], ["sdp", "sip"], ["tcp", "sip"], ["sip", "udp", "sdp"],
+             ["sip", "diameter"], ["tcp", "sdp", "sip"], ["udp", "rtp"], ["sip", "rtp"], ["sip", "h248"]]
+
+
+def scan(protocols, index):
+    for position in range(index, len(FRAMES)):
+        if all(protocol in FRAMES[position] for protocol in protocols):
+            return position
+    return len(FRAMES)
+
+
+@pytest.fixture(params=["file", "frames"])
+def trace(request, tmp_path):
+    if request.param == "file":
+        return Trace(write_trace(tmp_path / "call.json", FRAMES), index_protocols=True)
+    return Trace.from_frames(FRAMES, "call", index_protocols=True)
+
+
+def test_protocol_index(trace):
+    assert trace.numpackets == len(FRAMES)
+    assert dict((protocol, list(indexes)) for protocol, indexes in trace.protocol_index.items()) == {
+        "frame": list(range(8)), "eth": [0], "udp": [0, 1, 2, 3, 6], "sip": [1, 3, 5, 7], "sdp": [1, 5],
+        "rtp": [2, 6], "tcp": [4, 5, 7], "diameter": [4, 7]}
+
+
+@pytest.mark.parametrize("protocols", PROTOCOLS)
+def test_next_frame_with(trace, protocols):
+    for index in range(len(FRAMES) + 1):
+        expected = index if len(protocols) == 0 else scan(protocols, index)
+        assert trace.next_frame_with(protocols, index) == expected
+
+
+def test_next_frame_without_index(tmp_path):
+    trace = Trace(write_trace(tmp_path / "call.json", FRAMES))
+    assert trace.protocol_index is None
+    assert trace.next_frame_with(["sip", "sdp"], 2) == 2
+
+
+@pytest.mark.parametrize("match", [{"sip": [], "sdp": []}, {"tcp": [], "sip": [{"sip.Request-Line": "ACK"}]},
+                                   {"sip": [], "diameter": []}, {"rtp": [], "sip": []}])
+def test_same_report_with_protocol_index(tmp_path, match):
+    tracefn = write_trace(tmp_path / "call.json", FRAMES)
+    template = [{"match": {"sip": [{"sip.Request-Line": "^INVITE"}]}}, {"match": match}]
+    reports = []
+    for index_protocols in [False, True]:
+        tc = test_case.TestCase("tc.json", Trace(tracefn, index_protocols=index_protocols),
+                                description={"template": template})
+        tc.run()
+        reports.append(tc.get_report())
+    assert reports[0] == reports[1]
@@ -0,0 +1,86 @@
+'''
+Tests of the trace readers: incremental JSON parsing, and captures dissected by a tshark subprocess. tshark is
+replaced by tools/fake_tshark.py (see conftest.py).
+'''
+
+import io
+import json
+import time
+import pytest
+from tcparser import reader
+from tcparser.trace import Trace
+from .frames import sip, write_trace
+
+CALL = [sip(1, "INVITE sip:b SIP/2.0"), sip(2, "SIP/2.0 180 Ringing"), sip(3, "SIP/2.0 200 OK"),
+        sip(4, "ACK sip:b SIP/2.0")]
+LITERALS = [{"s": "x\u00e9y\"z\U0001f600", "n": -12.5e3, "t": True, "f": False, "z": None, "l": [1, []]},
+            {"inf": float("inf"), "-inf": float("-inf")}, {}]
+
+
+def test_iter_json_frames_small_chunks(tmp_path):
+    with open(write_trace(tmp_path / "call.json", CALL), "r") as tracefile:
+        assert list(reader.iter_json_frames(tracefile, chunk_size=7)) == CALL
+
+
+@pytest.mark.parametrize("chunk_size", range(1, 24))
+def test_iter_json_frames_cut_anywhere(chunk_size):
+    text = json.dumps([{"_source": {"layers": layers}} for layers in LITERALS])
+    frames = reader.iter_json_frames(io.StringIO(text), chunk_size=chunk_size, object_pairs_hook=dict)
+    assert list(frames) == LITERALS
+
+
+def test_iter_json_frames_syntax_error_in_the_middle():
+    text = '[{"_source": {"layers": {"a": 1 "b": 2}}},' + '{"_source": {"layers": {}}},' * 10000 + "]"
+    tracefile = io.StringIO(text)
+    frames = reader.iter_json_frames(tracefile, chunk_size=64)
+    with pytest.raises(ValueError, match="delimiter"):
+        next(frames)
+    assert tracefile.tell() < 1000
+
+
+def test_iter_json_frames_truncated():
+    with pytest.raises(ValueError, match="closing"):
+        list(reader.iter_json_frames(io.StringIO('[{"_source": {"layers": {}}},')))
+
+
+def test_capture_streamed_from_tshark(tmp_path, tshark, monkeypatch):
+    capturefn = write_trace(tmp_path / "call.pcap", CALL)
+    monkeypatch.setenv("FAKE_TSHARK_DELAY", "0.4")     # after every frame
+    start = time.monotonic()
+    frames = reader.open_tshark_frames(capturefn)
+    first = next(frames)
+    first_s = time.monotonic() - start
+    rest = list(frames)
+    total_s = time.monotonic() - start
+    assert [first] + rest == CALL
+    assert total_s >= 1.6
+    assert first_s < 1.2    # not held back until tshark is done
+
+
+def test_capture_display_filter_and_protocols(tmp_path, tshark):
+    capturefn = write_trace(tmp_path / "call.pcapng", CALL)
+    frames = list(reader.open_tshark_frames(capturefn, display_filter='sip.Status-Line contains "200"',
+                                            protocols=["sip"]))
+    assert frames == [{"sip": CALL[2]["sip"]}]
+
+
+def test_tshark_error(tmp_path, tshark):
+    with pytest.raises(RuntimeError, match="tshark exited with code 2: .*doesn't exist"):
+        list(reader.open_tshark_frames(str(tmp_path / "missing.pcap")))
+
+
+def test_tshark_from_environment(tmp_path, tshark, monkeypatch):
+    capturefn = write_trace(tmp_path / "call.pcap", CALL)
+    assert reader.tshark_command(capturefn)[:2] == reader.tshark_executable(tshark)
+    monkeypatch.setenv(reader.TSHARK_ENV, str(tmp_path / "no-tshark"))
+    with pytest.raises(FileNotFoundError):
+        list(reader.open_tshark_frames(capturefn))
+    assert list(reader.open_tshark_frames(capturefn, tshark=tshark)) == CALL    # explicit command first
+
+
+@pytest.mark.parametrize("options", [{}, {"stream": True, "lookback": 2}, {"index_protocols": True}])
+def test_trace_of_capture(tmp_path, tshark, options):
+    trace = Trace(write_trace(tmp_path / "call.pcap", CALL), **options)
+    assert trace.get_frame(3) == CALL[3]
+    assert trace.get_frame(0) == CALL[0]    # beyond the look-back buffer in stream mode: tshark runs again
+    assert trace.get_frame(4) is None
@@ -0,0 +1,69 @@
+'''
+Tests of the runs of a TC on every conversation of a trace.
+'''
+
+import json
+from tcparser import shard
+from .frames import frame, sip, write_trace
+from .test_batch import write_tc
+
+TC = {"template": [{"match": {"sip": [{"sip.Request-Line": "^INVITE"}]}},
+                   {"match": {"sip": [{"sip.Status-Line": "200 OK"}]}}]}
+
+
+def diameter(number, session):
+    return frame(number, diameter={"diameter.Session-Id": session})
+
+
+def test_key_aliases():
+    assert shard.key_fields(["Call-ID", "session-id", "e212.imsi"]) == ["sip.Call-ID", "diameter.Session-Id",
+                                                                        "e212.imsi"]
+
+
+def test_split_frames_by_first_field_of_the_key():
+    frames = [sip(1, "INVITE sip:b SIP/2.0", "c1"), diameter(2, "s1"), frame(3, udp={}),
+              sip(4, "INVITE sip:b SIP/2.0", "c2"), sip(5, "SIP/2.0 200 OK", "c1"), diameter(6, "s1")]
+    shards, unsharded = shard.split_frames(frames, shard.key_fields(["call-id", "session-id"]))
+    assert list(shards) == ["c1", "s1", "c2"]
+    assert [(list(indexes), [layers["frame"]["frame.number"] for layers in shard_frames])
+            for indexes, shard_frames in shards.values()] == [([0, 4], ["1", "5"]), ([1, 5], ["2", "6"]),
+                                                              ([3], ["4"])]
+    assert unsharded == 1
+
+
+def test_frame_with_several_values_of_the_key():
+    frames = [frame(1, diameter={"diameter.Session-Id": ["s1", "s2", "s1"]}), diameter(2, "s2")]
+    shards, unsharded = shard.split_frames(frames, ["diameter.Session-Id"])
+    assert dict((key, list(indexes)) for key, (indexes, shard_frames) in shards.items()) == {"s1": [0], "s2": [0, 1]}
+    assert unsharded == 0
+
+
+def test_reports_give_the_frames_of_the_trace(tmp_path):
+    tcfn = write_tc(tmp_path / "tc.json", TC)
+    frames = [sip(1, "INVITE sip:b SIP/2.0", "c1"), sip(2, "INVITE sip:b SIP/2.0", "c2"), frame(3, udp={}),
+              sip(4, "SIP/2.0 200 OK", "c2"), sip(5, "SIP/2.0 200 OK", "c1")]
+    shards, unsharded = shard.split_frames(frames, ["sip.Call-ID"])
+    numbered = [(number, key, indexes, shard_frames)
+                for number, (key, (indexes, shard_frames)) in enumerate(shards.items())]
+    results = shard.run_shards(tcfn, numbered, str(tmp_path))
+    assert [(result["shard"], result["frames"], result["result"]) for result in results] == [
+        ("c1", 2, "Passed"), ("c2", 2, "Passed")]
+    reports = [json.loads((tmp_path / "shard_{:05d}.json".format(number)).read_text()) for number in range(2)]
+    assert [[(rule["frame_number"], rule["shard_frame_number"]) for rule in report["rules"]]
+            for report in reports] == [[(0, 0), (4, 1)], [(1, 0), (3, 1)]]
+    assert reports[1]["shard"] == {"key": "c2", "frames": 2}
+
+
+def test_run_sharded(tmp_path):
+    tcfn = write_tc(tmp_path / "tc.json", TC)
+    tracefn = write_trace(tmp_path / "call.json", [
+        sip(1, "INVITE sip:b SIP/2.0", "c1"), sip(2, "INVITE sip:b SIP/2.0", "c2"), frame(3, udp={}),
+        sip(4, "SIP/2.0 486 Busy Here", "c2"), sip(5, "SIP/2.0 200 OK", "c1")])
+    summary = shard.run_sharded(tcfn, tracefn, ["call-id"], str(tmp_path), {}, workers=1,
+                                logging_options=("WARNING", str(tmp_path / "trazer.log"), None))
+    assert (summary["shards"], summary["unsharded_frames"]) == (2, 1)
+    assert summary["histogram"] == {"Passed": 1, "Failed": 1, "Error": 0}
+    assert summary["failed_rules"] == {"rule 1": 1}
+    report = json.loads((tmp_path / "shard_00001.json").read_text())
+    assert report["shard"]["key"] == "c2"
+    assert report["rules"][0]["frame_number"] == 1
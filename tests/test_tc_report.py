@@ -0,0 +1,107 @@
+'''
+Tests of the TC reports: JSON lines reports and their merge.
+'''
+
+import json
+import pytest
+from tcparser import batch
+from tcparser import tc_report
+from tcparser import test_case
+from tcparser.trace import Trace
+from .frames import sip, write_trace
+
+PASSING = {"template": [{"match": {"sip": [{"sip.Request-Line": "^INVITE"}]}}]}
+FAILING = {"template": [{"match": {"sip": [{"sip.Request-Line": "^BYE"}]}}]}
+
+
+def read_records(path):
+    with open(path) as merged:
+        return [json.loads(line) for line in merged]
+
+
+@pytest.mark.parametrize("report_format", ["json", "ndjson"])
+def test_merge_batch_report_directory(tmp_path, report_format):
+    (tmp_path / "traces").mkdir()
+    tracefns = [write_trace(tmp_path / "traces" / name, [sip(1, "INVITE sip:b SIP/2.0")])
+                for name in ("site1.json", "site2.json")]
+    tcfns = []
+    for name, description in [("pass.json", PASSING), ("fail.json", FAILING)]:
+        (tmp_path / name).write_text(json.dumps(description))
+        tcfns.append(str(tmp_path / name))
+    report_dir = tmp_path / "reports"
+    summary = batch.run_batch(tracefns, tcfns, str(report_dir), {}, workers=1, report_format=report_format,
+                              logging_options=("WARNING", str(tmp_path / "trazer.log"), None))
+    (report_dir / "summary.json").write_text(json.dumps(summary))     # as batch.py does
+    reportfns = batch.find_files([str(report_dir)], (".json", ".ndjson"), recursive=True)
+    merged = tc_report.merge_reports(reportfns, str(tmp_path / "merged.ndjson"))
+    assert (merged["reports"], merged["Passed"], merged["Failed"], merged["Incomplete"], merged["skipped"]) == \
+        (4, 2, 2, 0, 1)
+    records = read_records(tmp_path / "merged.ndjson")
+    assert records[-1] == merged
+    assert sorted(record["report"] for record in records if record["record"] == "result") == \
+        sorted(result["report"] for result in summary["results"])
+
+
+def test_merge_skips_files_that_are_not_reports(tmp_path):
+    report = tmp_path / "tc.json"
+    report.write_text(json.dumps({"result": "Passed", "rules": [{"result": "Passed"}]}))
+    other = tmp_path / "other.json"
+    other.write_text(json.dumps({"totals": {"Passed": 1}}))
+    broken = tmp_path / "broken.json"
+    broken.write_text("{")
+    outpath = tmp_path / "merged.ndjson"
+    outpath.write_text("")
+    merged = tc_report.merge_reports([str(broken), str(outpath), str(other), str(report)], str(outpath))
+    assert (merged["reports"], merged["Passed"], merged["skipped"]) == (1, 1, 2)
+    assert [record["record"] for record in read_records(outpath)] == ["tc", "rule", "result", "summary"]
+
+
+def test_incomplete_report(tmp_path):
+    writer = tc_report.ReportWriter(str(tmp_path / "tc.ndjson"), "tc.json")
+    writer.write_rule(0, {"result": "Passed"})
+    merged = tc_report.merge_reports([str(tmp_path / "tc.ndjson")], str(tmp_path / "merged.ndjson"))
+    assert (merged["reports"], merged["Incomplete"]) == (1, 1)
+
+
+def test_find_files_in_subdirectories(tmp_path):
+    (tmp_path / "trace" / "tcs").mkdir(parents=True)
+    for name in ("summary.json", "trace/a.json", "trace/tcs/b.ndjson", "trace/notes.txt"):
+        (tmp_path / name).write_text("{}")
+    assert batch.find_files([str(tmp_path)], (".json", ".ndjson")) == [str(tmp_path / "summary.json")]
+    assert batch.find_files([str(tmp_path)], (".json", ".ndjson"), recursive=True) == \
+        sorted(str(tmp_path / name) for name in ("summary.json", "trace/a.json", "trace/tcs/b.ndjson"))
+
+
+STREAMED = [{"match": {"sip": [{"sip.Request-Line": "^INVITE"}]}},
+            {"optional": True, "match": {"sip": [{"sip.Status-Line": "183"}]}},
+            {"match": {"sip": [{"sip.Status-Line": "180"}]}},
+            {"match": {"sip": [{"sip.Status-Line": "200"}]}, "report": [{"tag": "answer", "value": "200 OK"}]}]
+CALL = [sip(1, "INVITE sip:b SIP/2.0"), sip(2, "SIP/2.0 180 Ringing"), sip(3, "SIP/2.0 200 OK")]
+
+
+def run_streamed(tmp_path, checkpoints=False):
+    tc = test_case.TestCase("tc.json", Trace(write_trace(tmp_path / "call.json", CALL)),
+                            description={"template": STREAMED})
+    reportfn = str(tmp_path / "tc.ndjson")
+    tc.stream_report(reportfn)
+    if checkpoints:
+        tc.use_checkpoints(str(tmp_path / "checkpoints"))
+    tc.run()
+    report = tc.get_report()
+    tc.report()
+    return report, tc_report.load_report(reportfn)
+
+
+def test_streamed_rules_not_kept(tmp_path):
+    expected = test_case.TestCase("tc.json", Trace(write_trace(tmp_path / "call.json", CALL)),
+                                  description={"template": STREAMED})
+    expected.run()
+    report, written = run_streamed(tmp_path)
+    assert written == expected.get_report()
+    assert report["rules"] == [None] * len(STREAMED)
+    assert report["result"] == "Passed"
+
+
+def test_streamed_rules_kept_for_checkpoints(tmp_path):
+    report, written = run_streamed(tmp_path, checkpoints=True)
+    assert report == written
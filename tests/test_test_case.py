@@ -0,0 +1,158 @@
+'''
+Tests of the evaluation of TCs, of optional rules evaluated in the same pass as the rules after them, and of the
+"within" bounds of the rules.
+'''
+
+import pytest
+from tcparser.trace import Trace
+from tcparser import test_case
+from .frames import sip, write_trace
+
+INVITE = {"match": {"sip": [{"sip.Request-Line": "^INVITE"}]},
+          "store": {"sip": [{"sip.msg_hdr_tree": {"sip.Call-ID": "call_id"}}]}}
+EARLY = {"optional": True,      # stores the variable that the next rule uses
+         "match": {"sip": [{"sip.Status-Line": "183"}, {"sip.msg_hdr_tree": {"sip.Call-ID": "{{call_id}}"}}]},
+         "store": {"sip": [{"sip.msg_hdr_tree": {"sip.to.tag": "tag"}}]}}
+ANSWER = {"match": {"sip": [{"sip.Status-Line": "200 OK"}, {"sip.msg_hdr_tree": {"sip.to.tag": "{{tag}}"}}]},
+          "report": [{"tag": "To tag", "value": "{{tag}}"}]}
+CALL = [sip(1, "INVITE sip:b SIP/2.0"),
+        sip(2, "SIP/2.0 183 Session Progress", sip_to_tag="t9"),
+        sip(3, "SIP/2.0 200 OK", sip_to_tag="t9")]
+
+MODES = [{}, {"stream": True}, {"index_protocols": True, "index_fields": True}]
+
+
+def run(tmp_path, template, frames, **options):
+    tracefn = write_trace(tmp_path / "trace.json", frames)
+    tc = test_case.TestCase("tc.json", Trace(tracefn, **options), description={"template": template})
+    tc.run()
+    return tc.get_report()
+
+
+def summary(report):
+    return [(rule["result"], rule.get("frame_number")) for rule in report["rules"]]
+
+
+@pytest.mark.parametrize("options", MODES)
+def test_rules_matched_in_order(tmp_path, options):
+    report = run(tmp_path, [INVITE, dict(ANSWER, match={"sip": [{"sip.Status-Line": "200 OK"}]}, report=[])],
+                 CALL, **options)
+    assert report["result"] == "Passed"
+    assert summary(report) == [("Passed", 0), ("Passed", 2)]
+
+
+@pytest.mark.parametrize("options", MODES)
+def test_mandatory_rule_not_matched(tmp_path, options):
+    report = run(tmp_path, [INVITE, {"match": {"sip": [{"sip.Request-Line": "^BYE"}]}}], CALL, **options)
+    assert report["result"] == "Failed"
+    assert summary(report) == [("Passed", 0), ("Failed", None)]
+
+
+@pytest.mark.parametrize("options", MODES)
+def test_optional_rule_stores_variable_of_next_rule(tmp_path, options):
+    report = run(tmp_path, [INVITE, EARLY, ANSWER], CALL, **options)
+    assert report["result"] == "Passed"
+    assert summary(report) == [("Passed", 0), ("Passed", 1), ("Passed", 2)]
+    assert report["rules"][2]["To tag"] == "t9"
+
+
+@pytest.mark.parametrize("options", MODES)
+def test_optional_rule_not_matched(tmp_path, options):
+    frames = [CALL[0], sip(2, "SIP/2.0 180 Ringing"), CALL[2]]
+    answer = dict(ANSWER, match={"sip": [{"sip.Status-Line": "200 OK"}]}, report=[])
+    report = run(tmp_path, [INVITE, EARLY, answer], frames, **options)
+    assert report["result"] == "Passed"
+    assert summary(report) == [("Passed", 0), ("Failed", None), ("Passed", 2)]
+    assert report["rules"][1]["optional"] is True
+
+
+@pytest.mark.parametrize("options", MODES)
+def test_optional_rule_not_matched_variable_missing(tmp_path, options):
+    frames = [CALL[0], sip(2, "SIP/2.0 180 Ringing"), CALL[2]]
+    with pytest.raises(AssertionError, match="tag not stored"):
+        run(tmp_path, [INVITE, EARLY, ANSWER], frames, **options)
+
+
+@pytest.mark.parametrize("options", MODES)
+def test_fork_reports_variable_before_optional_rule_matches(tmp_path, options):
+    # The fork that skips EARLY matches the PRACK of frame 2 before EARLY is matched at frame 3
+    prack = {"optional": True, "match": {"sip": [{"sip.Request-Line": "^PRACK"}]},
+             "report": [{"tag": "To tag", "value": "{{tag}}"}]}
+    frames = [CALL[0], sip(2, "PRACK sip:b SIP/2.0"), CALL[1], sip(4, "PRACK sip:b SIP/2.0")]
+    report = run(tmp_path, [INVITE, EARLY, prack], frames, **options)
+    assert report["result"] == "Passed"
+    assert summary(report) == [("Passed", 0), ("Passed", 2), ("Passed", 3)]
+    assert report["rules"][2]["To tag"] == "t9"
+
+
+def test_listener_gets_final_rules(tmp_path):
+    tracefn = write_trace(tmp_path / "trace.json", CALL)
+    rules = []
+    tc = test_case.TestCase("tc.json", Trace(tracefn), description={"template": [INVITE, EARLY, ANSWER]},
+                            listener=lambda index, rule: rules.append((index, rule["result"])))
+    tc.run()
+    assert rules == [(0, "Passed"), (1, "Passed"), (2, "Passed")]
+
+
+def bounded(rule, **within):
+    return dict(rule, within=within)
+
+
+RINGING = {"match": {"sip": [{"sip.Status-Line": "180"}]}}
+OK = {"match": {"sip": [{"sip.Status-Line": "200 OK"}]}}
+TIMED = [sip(10, "INVITE sip:b SIP/2.0", epoch=100.0), sip(11, "SIP/2.0 100 Trying", epoch=100.5),
+         sip(12, "SIP/2.0 180 Ringing", epoch=101.0), sip(13, "SIP/2.0 200 OK", epoch=102.0)]
+
+
+@pytest.mark.parametrize("options", MODES)
+@pytest.mark.parametrize("within, result", [
+    ({"frames": 3}, "Passed"), ({"frames": 2}, "Failed"),
+    ({"seconds": 2}, "Passed"), ({"seconds": 1.999}, "Failed"),
+    ({"seconds": 2, "frames": 3}, "Passed"), ({"seconds": 2, "frames": 2}, "Failed"),
+    ({"seconds": 1.999, "frames": 3}, "Failed")])
+def test_within_bounds(tmp_path, options, within, result):
+    report = run(tmp_path, [INVITE, bounded(OK, **within)], TIMED, **options)
+    assert report["result"] == result
+    if result == "Passed":
+        assert summary(report) == [("Passed", 0), ("Passed", 3)]
+    else:
+        assert summary(report) == [("Passed", 0), ("Failed", None)]
+        assert report["rules"][1]["within_exceeded"]
+
+
+@pytest.mark.parametrize("options", MODES)
+def test_within_counts_from_last_matched_rule(tmp_path, options):
+    report = run(tmp_path, [INVITE, RINGING, bounded(OK, frames=1, seconds=1)], TIMED, **options)
+    assert summary(report) == [("Passed", 0), ("Passed", 2), ("Passed", 3)]
+
+
+@pytest.mark.parametrize("options", MODES)
+def test_first_rule_not_bounded(tmp_path, options):
+    report = run(tmp_path, [bounded(OK, frames=1, seconds=0)], TIMED, **options)
+    assert summary(report) == [("Passed", 3)]
+
+
+@pytest.mark.parametrize("options", MODES)
+@pytest.mark.parametrize("within, matched", [({"frames": 2}, 2), ({"frames": 1}, None),
+                                             ({"seconds": 1}, 2), ({"seconds": 0.999}, None)])
+def test_within_bounds_of_optional_rule(tmp_path, options, within, matched):
+    report = run(tmp_path, [INVITE, bounded(dict(RINGING, optional=True), **within), OK], TIMED, **options)
+    assert report["result"] == "Passed"
+    assert [rule.get("frame_number") for rule in report["rules"]] == [0, matched, 3]
+
+
+@pytest.mark.parametrize("options", MODES)
+@pytest.mark.parametrize("verify, result", [
+    ([{"field": "status", "contains": "100"}], [("Passed", 0), ("Passed", 1)]),
+    ([{"field": "status", "contains": "200"}], [("Passed", 0), ("Failed", 1)]),     # the first match is verified
+    ([{"field": "status", "contains": "200"}, {"field": "status", "is": "SIP/2.0 100 Trying"}],
+     [("Passed", 0), ("Passed", 1)]),
+    ([{"field": "status", "contains": "100"}, {"field": "other", "is": "x"}], KeyError)])
+def test_verify_after_match(tmp_path, options, verify, result):
+    rule = {"match": {"sip": [{"sip.Status-Line": "SIP/2.0"}]},
+            "store": {"sip": [{"sip.Status-Line": "status"}]}, "verify": verify}
+    if result is KeyError:     # "is" condition on a variable not stored, even after a condition is met
+        with pytest.raises(KeyError, match="other"):
+            run(tmp_path, [INVITE, rule], TIMED, **options)
+    else:
+        assert summary(run(tmp_path, [INVITE, rule], TIMED, **options)) == result
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+'''
+Stand-in for tshark, to run Trazer against "captures" without Wireshark installed.
+
+The "capture" is a JSON trace exported from Wireshark, whatever its extension. It is written to the standard output
+frame by frame, the way tshark -T json does. With -r -, the trace is read from the standard input as it comes, so that
+a growing "capture" can be piped in. -J keeps only the listed layers. A delay between frames can be set in the
+environment variable FAKE_TSHARK_DELAY (seconds), to check that frames are consumed while they are being produced.
+
+Display filters are limited to protocol and field names, "field contains "text"", "and", "or" and parentheses: the
+filters written by Trazer (see tcparser/display_filter.py). A name is true when the frame carries the protocol or
+field. -G fields lists the fields of FIELDS only.
+
+Usage: TRAZER_TSHARK="python tools/fake_tshark.py" python test.py tc.json trace.pcap report.json
+'''
+
+import os
+import re
+import sys
+import codecs
+import json
+import time
+import argparse
+
+# Fields reported by -G fields: abbreviation -> type
+FIELDS = {
+    "frame.number": "FT_UINT32",
+    "ip.src": "FT_IPv4",
+    "ip.dst": "FT_IPv4",
+    "udp.port": "FT_UINT16",
+    "rtp.seq": "FT_UINT16",
+    "sip.Request-Line": "FT_STRING",
+    "sip.Status-Line": "FT_STRING",
+    "sip.Method": "FT_STRING",
+    "sip.From": "FT_STRING",
+    "sip.To": "FT_STRING",
+    "sip.Call-ID": "FT_STRING",
+    "sip.CSeq": "FT_STRING",
+    "sip.P-Access-Network-Info": "FT_STRING",
+    "sdp.media": "FT_STRING",
+    "sdp.media_attr": "FT_STRING",
+    "diameter.cmd.code": "FT_UINT24",
+    "diameter.applicationId": "FT_UINT32",
+    "diameter.flags.request": "FT_BOOLEAN",
+    "diameter.Session-Id": "FT_STRING",
+    "diameter.Public-Identity": "FT_STRING",
+    "diameter.User-Identity": "FT_BYTES",
+    "diameter.Result-Code": "FT_UINT32"
+}
+
+TOKEN = re.compile(r'\s*(\(|\)|"(?:[^"\\]|\\.)*"|[^\s()"]+)')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="fake_tshark")
+    parser.add_argument("-r", dest="capture")
+    parser.add_argument("-Y", "-R", dest="display_filter")
+    parser.add_argument("-T", dest="output_format", default="json")
+    parser.add_argument("-J", dest="export_protocols")
+    parser.add_argument("-G", dest="glossary")
+    parser.add_argument("-n", action="store_true")
+    parser.add_argument("-l", dest="flush", action="store_true")
+    parser.add_argument("-2", dest="two_pass", action="store_true")
+    parser.add_argument("--no-duplicate-keys", action="store_true")
+    return parser.parse_args()
+
+
+def parse_filter(display_filter):
+    '''
+    :return: function that tells whether the layers of a frame pass the display filter. None for all frames.
+    '''
+    if not display_filter:
+        return None
+    tokens = TOKEN.findall(display_filter)
+    position = [0]
+
+    def peek():
+        return tokens[position[0]] if position[0] < len(tokens) else None
+
+    def take():
+        position[0] += 1
+        return tokens[position[0] - 1]
+
+    def expression():
+        terms = [term()]
+        while peek() == "or":
+            take()
+            terms.append(term())
+        return lambda layers: any(test(layers) for test in terms)
+
+    def term():
+        factors = [factor()]
+        while peek() == "and":
+            take()
+            factors.append(factor())
+        return lambda layers: all(test(layers) for test in factors)
+
+    def factor():
+        token = take()
+        if token == "(":
+            test = expression()
+            assert (take() == ")"), "Unbalanced parentheses"
+            return test
+        if peek() == "contains":
+            take()
+            text = json.loads(take())
+            return lambda layers: any(type(value) is str and text in value for value in field_values(layers, token))
+        return lambda layers: len(field_values(layers, token)) > 0
+
+    test = expression()
+    assert (peek() is None), "Cannot parse display filter at {}".format(peek())
+    return test
+
+
+def iter_stdin_frames():
+    '''
+    :return: generator of the frames of a JSON trace read from the standard input, as soon as each is complete.
+    '''
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    pos = 0
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,[":
+            pos += 1
+        if pos < len(buf) and buf[pos] == "]":
+            return
+        try:
+            frame, pos = decoder.raw_decode(buf, pos)
+            yield frame
+            continue
+        except ValueError:
+            pass
+        data = os.read(sys.stdin.fileno(), 65536)
+        if not data:
+            return
+        buf = buf[pos:] + text.decode(data)
+        pos = 0
+
+
+def field_values(tree, name):
+    '''
+    :return: list of the values of a key anywhere inside the layers of a frame.
+    '''
+    values = []
+    items = tree if type(tree) is list else [tree]
+    for item in items:
+        if type(item) is not dict:
+            continue
+        for key, value in item.items():
+            if key == name:
+                values.extend(value if type(value) is list else [value])
+            if type(value) in (dict, list):
+                values.extend(field_values(value, name))
+    return values
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.glossary == "fields":
+        for abbrev, ftype in FIELDS.items():
+            print("F\t{}\t{}\t{}\t{}\t".format(abbrev, abbrev, ftype, abbrev.split(".")[0]))
+        sys.exit(0)
+    if args.output_format != "json":
+        print("fake_tshark: only -T json is supported", file=sys.stderr)
+        sys.exit(1)
+    if args.capture != "-" and not os.path.exists(args.capture):
+        print("fake_tshark: The file \"{}\" doesn't exist.".format(args.capture), file=sys.stderr)
+        sys.exit(2)
+    passes = parse_filter(args.display_filter)
+    delay = float(os.environ.get("FAKE_TSHARK_DELAY", "0"))
+    if args.capture == "-":
+        frames = iter_stdin_frames()
+    else:
+        with open(args.capture, "r") as capture:
+            frames = json.load(capture)
+    out = sys.stdout
+    out.write("[\n")
+    separator = ""
+    for frame in frames:
+        layers = frame["_source"]["layers"]
+        if passes is not None and not passes(layers):
+            continue
+        if args.export_protocols:
+            keep = args.export_protocols.split()
+            frame["_source"]["layers"] = {key: value for key, value in layers.items() if key in keep}
+        out.write(separator)
+        json.dump(frame, out, indent=2)
+        separator = ",\n"
+        out.flush()
+        if delay:
+            time.sleep(delay)
+    out.write("\n]\n")